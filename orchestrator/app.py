@@ -3,7 +3,7 @@ Flask API Server for DataSense NL2SQL
 Provides REST API endpoints for the frontend
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 import json
 import os
@@ -12,14 +12,32 @@ from dotenv import load_dotenv
 # Import our existing modules
 from query_executor import QueryExecutor
 from query_validator import QueryValidator
-from business_context import BUSINESS_CONTEXT
-import requests
-import tempfile
+from business_context import load_business_context, load_context_index
 import time
-import io
 import os
-import openpyxl
+from collections import namedtuple
+import query_store
 from query_store import create_token, get_query
+from row_counter import RowCounter
+from sql_cache import SQLCache, fingerprint
+from sql_parser import parse, tokenize
+from sql_repair import MAX_ATTEMPTS as REPAIR_MAX_ATTEMPTS, SQLRepairer, is_repairable
+from schema_catalog import SchemaCatalog
+from context_index import source_paths as context_source_paths
+from hot_reload import HotReloader
+from fast_path import ENABLED as FAST_PATH_ENABLED, DATASET_PATH, FastPathIndex, FastPathStats, load_examples
+from few_shot import FewShotIndex
+from prompt_layout import PROMPT_LAYOUT, build_prefix, build_suffix, catalogue_order, context_window
+from schema_index import SchemaIndex, estimate_tokens
+from llm_client import NUM_CTX, OllamaClient, LLMError
+from llm_scheduler import ModelScheduler, QueueFullError
+from llm_router import LLMRouter, parse_urls
+from singleflight import SingleFlight
+from result_cache import ResultCache
+from xlsx_stream import stream_xlsx
+from result_pager import CursorError, MAX_PAGE_SIZE, DEFAULT_PAGE_SIZE, ResultPager
+from result_serializer import ROW_SHAPES, columnar, rows_to_dicts
+from export_formats import FORMATS as EXPORT_FORMATS, ExportFormatError, check_format, prime, stream_export
 
 # Load environment variables
 load_dotenv()
@@ -34,149 +52,301 @@ USE_LORA = os.path.exists(LORA_ADAPTER_PATH)
 # API Configuration
 API_KEY = os.getenv("LLAMA_API_KEY")
 OLLAMA_API_URL = os.getenv("OLLAMA_API_URL", "http://192.168.11.10:11434/api/generate")
+# Several inference boxes: comma-separated generate URLs
+OLLAMA_API_URLS = parse_urls(os.getenv("OLLAMA_API_URLS", OLLAMA_API_URL))
+# Models clients may request, comma-separated (empty allows any model)
+ALLOWED_MODELS = [m.strip() for m in os.getenv("LLM_ALLOWED_MODELS", "").split(',') if m.strip()]
 
-# Initialize query executor and validator
+# Keep-alive Ollama client with retries, per-host circuit breakers,
+# latency-aware routing across hosts and per-model queues
+llm_router = LLMRouter(OLLAMA_API_URLS)
+llm_router.start_probes()
+ollama = OllamaClient(llm_router, scheduler=ModelScheduler(hosts=len(OLLAMA_API_URLS)))
+
+# Initialize query executor
 executor = QueryExecutor()
-validator = QueryValidator()
 
 # Preview / export configuration
 PREVIEW_LIMIT = int(os.getenv("PREVIEW_LIMIT", 50))
 PREVIEW_CHECK = PREVIEW_LIMIT + 1
 EXPORT_ROW_WARNING_THRESHOLD = int(os.getenv("EXPORT_ROW_WARNING_THRESHOLD", 10000))
 EXPORT_MAX_ROWS = int(os.getenv("EXPORT_MAX_ROWS", 200000))
+# CSV / NDJSON / Parquet / Arrow are not bound by spreadsheet limits
+EXPORT_MAX_ROWS_BULK = int(os.getenv("EXPORT_MAX_ROWS_BULK", 5000000))
+# Count rows in the background for results beyond the preview (per-request "count_rows")
+ROW_COUNT_AUTO = os.getenv("ROW_COUNT_AUTO", "0") not in ("0", "false", "False")
+# Seconds an export waits for a running row count before streaming anyway
+EXPORT_COUNT_WAIT = float(os.getenv("EXPORT_COUNT_WAIT", 2))
+
+# Cache of generated SQL keyed on (prompt, model, schema/context fingerprint)
+sql_cache = SQLCache()
+
+# Hit rate of the dataset fast path, kept across context reloads
+fast_path_stats = FastPathStats()
+
+# Coalesce concurrent identical LLM generations and preview executions
+llm_flight = SingleFlight()
+preview_flight = SingleFlight()
+
+
+SCHEMA_PATH = 'database_schema.json'
+BUSINESS_CONTEXT_PATH = 'datasense.md'
+
+# Everything compiled from the schema and business-context files. Built as a
+# whole and swapped in one assignment by the reloader; read it once per use.
+PromptContext = namedtuple('PromptContext', 'schema_text catalog schema_index business_context context_index prompt_prefix fast_path few_shot version')
 
 
 def load_schema():
-    """Load the fixed database schema from JSON file"""
+    """Load the fixed database schema from JSON file into a catalogue"""
     try:
-        with open('database_schema.json', 'r') as f:
-            schema_data = json.load(f)
-        return format_schema_for_prompt(schema_data), schema_data
+        catalog = SchemaCatalog.load(SCHEMA_PATH)
+        return catalog.full_prompt, catalog
     except FileNotFoundError:
         return "Schema file not found. Please ensure database_schema.json exists.", None
 
 
-def format_schema_for_prompt(schema_data):
-    """Convert JSON schema to human-readable format for LLM prompt"""
-    formatted = f"DATABASE: {schema_data['database']}\n\n"
-    formatted += "TABLES AND COLUMNS:\n\n"
-    
-    for table in schema_data['tables']:
-        formatted += f"Table: {table['name']}\n"
-        formatted += "Columns:\n"
-        
-        for col in table['columns']:
-            col_info = f"  - {col['name']} ({col['type']}"
-            
-            if col.get('primary_key'):
-                col_info += ", PRIMARY KEY"
-            if col.get('nullable') == False:
-                col_info += ", NOT NULL"
-            if col.get('unique'):
-                col_info += ", UNIQUE"
-            if 'default' in col:
-                col_info += f", DEFAULT {col['default']}"
-            if 'foreign_key' in col:
-                fk = col['foreign_key']
-                col_info += f", FOREIGN KEY -> {fk['table']}({fk['column']})"
-            if 'values' in col:
-                col_info += f", VALUES: {col['values']}"
-            
-            col_info += ")"
-            formatted += col_info + "\n"
-        
-        formatted += "\n"
-    
-    return formatted
+def load_training_examples(catalog):
+    """NL->SQL pairs from the training dataset that validate against the current schema"""
+    if not os.path.exists(DATASET_PATH):
+        return []
+    return load_examples(DATASET_PATH, QueryValidator(catalog, database=executor.db.database))
+
+
+def build_prompt_context(allow_missing_schema=False):
+    """
+    Compile the schema catalogue, retrieval indexes, business context and training examples.
+
+    A missing schema file raises FileNotFoundError, so a reload keeps the
+    previous context; only the startup build passes allow_missing_schema.
+    """
+    schema_text, catalog = load_schema()
+    if catalog is None and not allow_missing_schema:
+        raise FileNotFoundError(f"Schema file not found: {SCHEMA_PATH}")
+    business_context = load_business_context()
+    context_index = load_context_index()
+    examples = load_training_examples(catalog)
+    version = fingerprint(
+        catalog.version if catalog else '',
+        business_context,
+        context_index.version if context_index is not None else '',
+        # few-shot examples are part of the prompt
+        json.dumps(examples)
+    )
+    return PromptContext(
+        schema_text=schema_text,
+        catalog=catalog,
+        # Retrieval index used to send only the relevant tables to the LLM
+        schema_index=SchemaIndex(catalog) if catalog else None,
+        business_context=business_context,
+        context_index=context_index,
+        # Shared by every prompt until the next reload, so Ollama reuses its KV cache
+        prompt_prefix=build_prefix(schema_text, business_context),
+        # Question templates answered without the LLM
+        fast_path=FastPathIndex.from_examples(examples) if FAST_PATH_ENABLED and examples else None,
+        # Nearest examples added to each prompt
+        few_shot=FewShotIndex(examples),
+        version=version
+    )
+
+
+def watched_paths():
+    """Files the prompt context is compiled from"""
+    return [SCHEMA_PATH, BUSINESS_CONTEXT_PATH, DATASET_PATH] + context_source_paths()
+
+
+def apply_context_window(ctx):
+    """In the prefix layout, size num_ctx to the prefix unless OLLAMA_NUM_CTX is set"""
+    if PROMPT_LAYOUT == 'prefix' and NUM_CTX is None:
+        ollama.num_ctx = context_window(estimate_tokens(ctx.prompt_prefix))
+
+
+def on_context_swap(old, new):
+    """Point schema-dependent components at the new catalogue and drop stale caches"""
+    apply_context_window(new)
+    catalog = new.catalog
+    validator.columns_by_table = catalog.column_sets if catalog else None
+    validator.database = executor.db.database or (catalog.database if catalog else None)
+    repairer.catalog = catalog
+    pager.primary_keys = catalog.primary_keys if catalog else {}
+    result_cache.table_names = set(catalog.table_names) if catalog else set()
+    # Keys already include the version; clearing frees the old entries
+    sql_cache.clear()
+    result_cache.clear()
+    # The old context index is not closed: in-flight requests may still read it
+
+
+reloader = HotReloader(build_prompt_context, watched_paths, on_swap=on_context_swap,
+                       initial=build_prompt_context(allow_missing_schema=True))
+_initial = reloader.current
+apply_context_window(_initial)
+
+# Checks generated SELECTs against the schema's tables and columns
+# Tables may only be qualified with the connected database (DB_NAME)
+validator = QueryValidator(_initial.catalog, database=executor.db.database)
+repairer = SQLRepairer(_initial.catalog)
+
+# Preview results keyed on normalized SQL, expiring per referenced table
+result_cache = ResultCache(_initial.catalog.table_names if _initial.catalog else ())
+pager = ResultPager(executor.db, _initial.catalog.primary_keys if _initial.catalog else None)
+row_counter = RowCounter(executor.db)
+reloader.start()
+
+
+def prompt_context():
+    """The current compiled schema and business context"""
+    return reloader.current
+
+
+def prompt_stats():
+    ctx = prompt_context()
+    return {
+        'layout': PROMPT_LAYOUT,
+        'prefix_version': ctx.version,
+        'prefix_tokens': estimate_tokens(ctx.prompt_prefix),
+        'num_ctx': ollama.num_ctx,
+        'few_shot': ctx.few_shot.stats(),
+    }
+
+
+def context_fingerprint():
+    """Version of the schema and business context that cached SQL is keyed to"""
+    return reloader.current.version
+
+
+def build_prompt(query_text):
+    """Build the prompt: the context version's stable prefix, then the question-specific part"""
+    ctx = prompt_context()
+    # the training examples nearest to this question, within a token budget
+    examples_section = ctx.few_shot.prompt_section(query_text)
+
+    if PROMPT_LAYOUT == 'retrieval' and ctx.schema_index is not None:
+        # top-k tables by BM25 score plus FK neighbours, within a token budget,
+        # listed in catalogue order so equal selections give equal prompts
+        names = catalogue_order(ctx.catalog, ctx.schema_index.select_tables(query_text))
+        schema_section = ctx.schema_index.tables_section(names)
+        # only the business-context snippets relevant to this question
+        context_section = ctx.context_index.prompt_section(query_text) if ctx.context_index is not None else ''
+        return build_prefix(schema_section, context_section or ctx.business_context) + \
+            build_suffix(query_text, examples_section=examples_section)
+
+    # the prefix already holds the whole business context; no snippets on top
+    return ctx.prompt_prefix + build_suffix(query_text, examples_section=examples_section)
+
+
+def strip_code_fence(sql_query):
+    """Remove markdown ``` fence lines around a model response"""
+    sql_query = sql_query.strip()
+    if sql_query.startswith('```'):
+        lines = sql_query.split('\n')
+        sql_query = '\n'.join([line for line in lines if not line.startswith('```')])
+        sql_query = sql_query.strip()
+    return sql_query
+
+
+def extract_complete_sql(text):
+    """
+    Return the first complete SQL statement in partial model output, or None.
+
+    A statement is complete once a ``` fenced block is closed, or, for
+    unfenced output, at the first semicolon outside a string or comment.
+    """
+    fence = text.find('```')
+    if fence != -1:
+        body_start = text.find('\n', fence)
+        if body_start == -1:
+            return None
+        fence_end = text.find('```', body_start)
+        if fence_end == -1:
+            return None
+        return text[body_start + 1:fence_end].strip() or None
 
+    # strings, quoted names and comments (closed or not) are single tokens,
+    # so a ';' inside them never ends the statement early
+    for token in tokenize(text, keep_comments=True):
+        if token.kind == 'op' and token.value == ';':
+            return text[:token.end].strip()
+    return None
 
-DATABASE_SCHEMA, SCHEMA_JSON = load_schema()
 
+def fast_path_sql(natural_language_query):
+    """SQL from a matching training example, or None to ask the LLM"""
+    index = prompt_context().fast_path
+    if index is None:
+        return None
+    match, score = index.match(natural_language_query)
+    fast_path_stats.record(match, score, index.threshold)
+    return match.sql if match is not None else None
 
-def generate_sql(natural_language_query, model="llama3:8b"):
+
+def fast_path_health():
+    index = prompt_context().fast_path
+    stats = {'enabled': index is not None}
+    if index is not None:
+        stats.update(index.stats())
+    stats.update(fast_path_stats.stats())
+    return stats
+
+
+def sql_cache_key(natural_language_query, model):
+    return SQLCache.make_key(natural_language_query, model, context_fingerprint())
+
+
+def generate_sql(natural_language_query, model="llama3:8b", use_cache=True):
     """
     Convert natural language to SQL query using Ollama LLM
     
     Args:
         natural_language_query (str): The natural language question
         model (str): The Ollama model to use (default: llama3:8b)
+        use_cache (bool): Serve the result from the SQL cache and answer
+            questions matching a training example without the LLM (default: True)
     
     Returns:
-        str: Generated SQL query only
+        str: Generated SQL query only (cached by remember_sql once it has run)
     """
-    
-    # Build a shorter prompt: include only relevant schema tables when possible
-    def build_prompt(query_text: str) -> str:
-        # find table names mentioned in user query (case-insensitive)
-        q = query_text.lower()
-        matched_tables = []
-        try:
-            for t in SCHEMA_JSON.get('tables', []):
-                name = t.get('name', '').lower()
-                if name and (name in q or name.replace('_', ' ') in q):
-                    matched_tables.append(t)
-        except Exception:
-            matched_tables = []
-
-        schema_section = ''
-        if matched_tables:
-            for table in matched_tables:
-                schema_section += f"Table: {table['name']}\nColumns:\n"
-                for col in table.get('columns', []):
-                    schema_section += f"  - {col['name']} ({col.get('type','')})\n"
-                schema_section += "\n"
-        else:
-            # fallback to full schema
-            schema_section = DATABASE_SCHEMA
-
-        prompt = f"You are a SQL expert for DataSense.\n\n{BUSINESS_CONTEXT}\n\n{schema_section}\n" \
-                 f"Rules:\n1) Only use tables/columns present above.\n2) Return ONLY the SQL query, no explanation.\n\nUser question: {natural_language_query}\n\nSQL:"
-        return prompt
+    cache_key = sql_cache_key(natural_language_query, model)
+    if use_cache:
+        cached = sql_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        fast_sql = fast_path_sql(natural_language_query)
+        if fast_sql is not None:
+            return fast_sql
 
     prompt = build_prompt(natural_language_query)
 
-    # No caching: always request a fresh response from the model so
-    # the user receives up-to-date output (errors / transient states included).
+    try:
+        # identical questions already in flight share one generation
+        response_text, _ = llm_flight.do(cache_key, ollama.generate, model, prompt)
+        sql_query = strip_code_fence(response_text)
+    except QueueFullError:
+        # surfaced to the client as 429 with Retry-After
+        raise
+    except LLMError as e:
+        return f"Error: {e}"
+    return sql_query
 
-    # Retry logic with backoff
-    attempts = 3
-    backoff = 2
-    last_err = None
-    for attempt in range(1, attempts + 1):
-        try:
-            response = requests.post(OLLAMA_API_URL, json={"model": model, "prompt": prompt, "stream": False}, timeout=300)
-            if response.status_code == 200:
-                result = response.json()
-                if 'response' in result:
-                    sql_query = result['response'].strip()
-                    if sql_query.startswith('```'):
-                        lines = sql_query.split('\n')
-                        sql_query = '\n'.join([line for line in lines if not line.startswith('```')])
-                        sql_query = sql_query.strip()
-                    return sql_query
-                else:
-                    last_err = f"Unexpected response format (status 200)"
-                    break
-            else:
-                last_err = f"API returned status code {response.status_code}"
-                # if 5xx, retry
-                if 500 <= response.status_code < 600:
-                    pass
-                else:
-                    break
-        except requests.exceptions.Timeout as e:
-            last_err = f"Timeout: {e}"
-        except Exception as e:
-            last_err = str(e)
 
-        # wait before retrying
-        try:
-            import time
-            time.sleep(backoff * attempt)
-        except Exception:
-            pass
+def remember_sql(question, model, sql_query, success):
+    """Cache the SQL for `question` once it ran; after a failure, drop any cached entry"""
+    if not question:
+        return
+    cache_key = sql_cache_key(question, model)
+    if success:
+        sql_cache.remember(cache_key, sql_query)
+    else:
+        sql_cache.delete(cache_key)
+
 
-    return f"Error: {last_err or 'Unknown error'}"
+def queue_full_response(error):
+    """429 telling the client when the model's queue should have room again"""
+    response = jsonify({
+        'error': f'Error: {error}',
+        'retry_after': error.retry_after
+    })
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response, 429
 
 
 @app.route('/api/health', methods=['GET'])
@@ -189,39 +359,301 @@ def health_check():
             'status': 'healthy',
             'database': 'connected',
             'message': connection_status,
-            'lora_available': USE_LORA
+            'lora_available': USE_LORA,
+            'sql_cache': sql_cache.stats(),
+            'db_pool': executor.db.pool_stats(),
+            'preview_limits': executor.db.limit_stats(),
+            'llm': ollama.stats(),
+            'coalescing': {'llm': llm_flight.stats(), 'preview': preview_flight.stats()},
+            'result_cache': result_cache.stats(),
+            'pager': pager.stats(),
+            'row_counts': row_counter.stats(),
+            'sql_repair': repairer.stats(),
+            'token_store': query_store.stats(),
+            'context': reloader.stats(),
+            'prompt': prompt_stats(),
+            'fast_path': fast_path_health()
         }), 200
     else:
         return jsonify({
             'status': 'unhealthy',
             'database': 'disconnected',
             'message': connection_status,
-            'lora_available': USE_LORA
+            'lora_available': USE_LORA,
+            'sql_cache': sql_cache.stats(),
+            'db_pool': executor.db.pool_stats(),
+            'preview_limits': executor.db.limit_stats(),
+            'llm': ollama.stats(),
+            'coalescing': {'llm': llm_flight.stats(), 'preview': preview_flight.stats()},
+            'result_cache': result_cache.stats(),
+            'pager': pager.stats(),
+            'row_counts': row_counter.stats(),
+            'sql_repair': repairer.stats(),
+            'token_store': query_store.stats(),
+            'context': reloader.stats(),
+            'prompt': prompt_stats(),
+            'fast_path': fast_path_health()
         }), 500
 
 
 @app.route('/api/schema', methods=['GET'])
 def get_schema():
-    """Get database schema for display in frontend"""
-    if SCHEMA_JSON:
-        # Format schema in a readable way for frontend
-        schema_text = ""
-        for table in SCHEMA_JSON['tables']:
-            schema_text += f"\n{table['name']}:\n"
-            for col in table['columns']:
-                schema_text += f"  • {col['name']} ({col['type']})\n"
-        
-        return jsonify({
-            'schema': schema_text.strip(),
-            'database': SCHEMA_JSON['database'],
-            'tables': SCHEMA_JSON['tables']
-        }), 200
+    """Get database schema for display in frontend (precomputed, with ETag)"""
+    catalog = prompt_context().catalog
+    if catalog:
+        if request.if_none_match.contains(catalog.etag):
+            return Response(status=304, headers={'ETag': f'"{catalog.etag}"'})
+        return Response(catalog.api_payload, mimetype='application/json', headers={
+            'ETag': f'"{catalog.etag}"',
+            'Cache-Control': 'no-cache'
+        })
     else:
         return jsonify({
             'error': 'Schema not found'
         }), 500
 
 
+def run_preview(cleaned_query, use_cache=True):
+    """Preview (PREVIEW_CHECK rows) of a SELECT, cached and shared by concurrent identical queries"""
+    if use_cache:
+        cached = result_cache.get(cleaned_query)
+        if cached is not None:
+            rows, columns = cached
+            return True, rows, columns
+
+    result, shared = preview_flight.do(cleaned_query, executor.db.execute_query_with_limit, cleaned_query, PREVIEW_CHECK)
+    success, rows, columns = result
+    if success and not shared:
+        result_cache.set(cleaned_query, rows, columns)
+    return result
+
+
+def repair_schema_section(question, sql):
+    """Reduced schema for a repair prompt: the tables the failed SQL used plus the question's best matches."""
+    ctx = prompt_context()
+    if ctx.schema_index is None:
+        return ctx.schema_text
+    table_names = ctx.catalog.table_names
+    names = [table_names[name] for name in parse(sql).tables if name in table_names]
+    for name in ctx.schema_index.select_tables(question, top_k=2):
+        if name not in names:
+            names.append(name)
+    return ctx.schema_index.tables_section(names)
+
+
+def generate_repair(model, prompt):
+    """Model answer to a repair prompt, or None if the model call fails"""
+    try:
+        return ollama.generate(model, prompt)
+    except LLMError as e:
+        print(f"SQL repair prompt failed: {e}")
+        return None
+
+
+def corrected_sql(response_text):
+    """SQL from a repair answer; None for a missing or error answer"""
+    sql_query = strip_code_fence(response_text) if response_text else ''
+    return None if not sql_query or sql_query.lower().startswith('error') else sql_query
+
+
+def drive(steps, model):
+    """Run a repair generator, answering its repair prompts with the blocking client"""
+    kind, value = advance(steps)
+    while kind == 'prompt':
+        kind, value = advance(steps, generate_repair(model, value))
+    return value
+
+
+def advance(steps, answer=None):
+    """
+    Run `steps` up to its next repair prompt.
+
+    Returns:
+        tuple: ('prompt', prompt text) or ('done', result)
+    """
+    try:
+        return 'prompt', steps.send(answer)
+    except StopIteration as stop:
+        return 'done', stop.value
+
+
+def preview_with_repair(cleaned_query, question=None, model=None, use_cache=True):
+    """Blocking wrapper around preview_with_repair_steps"""
+    return drive(preview_with_repair_steps(cleaned_query, question, model, use_cache), model)
+
+
+def preview_with_repair_steps(cleaned_query, question=None, model=None, use_cache=True):
+    """
+    Validate and preview a generated SELECT, repairing it when it fails.
+
+    Unknown identifiers are first fuzzy-matched against the schema; if the
+    query is still rejected or MySQL reports a schema/syntax error and
+    `question` is given, the model is re-prompted with the error, up to
+    SQL_REPAIR_MAX_ATTEMPTS times.
+
+    A generator, so the model call stays with the caller: it yields each
+    repair prompt and expects the model's answer (None on failure) to be
+    sent back. The ASGI server awaits the answer on its event loop instead
+    of holding a DB worker thread during generation.
+
+    Returns (as the generator's return value):
+        tuple: (final cleaned SQL, success, rows or error message, columns,
+                repairs dict {"fixes": [...], "reprompts": n})
+    """
+    repairs = {'fixes': [], 'reprompts': 0}
+    while True:
+        cleaned_query, fixes = repairer.fix_identifiers(cleaned_query)
+        repairs['fixes'].extend(fixes)
+
+        is_safe, msg = validator.is_safe_query(cleaned_query)
+        if is_safe:
+            success, rows, columns = run_preview(cleaned_query, use_cache=use_cache)
+            if success:
+                if repairs['reprompts']:
+                    repairer.record_success()
+                return cleaned_query, True, rows, columns, repairs
+            cause, error = rows, f"Query execution failed: {rows}"
+        else:
+            cause, error = msg, f"Query rejected: {msg}"
+
+        if not question or repairs['reprompts'] >= REPAIR_MAX_ATTEMPTS or not is_repairable(cause):
+            return cleaned_query, False, error, None, repairs
+        prompt = repairer.repair_prompt(question, cleaned_query, cause, repair_schema_section(question, cleaned_query))
+        corrected = corrected_sql((yield prompt))
+        if corrected is None:
+            return cleaned_query, False, error, None, repairs
+        repairs['reprompts'] += 1
+        cleaned_query = validator.clean_query(corrected)
+
+
+def parse_query_request(data):
+    """
+    Validate a /api/query request body.
+
+    Returns:
+        tuple: (params dict or None, error message or None)
+    """
+    if not data or 'prompt' not in data:
+        return None, 'Missing "prompt" in request body'
+
+    natural_language_query = data['prompt'].strip()
+    if not natural_language_query:
+        return None, 'Prompt cannot be empty'
+
+    model = data.get('model', 'llama3:8b')  # default to llama3:8b
+    if not isinstance(model, str) or not model.strip():
+        return None, '"model" must be a non-empty string'
+    if ALLOWED_MODELS and model not in ALLOWED_MODELS:
+        return None, f'Unsupported "model" (use one of: {", ".join(ALLOWED_MODELS)})'
+
+    shape = data.get('shape', 'rows')
+    if shape not in ROW_SHAPES:
+        return None, f'Unsupported "shape" (use one of: {", ".join(ROW_SHAPES)})'
+
+    return {
+        'natural_language_query': natural_language_query,
+        'model': model,
+        'use_cache': data.get('use_cache', True) is not False,
+        'shape': shape,
+        'count_rows': bool(data.get('count_rows', ROW_COUNT_AUTO))
+    }, None
+
+
+def execute_generated_sql(sql_query, model, use_cache=True, shape='rows', count_rows=False, question=None):
+    """Blocking wrapper around execute_generated_sql_steps"""
+    return drive(execute_generated_sql_steps(sql_query, model, use_cache, shape, count_rows, question), model)
+
+
+def execute_generated_sql_steps(sql_query, model, use_cache=True, shape='rows', count_rows=False, question=None):
+    """
+    Validate and run SQL returned by the LLM, building the /api/query response.
+    `shape` selects row dicts ('rows') or typed column arrays ('columnar');
+    `count_rows` starts a background row count for results beyond the preview;
+    `question` enables re-prompting the model when the SQL fails.
+
+    A generator yielding repair prompts like preview_with_repair_steps.
+    Shared by the Flask view and the ASGI server (which runs the steps on
+    its DB executor), so it must not touch the Flask request context.
+
+    Returns (as the generator's return value):
+        tuple: (response payload dict, HTTP status)
+    """
+    # Check if it's an error message from LLM
+    if sql_query.startswith("ERROR:") or sql_query.startswith("Error:"):
+        return {
+            'error': sql_query,
+            'sql_query': None
+        }, 400
+
+    # Step 2: Clean and validate query
+    cleaned_query = validator.clean_query(sql_query)
+
+    # Step 3: Execute query (preview + possible export token)
+    # If it's a query (SELECT or WITH), perform a cheap preview using LIMIT (PREVIEW_CHECK)
+    if parse(cleaned_query).is_query:
+        cleaned_query, success, rows, columns, repairs = yield from preview_with_repair_steps(
+            cleaned_query, question, model, use_cache=use_cache)
+        repaired = bool(repairs['fixes'] or repairs['reprompts'])
+        # report the statement that was run (comments stripped, repairs applied)
+        sql_query = cleaned_query
+        # the next identical question gets the working SQL (repairs applied) from the cache
+        remember_sql(question, model, cleaned_query, success)
+        if not success:
+            return {
+                'error': rows,
+                'sql_query': sql_query
+            }, 400
+
+        # More than PREVIEW_LIMIT rows: return the preview plus an export token
+        has_more = len(rows) > PREVIEW_LIMIT
+        preview_rows = rows[:PREVIEW_LIMIT]
+
+        payload = {
+            'sql_query': sql_query,
+            'success': True,
+            'model_used': model,
+            'lora_trained': USE_LORA,
+            'has_more': has_more
+        }
+        if repaired:
+            payload['repairs'] = repairs
+        if shape == 'columnar':
+            payload.update(columnar(preview_rows, columns))
+            payload['result_shape'] = 'columnar'
+        else:
+            payload['results'] = rows_to_dicts(preview_rows, columns)
+            payload['columns'] = columns
+
+        if has_more:
+            payload['preview_count'] = len(preview_rows)
+            payload['row_count'] = f">{PREVIEW_LIMIT}"
+            # create a short-lived token for exporting the full result
+            payload['export_token'] = create_token(cleaned_query)
+            if count_rows:
+                started = row_counter.start(payload['export_token'], cleaned_query)
+                payload['row_count_status'] = 'pending' if started else 'skipped'
+        else:
+            payload['row_count'] = len(preview_rows)
+        return payload, 200
+    else:
+        # Non-SELECT query: run as before
+        sql_query = cleaned_query
+        success, data, columns = executor.db.execute_query(cleaned_query)
+        remember_sql(question, model, cleaned_query, success)
+        if not success:
+            return {
+                'sql_query': sql_query,
+                'error': data
+            }, 400
+        # drop cached previews over any table this statement may have written
+        result_cache.invalidate_tables(result_cache.tables_in(cleaned_query))
+        return {
+            'sql_query': sql_query,
+            'message': data,
+            'success': True
+        }, 200
+
+
 @app.route('/api/query', methods=['POST'])
 def process_query():
     """
@@ -230,7 +662,10 @@ def process_query():
     Request body:
     {
         "prompt": "Show me all distributors",
-        "model": "llama3:8b"  // optional, defaults to llama3:8b
+        "model": "llama3:8b",  // optional, defaults to llama3:8b
+        "use_cache": true,     // optional, set false to bypass the SQL and result caches and the fast path
+        "shape": "rows",       // optional, "columnar" returns typed column arrays
+        "count_rows": true     // optional, count rows beyond the preview in the background (default ROW_COUNT_AUTO, off)
     }
     
     Response:
@@ -240,123 +675,270 @@ def process_query():
         "columns": [...],
         "row_count": 10
     }
+
+    If the SQL had to be corrected, "sql_query" is the corrected query and
+    "repairs" lists the fixes. With "shape": "columnar", "results" is
+    replaced by "data" (one value array per column) and "column_types".
+    When a count was started, poll /api/query/count with the export token
+    for the size.
     """
     try:
-        data = request.get_json()
-        
-        if not data or 'prompt' not in data:
-            return jsonify({
-                'error': 'Missing "prompt" in request body'
-            }), 400
-        
-        natural_language_query = data['prompt'].strip()
-        model = data.get('model', 'llama3:8b')  # Get model from request, default to llama3:8b
-        
-        if not natural_language_query:
+        params, error = parse_query_request(request.get_json())
+        if error:
             return jsonify({
-                'error': 'Prompt cannot be empty'
+                'error': error
             }), 400
-        
+
         # Step 1: Generate SQL using LLM with selected model
-        sql_query = generate_sql(natural_language_query, model)
-        
-        # Check if it's an error message from LLM
-        if sql_query.startswith("ERROR:") or sql_query.startswith("Error:"):
-            return jsonify({
-                'error': sql_query,
-                'sql_query': None
-            }), 400
-        
-        # Step 2: Clean and validate query
-        cleaned_query = validator.clean_query(sql_query)
-        
-        # Step 3: Execute query (preview + possible export token)
-        # If it's a SELECT, perform a cheap preview using LIMIT (PREVIEW_CHECK)
-        if cleaned_query.strip().lower().startswith('select'):
-            success, rows, columns = executor.db.execute_query_with_limit(cleaned_query, PREVIEW_CHECK)
-            if not success:
-                return jsonify({
-                    'error': f"Query execution failed: {rows}",
-                    'sql_query': sql_query
-                }), 400
-
-            # If results are <= PREVIEW_LIMIT, return all rows like before
-            if len(rows) <= PREVIEW_LIMIT:
-                results = []
-                for row in rows:
-                    row_dict = {}
-                    for i, col in enumerate(columns):
-                        value = row[i]
-                        if value is None:
-                            row_dict[col] = None
-                        else:
-                            row_dict[col] = str(value) if not isinstance(value, (int, float, bool)) else value
-                    results.append(row_dict)
-
-                return jsonify({
-                    'sql_query': sql_query,
-                    'results': results,
-                    'columns': columns,
-                    'row_count': len(results),
-                    'success': True,
-                    'model_used': model,
-                    'lora_trained': USE_LORA,
-                    'has_more': False
-                }), 200
-
-            # Otherwise, we have more than PREVIEW_LIMIT rows. Return preview and a token.
-            preview_rows = rows[:PREVIEW_LIMIT]
-            results = []
-            for row in preview_rows:
-                row_dict = {}
-                for i, col in enumerate(columns):
-                    value = row[i]
-                    if value is None:
-                        row_dict[col] = None
-                    else:
-                        row_dict[col] = str(value) if not isinstance(value, (int, float, bool)) else value
-                results.append(row_dict)
+        sql_query = generate_sql(params['natural_language_query'], params['model'], use_cache=params['use_cache'])
 
-            # create a short-lived token for exporting the full result
-            token = create_token(cleaned_query)
+        payload, status = execute_generated_sql(sql_query, params['model'], use_cache=params['use_cache'],
+                                                shape=params['shape'], count_rows=params['count_rows'],
+                                                question=params['natural_language_query'])
+        return jsonify(payload), status
 
-            return jsonify({
-                'sql_query': sql_query,
-                'results': results,
-                'columns': columns,
-                'preview_count': len(results),
-                'row_count': f">{PREVIEW_LIMIT}",
-                'success': True,
-                'model_used': model,
-                'lora_trained': USE_LORA,
-                'has_more': True,
-                'export_token': token
-            }), 200
-        else:
-            # Non-SELECT query: run as before
-            success, data, columns = executor.db.execute_query(cleaned_query)
-            if not success:
-                return jsonify({
-                    'sql_query': sql_query,
-                    'error': data
-                }), 400
-            return jsonify({
-                'sql_query': sql_query,
-                'message': data,
-                'success': True
-            }), 200
-    
+    except QueueFullError as e:
+        return queue_full_response(e)
     except Exception as e:
         return jsonify({
             'error': f'Server error: {str(e)}'
         }), 500
 
 
+def sse_event(event, data):
+    """Format one Server-Sent Event frame with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+@app.route('/api/query/stream', methods=['POST'])
+def process_query_stream():
+    """
+    Streaming variant of /api/query using Server-Sent Events.
+
+    Request body is the same as /api/query. Events, in order:
+        start    {"model": ...}
+        token    {"text": ...}            // LLM fragments as they arrive
+        sql      {"sql_query": ..., "cached": bool, "fast_path": bool}
+        repair   {"sql_query": ..., "repairs": {...}}  // only if the SQL was corrected
+        columns  {"columns": [...]}
+        row      {<column>: <value>, ...}  // one per preview row
+        done     {"row_count": ..., "has_more": bool, "export_token": ...}
+    An `error` event ends the stream early. Generation is stopped as soon as
+    a complete SQL statement has been received.
+    """
+    params, error = parse_query_request(request.get_json(silent=True))
+    if error:
+        return jsonify({
+            'error': error
+        }), 400
+
+    natural_language_query = params['natural_language_query']
+    model = params['model']
+    use_cache = params['use_cache']
+
+    cache_key = sql_cache_key(natural_language_query, model)
+    cached_sql = sql_cache.get(cache_key) if use_cache else None
+    fast_sql = fast_path_sql(natural_language_query) if use_cache and cached_sql is None else None
+    # Reject before the stream starts while the model's queue is full
+    if cached_sql is None and fast_sql is None and ollama.scheduler is not None and ollama.scheduler.is_full(model):
+        return queue_full_response(QueueFullError(
+            f"Too many queued requests for model '{model}'", ollama.scheduler.retry_after(model)))
+
+    def events():
+        yield sse_event('start', {'model': model})
+
+        sql_query = cached_sql or fast_sql
+        cached = cached_sql is not None
+
+        if sql_query is None:
+            text = ''
+            tokens = ollama.stream(model, build_prompt(natural_language_query))
+            try:
+                for token in tokens:
+                    text += token
+                    yield sse_event('token', {'text': token})
+                    sql_query = extract_complete_sql(text)
+                    if sql_query:
+                        break
+            except Exception as e:
+                yield sse_event('error', {'error': f'Error: {e}', 'sql_query': None})
+                return
+            finally:
+                # stops generation on the Ollama side when we break early
+                tokens.close()
+
+            if not sql_query:
+                sql_query = strip_code_fence(text)
+            if not sql_query or sql_query.lower().startswith('error'):
+                yield sse_event('error', {'error': sql_query or 'Error: Empty response from model', 'sql_query': None})
+                return
+
+        # the statement as it will be run (comments stripped)
+        cleaned_query = validator.clean_query(sql_query)
+        yield sse_event('sql', {'sql_query': cleaned_query, 'cached': cached, 'fast_path': fast_sql is not None})
+
+        if not parse(cleaned_query).is_query:
+            yield sse_event('error', {'error': 'Only SELECT queries can be streamed', 'sql_query': cleaned_query})
+            return
+        cleaned_query, success, rows, columns, repairs = preview_with_repair(
+            cleaned_query, natural_language_query, model, use_cache=use_cache)
+        remember_sql(natural_language_query, model, cleaned_query, success)
+        if repairs['fixes'] or repairs['reprompts']:
+            yield sse_event('repair', {'sql_query': cleaned_query, 'repairs': repairs})
+        if not success:
+            yield sse_event('error', {'error': rows, 'sql_query': cleaned_query})
+            return
+
+        yield sse_event('columns', {'columns': columns})
+        preview = rows_to_dicts(rows[:PREVIEW_LIMIT], columns)
+        for row in preview:
+            yield sse_event('row', row)
+
+        done = {
+            'success': True,
+            'model_used': model,
+            'lora_trained': USE_LORA,
+            'has_more': len(rows) > PREVIEW_LIMIT
+        }
+        if done['has_more']:
+            done['preview_count'] = len(preview)
+            done['row_count'] = f">{PREVIEW_LIMIT}"
+            done['export_token'] = create_token(cleaned_query)
+            if params['count_rows']:
+                started = row_counter.start(done['export_token'], cleaned_query)
+                done['row_count_status'] = 'pending' if started else 'skipped'
+        else:
+            done['row_count'] = len(preview)
+        yield sse_event('done', done)
+
+    headers = {
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    }
+    return Response(stream_with_context(events()), mimetype='text/event-stream', headers=headers)
+
+
+@app.route('/api/query/page', methods=['POST'])
+def query_page():
+    """
+    Fetch further pages of a result that was cut off at the preview.
+    Expects JSON body:
+    {
+        "token": "<export_token>",
+        "cursor": "<next_cursor>",   // optional, omit for the first page
+        "page_size": 100,            // optional
+        "shape": "rows"              // optional, or "columnar"
+    }
+
+    Returns: the page in the /api/query result shape plus "has_more",
+    "next_cursor" and "pagination" ("keyset" or "cursor"). Keyset pages are
+    ordered by the table's primary key.
+    """
+    try:
+        data = request.get_json()
+
+        if not data or 'token' not in data:
+            return jsonify({'error': 'Missing "token" in request body'}), 400
+
+        shape = data.get('shape', 'rows')
+        if shape not in ROW_SHAPES:
+            return jsonify({'error': f'Unsupported "shape" (use one of: {", ".join(ROW_SHAPES)})'}), 400
+
+        try:
+            page_size = int(data.get('page_size', DEFAULT_PAGE_SIZE))
+        except (TypeError, ValueError):
+            return jsonify({'error': '"page_size" must be an integer'}), 400
+        if not 1 <= page_size <= MAX_PAGE_SIZE:
+            return jsonify({'error': f'"page_size" must be between 1 and {MAX_PAGE_SIZE}'}), 400
+
+        token = data['token']
+        item = get_query(token)
+        if not item:
+            return jsonify({'error': 'Invalid or expired token'}), 400
+
+        cleaned = validator.clean_query(item.get('sql'))
+        is_safe, msg = validator.is_safe_query(cleaned)
+        if not is_safe:
+            return jsonify({'error': 'Query not allowed', 'reason': msg}), 400
+
+        try:
+            success, page = pager.page(token, cleaned, data.get('cursor'), page_size)
+        except CursorError as e:
+            return jsonify({'error': str(e)}), 400
+        if not success:
+            return jsonify({'error': f'Error executing SQL: {page}', 'success': False}), 400
+
+        payload = {
+            'success': True,
+            'has_more': page['has_more'],
+            'next_cursor': page['next_cursor'],
+            'pagination': page['pagination'],
+            'row_count': len(page['rows'])
+        }
+        if shape == 'columnar':
+            payload.update(columnar(page['rows'], page['columns']))
+            payload['result_shape'] = 'columnar'
+        else:
+            payload['results'] = rows_to_dicts(page['rows'], page['columns'])
+            payload['columns'] = page['columns']
+        return jsonify(payload), 200
+
+    except Exception as e:
+        return jsonify({'error': f'Server error: {str(e)}'}), 500
+
+
+@app.route('/api/query/count', methods=['POST'])
+def query_count():
+    """
+    Row count for a result that was cut off at the preview.
+    Expects JSON body: { "token": "<export_token>", "wait": 0 }
+    Starts a count if none was requested with the query; "wait" gives a
+    running count up to that many seconds (max 30) to finish.
+
+    Returns: { "status": "pending|exact|estimated|failed", "rows": ..., "elapsed_ms": ... }
+    or { "status": "skipped" } when too many counts are already running; ask again later.
+    """
+    try:
+        data = request.get_json()
+
+        if not data or 'token' not in data:
+            return jsonify({'error': 'Missing "token" in request body'}), 400
+
+        token = data['token']
+        item = get_query(token)
+        if not item:
+            return jsonify({'error': 'Invalid or expired token'}), 400
+
+        try:
+            wait = min(max(float(data.get('wait', 0)), 0), 30)
+        except (TypeError, ValueError):
+            return jsonify({'error': '"wait" must be a number of seconds'}), 400
+
+        if row_counter.get(token) is None:
+            cleaned = validator.clean_query(item.get('sql'))
+            is_safe, msg = validator.is_safe_query(cleaned)
+            if not is_safe:
+                return jsonify({'error': 'Query not allowed', 'reason': msg}), 400
+            if not row_counter.start(token, cleaned):
+                return jsonify({'status': 'skipped', 'rows': None}), 200
+
+        return jsonify(row_counter.wait(token, wait) or {'status': 'failed', 'rows': None}), 200
+
+    except Exception as e:
+        return jsonify({'error': f'Server error: {str(e)}'}), 500
+
+
 @app.route('/api/export', methods=['POST'])
-def export_csv():
+def export_results():
     """
-    Export full query result as XLSX.
-    Expects JSON body: { "token": "<export_token>" }
+    Export the full query result, streamed as it is read from the database.
+    Expects JSON body: { "token": "<export_token>", "format": "xlsx" }
+    where format is one of xlsx (default), csv, ndjson, parquet, arrow.
+
+    An export cut off at the row limit ends with a marker: a last row in
+    xlsx/csv, a {"_truncated": true} line in ndjson, 'datasense.truncated_at'
+    file metadata in parquet and an empty final record batch with that
+    custom metadata in arrow.
     """
     try:
         data = request.get_json()
@@ -364,6 +946,12 @@ def export_csv():
         if not data or 'token' not in data:
             return jsonify({'error': 'Missing "token" in request body'}), 400
 
+        fmt = str(data.get('format') or 'xlsx').lower()
+        try:
+            check_format(fmt)
+        except ExportFormatError as e:
+            return jsonify({'error': str(e)}), 400
+
         token = data['token']
         item = get_query(token)
         if not item:
@@ -376,58 +964,50 @@ def export_csv():
         if not is_safe:
             return jsonify({'error': 'Query not allowed for export', 'reason': msg}), 400
 
+        max_rows = EXPORT_MAX_ROWS if fmt == 'xlsx' else EXPORT_MAX_ROWS_BULK
+        # Reject before streaming when an exact count is known to be over the limit
+        count = row_counter.wait(token, EXPORT_COUNT_WAIT)
+        if count and count['status'] == 'exact' and count['rows'] > max_rows:
+            return jsonify({
+                'error': f"Result has {count['rows']} rows, more than the {max_rows} row limit for {fmt} export",
+                'row_count': count['rows'],
+                'max_rows': max_rows
+            }), 413
+
         # Stream rows using server-side cursor
         columns, rows_gen = executor.db.stream_query_with_columns(cleaned)
 
-        # Build XLSX in a temporary file using openpyxl write-only mode
-        tmp = tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx')
-        tmp_path = tmp.name
-        tmp.close()
-
-        wb = openpyxl.Workbook(write_only=True)
-        ws = wb.create_sheet(title='Export')
-        # Write header
-        ws.append(columns)
-
-        total = 0
-        for row in rows_gen:
-            total += 1
-            if total > EXPORT_MAX_ROWS:
-                # stop and return error to client
-                wb.close()
-                try:
-                    os.unlink(tmp_path)
-                except Exception:
-                    pass
-                return jsonify({'error': f'Export exceeds maximum allowed rows ({EXPORT_MAX_ROWS})'}), 413
-            # convert values to safe types (strings for blobs etc)
-            safe_row = [None if v is None else (v if isinstance(v, (int, float, bool)) else str(v)) for v in row]
-            ws.append(safe_row)
-
-        wb.save(tmp_path)
-        wb.close()
-
-        # Stream file and remove after streaming
-        filename = f"export_{int(time.time())}.xlsx"
-
-        def stream_file(path):
+        def limited_rows():
+            # The response has already started when the limit is hit, so the
+            # workbook is closed cleanly with a marker row instead of a 413.
+            for total, row in enumerate(rows_gen, start=1):
+                if total > max_rows:
+                    yield [f'Export truncated: more than {max_rows} rows']
+                    break
+                yield row
+
+        def body():
             try:
-                with open(path, 'rb') as f:
-                    chunk = f.read(8192)
-                    while chunk:
-                        yield chunk
-                        chunk = f.read(8192)
+                if fmt == 'xlsx':
+                    yield from stream_xlsx(columns, limited_rows(), sheet_title='Export')
+                else:
+                    yield from stream_export(fmt, columns, rows_gen.description, rows_gen.batches(), max_rows,
+                                             rows_gen.unsigned)
             finally:
-                try:
-                    os.unlink(path)
-                except Exception:
-                    pass
+                rows_gen.close()
 
-        from flask import Response
+        mimetype, extension = EXPORT_FORMATS[fmt]
+        filename = f"export_{int(time.time())}.{extension}"
         headers = {
-            'Content-Disposition': f'attachment; filename="{filename}"'
+            'Content-Disposition': f'attachment; filename="{filename}"',
+            'X-Export-Max-Rows': str(max_rows)
         }
-        return Response(stream_file(tmp_path), mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', headers=headers)
+        if count and count['rows'] is not None:
+            headers['X-Export-Row-Count'] = str(count['rows'])
+            headers['X-Export-Row-Count-Status'] = count['status']
+        # Errors up to the first chunk (e.g. an unsupported column type) still
+        # get a JSON error instead of a truncated download
+        return Response(prime(body()), mimetype=mimetype, headers=headers)
 
     except Exception as e:
         return jsonify({'error': f'Export error: {str(e)}'}), 500
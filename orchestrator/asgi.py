@@ -0,0 +1,203 @@
+"""
+ASGI entry point for the DataSense API
+
+Serves /api/query natively on asyncio: the Ollama call goes through a pooled
+httpx.AsyncClient and database work runs on a bounded thread pool, so one
+process can hold hundreds of in-flight questions while they wait on the LLM
+instead of parking a worker thread on each. Every other route (health,
+schema, export, streaming, CORS preflight) is delegated to the Flask app.
+
+Run with:
+    uvicorn asgi:app --host 0.0.0.0 --port 5001
+"""
+
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+from asgiref.wsgi import WsgiToAsgi
+
+from app import (
+    app as flask_app,
+    ollama,
+    build_prompt,
+    advance,
+    execute_generated_sql_steps,
+    fast_path_sql,
+    parse_query_request,
+    sql_cache,
+    sql_cache_key,
+    strip_code_fence,
+)
+from llm_client import CONNECT_TIMEOUT, READ_TIMEOUT, LLMError
+from llm_scheduler import QueueFullError
+from singleflight import AsyncSingleFlight
+
+# DB calls are blocking (pymysql); cap them at the size of the connection pool
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", os.getenv("DB_POOL_MAX_SIZE", 10)))
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("OLLAMA_MAX_CONNECTIONS", 200))
+OLLAMA_MAX_KEEPALIVE = int(os.getenv("OLLAMA_MAX_KEEPALIVE", 20))
+
+db_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix='datasense-db')
+wsgi_app = WsgiToAsgi(flask_app)
+
+_state = {'client': None}
+
+# Identical questions in flight on the event loop share one generation
+llm_flight = AsyncSingleFlight()
+
+
+def get_client():
+    """Shared AsyncClient, created on first use inside the running loop"""
+    if _state['client'] is None:
+        _state['client'] = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=OLLAMA_MAX_CONNECTIONS,
+                                max_keepalive_connections=OLLAMA_MAX_KEEPALIVE),
+            timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+        )
+    return _state['client']
+
+
+async def agenerate_sql(natural_language_query, model="llama3:8b", use_cache=True):
+    """Async counterpart of app.generate_sql (same cache, fast path, prompt and retries)"""
+    cache_key = sql_cache_key(natural_language_query, model)
+    if use_cache:
+        cached = sql_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        # in-process template match, cheap enough to run on the loop
+        fast_sql = fast_path_sql(natural_language_query)
+        if fast_sql is not None:
+            return fast_sql
+
+    sql_query, _ = await llm_flight.do(cache_key, call_ollama, build_prompt(natural_language_query), model)
+    return sql_query
+
+
+async def call_ollama(prompt, model):
+    """Generate SQL; failures are returned as "Error: ..." strings (cached once it has run).
+
+    QueueFullError is raised so the endpoint can answer 429.
+    """
+    try:
+        response_text = await ollama_generate(model, prompt)
+    except QueueFullError:
+        raise
+    except LLMError as e:
+        return f"Error: {e}"
+    return strip_code_fence(response_text)
+
+
+async def ollama_generate(model, prompt):
+    """Completion text for `prompt`; raises LLMError.
+
+    Uses the sync client's router and scheduler, so both servers see the
+    same backend breakers, load, latency and per-model queues.
+    """
+    return await ollama.agenerate(model, prompt, get_client())
+
+
+async def generate_repair(model, prompt):
+    """Async counterpart of app.generate_repair"""
+    try:
+        return await ollama_generate(model, prompt)
+    except LLMError as e:
+        print(f"SQL repair prompt failed: {e}")
+        return None
+
+
+async def read_json(receive):
+    """Read the full request body and decode it as JSON (None if invalid)"""
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            break
+    try:
+        return json.loads(body or b'null')
+    except ValueError:
+        return None
+
+
+async def send_json(send, payload, status, headers=()):
+    body = json.dumps(payload, default=str).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(body)).encode()),
+            # match flask-cors defaults used by the Flask routes
+            (b'access-control-allow-origin', b'*'),
+            *headers,
+        ],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def query_endpoint(scope, receive, send):
+    """POST /api/query — same contract as app.process_query"""
+    try:
+        params, error = parse_query_request(await read_json(receive))
+        if error:
+            await send_json(send, {'error': error}, 400)
+            return
+
+        sql_query = await agenerate_sql(params['natural_language_query'], params['model'],
+                                        use_cache=params['use_cache'])
+
+        # DB work runs on the executor; repair prompts are awaited here on the
+        # loop so a slow model never holds one of the DB worker threads
+        loop = asyncio.get_running_loop()
+        steps = execute_generated_sql_steps(sql_query, params['model'], params['use_cache'], params['shape'],
+                                            params['count_rows'], params['natural_language_query'])
+        kind, value = await loop.run_in_executor(db_executor, advance, steps)
+        while kind == 'prompt':
+            answer = await generate_repair(params['model'], value)
+            kind, value = await loop.run_in_executor(db_executor, advance, steps, answer)
+        payload, status = value
+        await send_json(send, payload, status)
+    except QueueFullError as e:
+        await send_json(send, {'error': f'Error: {e}', 'retry_after': e.retry_after}, 429,
+                        [(b'retry-after', str(e.retry_after).encode())])
+    except Exception as e:
+        await send_json(send, {'error': f'Server error: {str(e)}'}, 500)
+
+
+ROUTES = {
+    ('POST', '/api/query'): query_endpoint,
+}
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if _state['client'] is not None:
+                await _state['client'].aclose()
+                _state['client'] = None
+            db_executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    handler = ROUTES.get((scope.get('method'), scope.get('path'))) if scope['type'] == 'http' else None
+    if handler is not None:
+        await handler(scope, receive, send)
+    else:
+        await wsgi_app(scope, receive, send)
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    uvicorn.run(app, host='0.0.0.0', port=5001)
@@ -0,0 +1,99 @@
+"""
+Export throughput benchmark
+Compares the old XLSX export (openpyxl write-only workbook saved to a temp
+file, then re-read in 8 KB chunks) with the streaming writer in
+xlsx_stream.py on synthetic rows shaped like an invoice extract.
+
+Each mode runs in its own subprocess so peak RSS is measured independently.
+
+Usage:
+    python bench_export.py [rows] [columns]
+"""
+
+import datetime
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from decimal import Decimal
+
+
+def synthetic_rows(n_rows, n_cols):
+    base = datetime.datetime(2024, 1, 1)
+    for i in range(n_rows):
+        row = []
+        for c in range(n_cols):
+            kind = c % 5
+            if kind == 0:
+                row.append(i * n_cols + c)
+            elif kind == 1:
+                row.append(Decimal(i % 10000) / 100)
+            elif kind == 2:
+                row.append(base + datetime.timedelta(minutes=i))
+            elif kind == 3:
+                row.append(f"Distributor {i % 500} - Mango Cup 100ml")
+            else:
+                row.append(None if i % 7 == 0 else 'fully_delivered')
+        yield tuple(row)
+
+
+def run_openpyxl(columns, rows):
+    """The pre-streaming export path from app.export_csv"""
+    import openpyxl
+
+    tmp = tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx')
+    tmp_path = tmp.name
+    tmp.close()
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet(title='Export')
+    ws.append(columns)
+    for row in rows:
+        ws.append([None if v is None else (v if isinstance(v, (int, float, bool)) else str(v)) for v in row])
+    wb.save(tmp_path)
+    wb.close()
+    try:
+        with open(tmp_path, 'rb') as f:
+            chunk = f.read(8192)
+            while chunk:
+                yield chunk
+                chunk = f.read(8192)
+    finally:
+        os.unlink(tmp_path)
+
+
+def run_stream(columns, rows):
+    from xlsx_stream import stream_xlsx
+    return stream_xlsx(columns, rows)
+
+
+def measure(mode, n_rows, n_cols):
+    columns = [f"col_{c}" for c in range(n_cols)]
+    producer = {'openpyxl': run_openpyxl, 'stream': run_stream}[mode]
+
+    start = time.perf_counter()
+    first_byte = None
+    total_bytes = 0
+    for chunk in producer(columns, synthetic_rows(n_rows, n_cols)):
+        if first_byte is None:
+            first_byte = time.perf_counter() - start
+        total_bytes += len(chunk)
+    elapsed = time.perf_counter() - start
+
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"{mode:<9} {n_rows / elapsed:>12,.0f} {elapsed:>9.2f} {first_byte:>10.3f} "
+          f"{peak_kb / 1024:>10.1f} {total_bytes / 1e6:>9.1f}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--mode':
+        measure(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]))
+        sys.exit(0)
+
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    n_cols = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    print(f"Exporting {n_rows:,} rows x {n_cols} columns")
+    print(f"{'mode':<9} {'rows/s':>12} {'total s':>9} {'ttfb s':>10} {'peak MB':>10} {'size MB':>9}")
+    for mode in ('openpyxl', 'stream'):
+        subprocess.run([sys.executable, __file__, '--mode', mode, str(n_rows), str(n_cols)], check=True)
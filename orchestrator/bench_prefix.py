@@ -0,0 +1,145 @@
+"""
+Prompt prefix reuse benchmark
+Measures time-to-first-token for the training questions against a local mock
+Ollama server that, like Ollama, keeps the last prompt of each model and only
+prefills the characters after the prefix a new prompt shares with it (at
+PREFILL tokens per second, ~4 characters per token). Prompts longer than
+options.num_ctx (Ollama's default, 2048 tokens, when unset) are cut from
+the front, as Ollama does, which loses the shared prefix. Four layouts are
+compared:
+
+* retrieval, score order - selected tables in BM25 score order
+* retrieval, catalogue order - the same tables in schema order (default)
+* prefix, default num_ctx - the stable prefix from prompt_layout, question last
+* prefix - the same with num_ctx from prompt_layout.context_window
+
+Usage:
+    python bench_prefix.py [questions] [prefill_tokens_per_s]
+"""
+
+import json
+import os
+import re
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from business_context import load_business_context, load_context_index
+from llm_client import OllamaClient
+from llm_router import LLMRouter
+from prompt_layout import build_prefix, build_suffix, catalogue_order, context_window
+from schema_catalog import SchemaCatalog
+from schema_index import SchemaIndex, estimate_tokens
+
+MODEL = 'llama3:8b'
+RESPONSE = ['SELECT', ' *', ' FROM', ' distributors', ';']
+DEFAULT_NUM_CTX = 2048
+
+
+def load_questions(path=os.path.join('training', 'dataset.jsonl')):
+    questions = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            match = re.search(r'QUESTION: (.*)', json.loads(line)['prompt'])
+            if match:
+                questions.append(match.group(1).strip())
+    return questions
+
+
+def common_prefix(a, b):
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+def mock_server(prefill_tokens_per_s):
+    """Mock /api/generate on an ephemeral port; returns (server, stats)."""
+    cache = {}
+    stats = {'prompt_chars': 0, 'reused_chars': 0, 'truncated': 0}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            prompt = body['prompt']
+            window = body.get('options', {}).get('num_ctx', DEFAULT_NUM_CTX) * 4
+            if len(prompt) > window:
+                stats['truncated'] += 1
+                prompt = prompt[-window:]
+            with lock:
+                reused = common_prefix(cache.get(body['model'], ''), prompt)
+                cache[body['model']] = prompt
+                stats['prompt_chars'] += len(prompt)
+                stats['reused_chars'] += reused
+            time.sleep((len(prompt) - reused) / 4 / prefill_tokens_per_s)
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson')
+            self.end_headers()
+            for token in RESPONSE:
+                self.wfile.write(json.dumps({'response': token, 'done': False}).encode() + b'\n')
+                self.wfile.flush()
+                time.sleep(0.002)
+            self.wfile.write(json.dumps({'response': '', 'done': True}).encode() + b'\n')
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, stats
+
+
+def time_to_first_token(client, prompt):
+    start = time.perf_counter()
+    tokens = client.stream(MODEL, prompt)
+    next(tokens)
+    elapsed = time.perf_counter() - start
+    tokens.close()
+    return elapsed
+
+
+if __name__ == '__main__':
+    n_questions = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    prefill = float(sys.argv[2]) if len(sys.argv) > 2 else 500
+
+    catalog = SchemaCatalog.load('database_schema.json')
+    schema_index = SchemaIndex(catalog)
+    business_context = load_business_context()
+    context_index = load_context_index()
+    prefix = build_prefix(catalog.full_prompt, business_context)
+
+    def context_for(q):
+        return context_index.prompt_section(q) if context_index is not None else business_context
+
+    num_ctx = context_window(estimate_tokens(prefix))
+    layouts = [
+        ("retrieval, score order", None,
+         lambda q: build_prefix(schema_index.prompt_section(q), context_for(q)) + build_suffix(q)),
+        ("retrieval, catalogue order", None,
+         lambda q: build_prefix(schema_index.tables_section(
+             catalogue_order(catalog, schema_index.select_tables(q))), context_for(q)) + build_suffix(q)),
+        ("prefix, default num_ctx", None, lambda q: prefix + build_suffix(q)),
+        (f"prefix, num_ctx {num_ctx}", num_ctx, lambda q: prefix + build_suffix(q)),
+    ]
+
+    questions = load_questions()[:n_questions]
+    print(f"{len(questions)} questions, mock prefill {prefill:.0f} tokens/s")
+    print(f"{'layout':<28} {'prompt tok':>10} {'cut':>4} {'reused':>7} {'median ms':>10} {'p95 ms':>8}")
+    for name, layout_num_ctx, build in layouts:
+        server, stats = mock_server(prefill)
+        url = f"http://127.0.0.1:{server.server_address[1]}/api/generate"
+        client = OllamaClient(LLMRouter([url], probe_interval=0), num_ctx=layout_num_ctx)
+        prompts = [build(q) for q in questions]
+        time_to_first_token(client, prompts[-1])      # model loaded with some earlier prompt
+        stats.update(prompt_chars=0, reused_chars=0, truncated=0)
+        times = sorted(time_to_first_token(client, p) for p in prompts)
+        p95 = times[min(len(times) - 1, int(len(times) * 0.95))]
+        print(f"{name:<28} {statistics.mean(len(p) for p in prompts) / 4:>10.0f} {stats['truncated']:>4} "
+              f"{stats['reused_chars'] / max(1, stats['prompt_chars']):>6.0%} "
+              f"{statistics.median(times) * 1000:>10.1f} {p95 * 1000:>8.1f}")
+        server.shutdown()
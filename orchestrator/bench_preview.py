@@ -0,0 +1,72 @@
+"""
+Preview LIMIT benchmark
+Runs typical preview queries over the schema's large tables against the
+configured database (DB_* environment variables) twice: wrapped in a derived
+table as the preview path used to do, and with the LIMIT pushed into the
+outermost SELECT by sql_rewrite.push_limit. Reports the median wall time of
+each and the strategy push_limit chose.
+
+Usage:
+    python bench_preview.py [repetitions] [limit]
+"""
+
+import statistics
+import sys
+import time
+
+from db_connector import DatabaseConnector
+from sql_rewrite import push_limit, wrap_limit
+
+QUERIES = [
+    ("inventory by product",
+     "SELECT product_id, SUM(quantity) AS total_qty FROM inventory_transactions "
+     "GROUP BY product_id ORDER BY total_qty DESC"),
+    ("latest inventory moves",
+     "SELECT * FROM inventory_transactions ORDER BY tx_date DESC"),
+    ("invoice totals by month",
+     "SELECT DATE_FORMAT(invoice_date, '%Y-%m') AS month, SUM(total_amount) AS total "
+     "FROM invoices GROUP BY month ORDER BY month DESC"),
+    ("largest invoice lines",
+     "SELECT ii.invoice_id, p.name, ii.quantity_invoiced * ii.price_per_unit AS line_total "
+     "FROM invoice_items ii JOIN products p ON p.product_id = ii.product_id "
+     "ORDER BY line_total DESC"),
+    ("orders per distributor",
+     "SELECT d.name, COUNT(*) AS orders, SUM(o.total_amount) AS amount FROM orders o "
+     "JOIN distributors d ON d.distributor_id = o.distributor_id GROUP BY d.name ORDER BY amount DESC"),
+    ("detailed orders (wide)",
+     "SELECT * FROM detailed_order ORDER BY ord_date DESC"),
+    ("existing limit",
+     "SELECT * FROM order_items ORDER BY order_item_id DESC LIMIT 1000"),
+]
+
+
+def timed(db, sql, limit, repetitions):
+    times = []
+    with db._get_pool().connection() as conn:
+        for _ in range(repetitions):
+            start = time.perf_counter()
+            with conn.cursor() as cursor:
+                cursor.execute(sql)
+                cursor.fetchmany(limit)
+            times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+if __name__ == '__main__':
+    repetitions = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    limit = int(sys.argv[2]) if len(sys.argv) > 2 else 51
+
+    db = DatabaseConnector()
+    print(f"Preview of {limit} rows, median of {repetitions} runs")
+    print(f"{'query':<26} {'wrapped ms':>11} {'pushed ms':>10} {'speedup':>8}  strategy")
+    for name, sql in QUERIES:
+        pushed, strategy = push_limit(sql, limit)
+        try:
+            wrapped_s = timed(db, wrap_limit(sql, limit), limit, repetitions)
+            pushed_s = timed(db, pushed, limit, repetitions)
+        except Exception as e:
+            print(f"{name:<26} error: {e}")
+            continue
+        print(f"{name:<26} {wrapped_s * 1000:>11.1f} {pushed_s * 1000:>10.1f} "
+              f"{wrapped_s / pushed_s:>7.1f}x  {strategy}")
+    db.close()
@@ -1,7 +1,10 @@
 """
-Load and format business context from datasense.md
+Load and format business context from datasense.md, plus the retrieval
+index that selects question-specific context snippets for prompts
 """
 
+from context_index import ContextIndex
+
 def load_business_context():
     """Load the DataSense business context from markdown file"""
     try:
@@ -66,4 +69,10 @@ COMMON BUSINESS SCENARIOS:
     except FileNotFoundError:
         return "Business context file not found."
 
-BUSINESS_CONTEXT = load_business_context()
+def load_context_index():
+    """Load (building if needed) the business-context snippet index"""
+    try:
+        return ContextIndex.load_or_build()
+    except Exception as e:
+        print(f"Context index unavailable, using static business context: {e}")
+        return None
@@ -0,0 +1,214 @@
+"""BM25 retrieval index over business-context snippets.
+
+Sources are training/chunks.jsonl, training/rules.jsonl and the markdown files
+in business_contexts/. The index is built offline into `context_index/`:
+
+    python context_index.py
+
+which writes `snippets.bin` (UTF-8 snippet texts back to back) and
+`index.json` (offsets, postings and BM25 statistics). At startup the JSON is
+loaded once and the snippet file is memory-mapped, so only the snippets that
+are actually selected for a prompt are read. A missing or stale index (any
+source changed since the build) is rebuilt automatically.
+"""
+import glob
+import hashlib
+import json
+import math
+import mmap
+import os
+from collections import Counter, defaultdict
+
+from schema_index import tokenize, estimate_tokens
+
+DEFAULT_INDEX_DIR = 'context_index'
+DEFAULT_TOP_N = int(os.getenv("CONTEXT_TOP_N", 4))
+DEFAULT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 350))
+
+INDEX_FORMAT = 1
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Markdown paragraphs are merged up to roughly this many characters per snippet
+MD_CHUNK_CHARS = 600
+
+
+def source_paths(base_dir='.'):
+    """All source files that feed the index, in a stable order."""
+    paths = [
+        os.path.join(base_dir, 'training', 'chunks.jsonl'),
+        os.path.join(base_dir, 'training', 'rules.jsonl'),
+    ]
+    paths += sorted(glob.glob(os.path.join(base_dir, 'business_contexts', '*.md')))
+    return [p for p in paths if os.path.exists(p)]
+
+
+def _source_signature(paths):
+    return {os.path.relpath(p): [os.path.getsize(p), os.stat(p).st_mtime_ns] for p in paths}
+
+
+def _read_jsonl(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def _markdown_chunks(path):
+    """Split a markdown file into paragraph groups prefixed with its title."""
+    with open(path, 'r', encoding='utf-8') as f:
+        lines = f.read().splitlines()
+    title = lines[0].strip('# ').strip() if lines else os.path.basename(path)
+    body = '\n'.join(l for l in lines[1:] if not set(l.strip()) <= set('=-'))
+    paragraphs = [p.strip() for p in body.split('\n\n') if p.strip()]
+
+    current = ''
+    for para in paragraphs:
+        if current and len(current) + len(para) > MD_CHUNK_CHARS:
+            yield title, current
+            current = ''
+        current = f"{current}\n{para}" if current else para
+    if current:
+        yield title, current
+
+
+def iter_snippets(base_dir='.'):
+    """Yield (source, title, text) for every snippet in the sources."""
+    for path in source_paths(base_dir):
+        source = os.path.relpath(path, base_dir)
+        if path.endswith('chunks.jsonl'):
+            for item in _read_jsonl(path):
+                yield source, item.get('title', ''), item['text']
+        elif path.endswith('rules.jsonl'):
+            for item in _read_jsonl(path):
+                text = item['rule']
+                if item.get('explanation'):
+                    text += f" {item['explanation']}"
+                yield source, 'rule', text
+        else:
+            for title, text in _markdown_chunks(path):
+                yield source, title, text
+
+
+def build_index(base_dir='.', index_dir=DEFAULT_INDEX_DIR):
+    """Build the index files from the sources and return the index directory."""
+    index_dir = os.path.join(base_dir, index_dir)
+    os.makedirs(index_dir, exist_ok=True)
+
+    docs = []
+    postings = defaultdict(list)
+    blob = bytearray()
+    for doc_id, (source, title, text) in enumerate(iter_snippets(base_dir)):
+        data = text.encode('utf-8')
+        tf = Counter(tokenize(f"{title.replace('_', ' ')} {text}"))
+        for term, count in tf.items():
+            postings[term].append([doc_id, count])
+        docs.append({
+            'offset': len(blob),
+            'length': len(data),
+            'source': source,
+            'title': title,
+            'terms': sum(tf.values()),
+            'tokens': estimate_tokens(text),
+        })
+        blob += data
+
+    n = len(docs)
+    index = {
+        'format': INDEX_FORMAT,
+        'sources': _source_signature(source_paths(base_dir)),
+        'version': hashlib.sha256(bytes(blob)).hexdigest()[:16],
+        'avg_terms': (sum(d['terms'] for d in docs) / n) if n else 1.0,
+        'docs': docs,
+        'idf': {t: math.log(1 + (n - len(p) + 0.5) / (len(p) + 0.5)) for t, p in postings.items()},
+        'postings': postings,
+    }
+
+    # Write to temporary names first so a running server never sees half a build
+    snippets_path = os.path.join(index_dir, 'snippets.bin')
+    index_path = os.path.join(index_dir, 'index.json')
+    with open(snippets_path + '.tmp', 'wb') as f:
+        f.write(blob)
+    with open(index_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(index, f)
+    os.replace(snippets_path + '.tmp', snippets_path)
+    os.replace(index_path + '.tmp', index_path)
+    return index_dir
+
+
+class ContextIndex:
+    """Read-only view over a built index with a memory-mapped snippet file."""
+
+    def __init__(self, index_dir=DEFAULT_INDEX_DIR):
+        with open(os.path.join(index_dir, 'index.json'), 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        if index.get('format') != INDEX_FORMAT:
+            raise ValueError(f"Unsupported context index format: {index.get('format')}")
+        self.version = index['version']
+        self.sources = index['sources']
+        self.docs = index['docs']
+        self.idf = index['idf']
+        self.postings = index['postings']
+        self.avg_terms = index['avg_terms'] or 1.0
+
+        self._file = open(os.path.join(index_dir, 'snippets.bin'), 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+
+    @classmethod
+    def load_or_build(cls, base_dir='.', index_dir=DEFAULT_INDEX_DIR):
+        """Load the index, rebuilding it first when missing or out of date."""
+        path = os.path.join(base_dir, index_dir)
+        try:
+            with open(os.path.join(path, 'index.json'), 'r', encoding='utf-8') as f:
+                stale = json.load(f).get('sources') != _source_signature(source_paths(base_dir))
+        except (OSError, ValueError):
+            stale = True
+        if stale:
+            build_index(base_dir, index_dir)
+        return cls(path)
+
+    def snippet(self, doc_id):
+        doc = self.docs[doc_id]
+        return self._map[doc['offset']:doc['offset'] + doc['length']].decode('utf-8')
+
+    def search(self, question, top_n=DEFAULT_TOP_N):
+        """Top documents for the question as (doc_id, score), best first."""
+        scores = defaultdict(float)
+        for term, qf in Counter(tokenize(question)).items():
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for doc_id, f in self.postings[term]:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.docs[doc_id]['terms'] / self.avg_terms)
+                scores[doc_id] += idf * qf * f * (BM25_K1 + 1) / (f + norm)
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:top_n]
+
+    def prompt_section(self, question, top_n=None, token_budget=None):
+        """Business-context block holding only the snippets relevant to the question."""
+        top_n = DEFAULT_TOP_N if top_n is None else top_n
+        token_budget = DEFAULT_TOKEN_BUDGET if token_budget is None else token_budget
+
+        snippets = []
+        used = 0
+        for doc_id, _ in self.search(question, top_n):
+            cost = self.docs[doc_id]['tokens']
+            if used + cost > token_budget:
+                continue
+            snippets.append(self.snippet(doc_id))
+            used += cost
+        if not snippets:
+            return ''
+        return "DATASENSE BUSINESS CONTEXT:\n" + '\n'.join(f"- {s}" for s in snippets)
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._file.close()
+
+
+if __name__ == '__main__':
+    out = build_index()
+    idx = ContextIndex(out)
+    print(f"Built context index in {out}: {len(idx.docs)} snippets, version {idx.version}")
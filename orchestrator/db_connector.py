@@ -1,21 +1,214 @@
 """
 Database Connection Handler
-Manages direct MySQL database connections and query execution.
+Manages pooled MySQL database connections and query execution.
 """
 
 import pymysql
 import pymysql.cursors
+import itertools
 import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
 from dotenv import load_dotenv
+from pymysql.constants import FLAG
+from sql_rewrite import push_limit
 
 load_dotenv()
 
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection becomes available in time."""
+
+
+def _is_server_error(exc):
+    """True for errors reported by the server (bad SQL etc.), after which the
+    connection is still usable. Client-side codes (CR_*, 2000+) mean the socket
+    is in an unknown state."""
+    if not isinstance(exc, pymysql.err.MySQLError) or isinstance(exc, pymysql.err.InterfaceError):
+        return False
+    code = exc.args[0] if exc.args else None
+    return isinstance(code, int) and code < 2000
+
+
+class ConnectionPool:
+    """Bounded, thread-safe pool of pymysql connections.
+
+    Connections are created lazily up to `max_size`; callers block for at most
+    `timeout` seconds when all of them are checked out. A connection older than
+    `recycle` seconds is replaced on checkout, and one idle for more than
+    `ping_after` seconds is pinged first, so healthy hot connections are handed
+    out without a round trip to the server.
+    """
+
+    def __init__(self, factory, min_size=1, max_size=10, timeout=30.0,
+                 recycle=3600.0, ping_after=30.0):
+        self._factory = factory
+        self.min_size = max(0, int(min_size))
+        self.max_size = max(1, int(max_size), self.min_size)
+        self.timeout = float(timeout)
+        self.recycle = float(recycle)
+        self.ping_after = float(ping_after)
+
+        self._cond = threading.Condition()
+        self._idle = deque()      # [conn, created_at, last_used]
+        self._created_at = {}     # id(conn) -> created_at for checked-out connections
+        self._size = 0
+        self._closed = False
+
+        # Counters for /api/health
+        self.checkouts = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.recycled = 0
+        self.discarded = 0
+
+    def _create(self):
+        conn = self._factory()
+        return [conn, time.time(), time.time()]
+
+    def fill(self):
+        """Open connections until at least `min_size` exist."""
+        while True:
+            with self._cond:
+                if self._closed or self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                entry = self._create()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._idle.append(entry)
+                self._cond.notify()
+
+    def acquire(self):
+        """Check out a live connection, blocking up to `timeout` seconds."""
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            entry = None
+            while True:
+                if self._closed:
+                    raise RuntimeError("Connection pool is closed")
+                if self._idle:
+                    entry = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise PoolTimeout(f"No database connection available within {self.timeout:g}s")
+                self.waits += 1
+                self._cond.wait(remaining)
+            self.checkouts += 1
+
+        try:
+            entry = self._validate(entry) if entry else self._create()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+        conn = entry[0]
+        with self._cond:
+            self._created_at[id(conn)] = entry[1]
+        return conn
+
+    def _validate(self, entry):
+        """Recycle old connections and ping ones that sat idle for a while."""
+        conn, created_at, last_used = entry
+        now = time.time()
+        if now - created_at > self.recycle:
+            self.recycled += 1
+            self._close_quietly(conn)
+            return self._create()
+        if now - last_used > self.ping_after:
+            try:
+                conn.ping(reconnect=False)
+            except Exception:
+                self.recycled += 1
+                self._close_quietly(conn)
+                return self._create()
+        return entry
+
+    def release(self, conn, discard=False):
+        """Return a connection to the pool, or close it if `discard` is set."""
+        with self._cond:
+            created_at = self._created_at.pop(id(conn), time.time())
+            if discard or self._closed:
+                self._size -= 1
+                self.discarded += 1 if discard else 0
+            else:
+                self._idle.append([conn, created_at, time.time()])
+            self._cond.notify()
+        if discard or self._closed:
+            self._close_quietly(conn)
+
+    @contextmanager
+    def connection(self):
+        """Context manager form of acquire/release.
+
+        The connection is discarded instead of returned when the block raises
+        anything other than a server-side SQL error, since its protocol state
+        is unknown.
+        """
+        conn = self.acquire()
+        try:
+            yield conn
+        except Exception as e:
+            self.release(conn, discard=not _is_server_error(e))
+            raise
+        else:
+            self.release(conn)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'checkouts': self.checkouts,
+                'waits': self.waits,
+                'timeouts': self.timeouts,
+                'recycled': self.recycled,
+                'discarded': self.discarded,
+            }
+
+    def close(self):
+        """Close idle connections; checked-out ones are closed on release."""
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, _, _ in idle:
+            self._close_quietly(conn)
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
 class DatabaseConnector:
-    """Direct MySQL connection handler.
+    """Pooled MySQL connection handler.
 
     Provides connection management and query execution helpers. Reads DB
     configuration from environment variables: DB_HOST, DB_PORT, DB_USER,
-    DB_PASSWORD and DB_NAME.
+    DB_PASSWORD and DB_NAME. Pool sizing is controlled by DB_POOL_MIN_SIZE,
+    DB_POOL_MAX_SIZE, DB_POOL_TIMEOUT, DB_POOL_RECYCLE and DB_POOL_PING_AFTER.
     """
 
     def __init__(self):
@@ -27,151 +220,149 @@ class DatabaseConnector:
         self.db_password = os.getenv("DB_PASSWORD")
         self.database = os.getenv("DB_NAME")
 
-        # Connection handle (None until connected)
-        self.connection = None
+        # Pool configuration
+        self.pool_min_size = int(os.getenv("DB_POOL_MIN_SIZE", 1))
+        self.pool_max_size = int(os.getenv("DB_POOL_MAX_SIZE", 10))
+        self.pool_timeout = float(os.getenv("DB_POOL_TIMEOUT", 30))
+        self.pool_recycle = float(os.getenv("DB_POOL_RECYCLE", 3600))
+        self.pool_ping_after = float(os.getenv("DB_POOL_PING_AFTER", 30))
+
+        # Connection pool (None until connected)
+        self.pool = None
+        self._pool_lock = threading.Lock()
+
+        # How preview LIMITs were applied (see sql_rewrite.push_limit)
+        self.limit_strategies = {}
+        self._stats_lock = threading.Lock()
+
+    def _open_connection(self):
+        # autocommit so a reused connection never keeps an old read snapshot
+        return pymysql.connect(
+            host=self.db_host,
+            port=self.db_port,
+            user=self.db_user,
+            password=self.db_password,
+            database=self.database,
+            connect_timeout=10,
+            autocommit=True,
+        )
+
+    def _get_pool(self):
+        """Create the pool on first use."""
+        if self.pool is None:
+            with self._pool_lock:
+                if self.pool is None:
+                    if not all([self.db_host, self.db_user, self.db_password, self.database]):
+                        raise RuntimeError("Missing DB config (DB_HOST/DB_USER/DB_PASSWORD/DB_NAME)")
+                    self.pool = ConnectionPool(
+                        self._open_connection,
+                        min_size=self.pool_min_size,
+                        max_size=self.pool_max_size,
+                        timeout=self.pool_timeout,
+                        recycle=self.pool_recycle,
+                        ping_after=self.pool_ping_after,
+                    )
+        return self.pool
 
-    
     def connect(self):
-        """Establish connection to MySQL database"""
+        """Create the pool, open the minimum connections and verify one with a ping"""
         try:
-            # Basic validation of required config
-            if not all([self.db_host, self.db_user, self.db_password, self.database]):
-                return False, "Missing DB config (DB_HOST/DB_USER/DB_PASSWORD/DB_NAME)"
-
-            self.connection = pymysql.connect(
-                host=self.db_host,
-                port=self.db_port,
-                user=self.db_user,
-                password=self.db_password,
-                database=self.database,
-                connect_timeout=10,
-            )
-
-            # Ensure connection is alive
-            try:
-                self.connection.ping(reconnect=True)
-            except Exception:
-                # if ping fails treat as a connection failure
-                return False, "Connection failed after ping"
+            pool = self._get_pool()
+            pool.fill()
+            with pool.connection() as conn:
+                try:
+                    conn.ping(reconnect=False)
+                except Exception:
+                    # if ping fails treat as a connection failure
+                    return False, "Connection failed after ping"
 
             return True, "Connected successfully"
         except Exception as e:
             return False, f"Connection error: {str(e)}"
-    
-    def execute_query(self, query):
+
+    def execute_query(self, query, params=None):
         """
         Execute a SQL query and return results
-        
+
         Args:
             query (str): SQL query to execute
-            
+            params (tuple): optional %s parameters (literal '%' must then be doubled)
+
         Returns:
             tuple: (success (bool), data (list), columns (list))
         """
         try:
-            # Ensure we have a live connection. Use ping with reconnect to revive if needed.
-            if self.connection is None:
-                success, message = self.connect()
-                if not success:
-                    return False, message, None
-            else:
-                try:
-                    self.connection.ping(reconnect=True)
-                except Exception:
-                    success, message = self.connect()
-                    if not success:
-                        return False, message, None
+            with self._get_pool().connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(query, params)
 
-            with self.connection.cursor() as cursor:
-                cursor.execute(query)
-
-                if query.strip().lower().startswith("select"):
-                    data = cursor.fetchall()
-                    columns = [desc[0] for desc in cursor.description] if cursor.description else []
-                    return True, data, columns
-                else:
-                    self.connection.commit()
-                    return True, f"{cursor.rowcount} row(s) affected.", None
+                    # Anything that returns a result set (SELECT, SHOW, EXPLAIN, ...)
+                    if cursor.description:
+                        data = cursor.fetchall()
+                        columns = [desc[0] for desc in cursor.description] if cursor.description else []
+                        return True, data, columns
+                    else:
+                        conn.commit()
+                        return True, f"{cursor.rowcount} row(s) affected.", None
         except Exception as e:
             return False, str(e), None
 
     def execute_query_with_limit(self, query: str, limit: int):
         """
         Execute the provided query but only return up to `limit` rows.
-        Uses a derived-table wrapper to safely apply a LIMIT without modifying
-        the original query text.
+        The LIMIT is pushed into the outermost SELECT (or merged with its
+        existing LIMIT) when that is safe, so ORDER BY / GROUP BY queries can
+        stop early; otherwise the query is wrapped in a derived table.
 
         Returns: (success: bool, rows: list, columns: list)
         """
         try:
-            if self.connection is None:
-                success, message = self.connect()
-                if not success:
-                    return False, message, None
-            else:
-                try:
-                    self.connection.ping(reconnect=True)
-                except Exception:
-                    success, message = self.connect()
-                    if not success:
-                        return False, message, None
-
-            wrapper = f"SELECT * FROM ({query.strip().rstrip(';')}) AS _sub LIMIT {int(limit)}"
-            with self.connection.cursor() as cursor:
-                cursor.execute(wrapper)
-                rows = cursor.fetchall()
-                columns = [desc[0] for desc in cursor.description] if cursor.description else []
-                return True, rows, columns
+            limited, strategy = push_limit(query, limit)
+            with self._stats_lock:
+                self.limit_strategies[strategy] = self.limit_strategies.get(strategy, 0) + 1
+            with self._get_pool().connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(limited)
+                    rows = cursor.fetchmany(int(limit))
+                    columns = [desc[0] for desc in cursor.description] if cursor.description else []
+                    return True, rows, columns
         except Exception as e:
             return False, str(e), None
 
     def stream_query_with_columns(self, query: str, batch_size: int = 1000):
         """
         Stream rows for a query using a server-side cursor to avoid loading
-        the entire resultset into memory. Returns a tuple (columns, generator)
-        where generator yields row tuples.
+        the entire resultset into memory. Returns a tuple (columns, iterator)
+        where iterator yields row tuples.
+
+        The pooled connection stays checked out until the iterator is
+        exhausted or closed. A stream abandoned half way discards its
+        connection rather than draining the remaining rows.
         """
-        # Ensure connection
-        if self.connection is None:
-            success, message = self.connect()
-            if not success:
-                raise RuntimeError(f"DB connect failed: {message}")
-        else:
-            try:
-                self.connection.ping(reconnect=True)
-            except Exception:
-                success, message = self.connect()
-                if not success:
-                    raise RuntimeError(f"DB connect failed: {message}")
+        pool = self._get_pool()
+        conn = pool.acquire()
 
         # Use SSCursor for server-side iteration
-        cursor = self.connection.cursor(pymysql.cursors.SSCursor)
         try:
+            cursor = conn.cursor(pymysql.cursors.SSCursor)
             cursor.execute(query)
             columns = [desc[0] for desc in cursor.description] if cursor.description else []
-
-            def generator():
-                try:
-                    while True:
-                        rows = cursor.fetchmany(batch_size)
-                        if not rows:
-                            break
-                        for r in rows:
-                            yield r
-                finally:
-                    try:
-                        cursor.close()
-                    except Exception:
-                        pass
-
-            return columns, generator()
         except Exception:
-            try:
-                cursor.close()
-            except Exception:
-                pass
+            pool.release(conn, discard=True)
             raise
-    
+
+        return columns, _StreamingRows(pool, conn, cursor, batch_size, cursor.description,
+                                       unsigned_columns(cursor))
+
+    def pool_stats(self):
+        """Pool counters for health reporting (None before the first connect)."""
+        return self.pool.stats() if self.pool is not None else None
+
+    def limit_stats(self):
+        """Count of preview queries per LIMIT strategy."""
+        with self._stats_lock:
+            return dict(self.limit_strategies)
+
     def test_connection(self):
         """Test database connection.
 
@@ -179,13 +370,112 @@ class DatabaseConnector:
             tuple(bool, str): (success, message)
         """
         return self.connect()
-    
+
     def close(self):
-        """Close database connection"""
-        if getattr(self, 'connection', None):
+        """Close all pooled connections"""
+        if getattr(self, 'pool', None):
             try:
-                self.connection.close()
+                self.pool.close()
             except Exception:
                 pass
             finally:
-                self.connection = None
+                self.pool = None
+
+
+def unsigned_columns(cursor):
+    """Per-column UNSIGNED flags of the cursor's result (DB-API descriptions omit them)."""
+    fields = getattr(getattr(cursor, '_result', None), 'fields', None) or ()
+    return tuple(bool(field.flags & FLAG.UNSIGNED) for field in fields)
+
+
+class _StreamingRows:
+    """Row iterator over a server-side cursor that returns its connection.
+
+    Implemented as a class rather than a generator so `close()` releases the
+    connection even when iteration never started. `description` is the
+    cursor's DB-API description and `unsigned` its per-column UNSIGNED
+    flags, for writers that need column types.
+    """
+
+    def __init__(self, pool, conn, cursor, batch_size, description=None, unsigned=()):
+        self._pool = pool
+        self._conn = conn
+        self._cursor = cursor
+        self._batch_size = batch_size
+        self._batch = iter(())
+        self._done = False
+        self.description = description or ()
+        self.unsigned = unsigned
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._done:
+            raise StopIteration
+        try:
+            for row in self._batch:
+                return row
+            rows = self._cursor.fetchmany(self._batch_size)
+        except Exception:
+            self._finish(discard=True)
+            raise
+        if not rows:
+            self._finish(discard=False)
+            raise StopIteration
+        self._batch = iter(rows)
+        return next(self._batch)
+
+    def fetch(self, size):
+        """Return up to `size` further rows; fewer means the cursor is exhausted."""
+        rows = list(itertools.islice(self._batch, size))
+        while len(rows) < size and not self._done:
+            try:
+                more = self._cursor.fetchmany(max(size - len(rows), self._batch_size))
+            except Exception:
+                self._finish(discard=True)
+                raise
+            if not more:
+                self._finish(discard=False)
+                break
+            take = size - len(rows)
+            rows.extend(more[:take])
+            self._batch = iter(more[take:])
+        return rows
+
+    def batches(self):
+        """Yield rows as the lists returned by fetchmany, without per-row iteration."""
+        pending = list(self._batch)
+        if pending:
+            yield pending
+        while not self._done:
+            try:
+                rows = self._cursor.fetchmany(self._batch_size)
+            except Exception:
+                self._finish(discard=True)
+                raise
+            if not rows:
+                self._finish(discard=False)
+                return
+            yield rows
+
+    def _finish(self, discard):
+        if self._done:
+            return
+        self._done = True
+        if not discard:
+            try:
+                self._cursor.close()
+            except Exception:
+                discard = True
+        self._pool.release(self._conn, discard=discard)
+
+    def close(self):
+        # Unread rows would have to be drained before reuse; drop the connection
+        self._finish(discard=True)
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
@@ -0,0 +1,286 @@
+"""Streaming export writers for CSV, NDJSON, Parquet and Arrow IPC.
+
+Writers consume row batches as returned by the server-side cursor's
+fetchmany and yield byte chunks for the HTTP response. CSV and NDJSON hand
+whole batches to the C-level csv/json encoders; Parquet and Arrow build one
+typed column array per batch from the cursor description, so DECIMAL, DATE
+and DATETIME columns keep their types instead of being stringified. The
+Arrow types are chosen to hold every value the MySQL column can: BIGINT
+UNSIGNED becomes uint64, and DECIMAL wider than 38 digits decimal256.
+Callers run the export up to its first chunk with `prime` before sending
+headers, so schema errors are still reported as an error response.
+
+An export cut off at max_rows says so at its end, since the headers are
+long gone by then: CSV and NDJSON append a marker row, Parquet sets the
+TRUNCATED_KEY file metadata and Arrow ends with an empty record batch
+carrying TRUNCATED_KEY as custom metadata.
+
+pyarrow is only needed for Parquet and Arrow and is imported lazily.
+"""
+import csv
+import io
+import json
+import os
+
+FLUSH_BYTES = int(os.getenv("EXPORT_FLUSH_BYTES", 64 * 1024))
+PARQUET_ROW_GROUP_ROWS = int(os.getenv("EXPORT_PARQUET_ROW_GROUP_ROWS", 65536))
+PARQUET_COMPRESSION = os.getenv("EXPORT_PARQUET_COMPRESSION", "zstd")
+
+# format -> (mimetype, file extension)
+FORMATS = {
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrow'),
+}
+ARROW_FORMATS = ('parquet', 'arrow')
+# Parquet / Arrow metadata key holding max_rows when the export was truncated
+TRUNCATED_KEY = 'datasense.truncated_at'
+
+# MySQL protocol type codes (pymysql.constants.FIELD_TYPE) -> logical types
+_MYSQL_TYPES = {
+    0: 'decimal', 246: 'decimal',
+    1: 'int', 2: 'int', 3: 'int', 8: 'int', 9: 'int', 13: 'int',
+    4: 'float', 5: 'float',
+    10: 'date', 14: 'date',
+    7: 'datetime', 12: 'datetime',
+    11: 'time',
+    16: 'binary',
+    245: 'json',
+}
+
+
+class ExportFormatError(ValueError):
+    """Unknown format or missing optional dependency."""
+
+
+def logical_type(type_code):
+    """Logical column type ('int', 'decimal', 'date', ..., 'string') for a MySQL type code."""
+    return _MYSQL_TYPES.get(type_code, 'string')
+
+
+def check_format(fmt):
+    """Raise ExportFormatError unless `fmt` can be produced in this process."""
+    if fmt not in FORMATS:
+        raise ExportFormatError(f"Unsupported export format '{fmt}'. Use one of: {', '.join(FORMATS)}")
+    if fmt in ARROW_FORMATS:
+        _pyarrow()
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc  # noqa: F401
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        raise ExportFormatError("Parquet and Arrow exports require the 'pyarrow' package")
+    return pyarrow
+
+
+def limit_batches(batches, max_rows, state):
+    """Pass batches through until `max_rows` rows; sets state['truncated'] if more existed."""
+    remaining = max_rows
+    for batch in batches:
+        if len(batch) > remaining:
+            if remaining:
+                yield batch[:remaining]
+            state['truncated'] = True
+            return
+        remaining -= len(batch)
+        yield batch
+
+
+def stream_csv(columns, batches, state, flush_bytes=FLUSH_BYTES):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(columns)
+    for batch in batches:
+        writer.writerows(batch)
+        if buf.tell() >= flush_bytes:
+            yield buf.getvalue().encode('utf-8')
+            buf.seek(0)
+            buf.truncate(0)
+    if state.get('truncated'):
+        writer.writerow([f"Export truncated: more than {state['max_rows']} rows"])
+    yield buf.getvalue().encode('utf-8')
+
+
+def stream_ndjson(columns, batches, state, flush_bytes=FLUSH_BYTES):
+    # Decimal, date and datetime fall back to their string form
+    encode = json.JSONEncoder(default=str, separators=(',', ':'), ensure_ascii=False).encode
+    parts = []
+    size = 0
+    for batch in batches:
+        lines = [encode(dict(zip(columns, row))) for row in batch]
+        lines.append('')
+        chunk = '\n'.join(lines)
+        parts.append(chunk)
+        size += len(chunk)
+        if size >= flush_bytes:
+            yield ''.join(parts).encode('utf-8')
+            parts = []
+            size = 0
+    if state.get('truncated'):
+        parts.append(encode({'_truncated': True, 'max_rows': state['max_rows']}) + '\n')
+    yield ''.join(parts).encode('utf-8')
+
+
+class _ArrowSink:
+    """Write target for pyarrow.PythonFile that buffers until drained."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def arrow_type(pa, desc, unsigned=False):
+    """pyarrow type for one DB-API description entry."""
+    kind = logical_type(desc[1])
+    if kind == 'int':
+        # only BIGINT UNSIGNED (LONGLONG) goes beyond int64
+        return pa.uint64() if unsigned and desc[1] == 8 else pa.int64()
+    if kind == 'float':
+        return pa.float64()
+    if kind == 'decimal':
+        scale = desc[5] or 0
+        # MySQL reports the display length, which also counts sign and point:
+        # at most two digits more than the column needs
+        precision = max(desc[4] or 38, scale + 1)
+        if precision <= 38:
+            return pa.decimal128(precision, scale)
+        if precision <= 76:
+            return pa.decimal256(precision, scale)
+        return pa.string()
+    if kind == 'date':
+        return pa.date32()
+    if kind == 'datetime':
+        return pa.timestamp('us')
+    if kind == 'time':
+        return pa.duration('us')
+    if kind == 'binary':
+        return pa.binary()
+    return pa.string()
+
+
+def arrow_schema(pa, columns, description, unsigned=()):
+    if description:
+        unsigned = tuple(unsigned) + (False,) * (len(description) - len(unsigned))
+        return pa.schema([pa.field(name, arrow_type(pa, desc, flag))
+                          for name, desc, flag in zip(columns, description, unsigned)])
+    return pa.schema([pa.field(name, pa.string()) for name in columns])
+
+
+def _column_array(pa, values, typ):
+    try:
+        return pa.array(values, type=typ)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError, ValueError):
+        if pa.types.is_string(typ):
+            return pa.array([None if v is None else str(v) for v in values], type=typ)
+        # e.g. MySQL zero dates arrive as strings; export them as nulls
+        return pa.array([None if isinstance(v, (str, bytes)) else v for v in values], type=typ)
+
+
+def _record_batches(pa, schema, batches):
+    types = [field.type for field in schema]
+    for batch in batches:
+        if not batch:
+            continue
+        arrays = [_column_array(pa, list(values), typ) for values, typ in zip(zip(*batch), types)]
+        yield pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def stream_arrow(columns, description, batches, state, unsigned=()):
+    pa = _pyarrow()
+    schema = arrow_schema(pa, columns, description, unsigned)
+    sink = _ArrowSink()
+    with pa.ipc.new_stream(pa.PythonFile(sink, mode='w'), schema) as writer:
+        for record_batch in _record_batches(pa, schema, batches):
+            writer.write_batch(record_batch)
+            yield sink.drain()
+        if state.get('truncated'):
+            marker = pa.RecordBatch.from_arrays([pa.array([], type=field.type) for field in schema], schema=schema)
+            writer.write_batch(marker, custom_metadata={TRUNCATED_KEY: str(state['max_rows'])})
+    yield sink.drain()
+
+
+def stream_parquet(columns, description, batches, state, unsigned=()):
+    pa = _pyarrow()
+    import pyarrow.parquet as pq
+
+    schema = arrow_schema(pa, columns, description, unsigned)
+    sink = _ArrowSink()
+    writer = pq.ParquetWriter(pa.PythonFile(sink, mode='w'), schema, compression=PARQUET_COMPRESSION)
+    try:
+        pending = []
+        pending_rows = 0
+        for record_batch in _record_batches(pa, schema, batches):
+            pending.append(record_batch)
+            pending_rows += record_batch.num_rows
+            if pending_rows >= PARQUET_ROW_GROUP_ROWS:
+                writer.write_table(pa.Table.from_batches(pending, schema=schema))
+                pending = []
+                pending_rows = 0
+                yield sink.drain()
+        if pending:
+            writer.write_table(pa.Table.from_batches(pending, schema=schema))
+        if state.get('truncated') and hasattr(writer, 'add_key_value_metadata'):
+            writer.add_key_value_metadata({TRUNCATED_KEY: str(state['max_rows'])})
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def stream_export(fmt, columns, description, batches, max_rows, unsigned=()):
+    """Yield the export body for a non-XLSX `fmt` from cursor row batches."""
+    state = {'truncated': False, 'max_rows': max_rows}
+    batches = limit_batches(batches, max_rows, state)
+    if fmt == 'csv':
+        return stream_csv(columns, batches, state)
+    if fmt == 'ndjson':
+        return stream_ndjson(columns, batches, state)
+    if fmt == 'arrow':
+        return stream_arrow(columns, description, batches, state, unsigned)
+    if fmt == 'parquet':
+        return stream_parquet(columns, description, batches, state, unsigned)
+    raise ExportFormatError(f"Unsupported export format '{fmt}'")
+
+
+def prime(chunks):
+    """
+    Run the `chunks` generator up to its first chunk now, so a failure in the
+    schema or the first batch raises here, before any response has started.
+    Returns a generator yielding the same chunks (closing it closes `chunks`).
+    """
+    first = next(chunks, None)
+
+    def replay():
+        try:
+            if first is not None:
+                yield first
+            yield from chunks
+        finally:
+            chunks.close()
+
+    return replay()
@@ -0,0 +1,379 @@
+"""
+Fast path: answer common questions from training/dataset.jsonl without the LLM
+
+Each NL->SQL pair in the dataset becomes a template when it is loaded. Any
+SQL literal that also appears in the question becomes a typed slot: a
+product or distributor name, a number, a date, or a year inside date
+literals. So "Count total orders for Delta Ice Creams" and its SQL give
+one template for every distributor. Pairs whose SQL the parser or the
+validator rejects are skipped.
+
+Questions are matched in two ways, strongest first:
+
+1. Template fit. The question has the template's exact wording, ignoring
+   case, spacing and trailing punctuation. Each name slot must hold exactly
+   one quoted literal or a name known from the dataset. Unknown unquoted
+   text such as "Delta Ice Creams in 2024" or "each distributor" makes
+   the fit fail. Score 1.0.
+2. Similarity. Known names, quoted strings, dates and numbers are replaced
+   by typed placeholders, and filler words ("show me", "please", "list")
+   are dropped. The rest is compared with each template that has the same
+   slot types in the same order, by cosine similarity over character
+   trigrams. The remaining words must be exactly the template's, so no
+   unmatched text is left over. "... in November" can therefore never
+   borrow an October template.
+
+When the score reaches FAST_PATH_THRESHOLD, the SQL is filled in from the
+question's slot values. Otherwise the caller falls back to the LLM.
+"""
+
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+
+from sql_parser import parse
+
+ENABLED = os.getenv("FAST_PATH_ENABLED", "1") not in ("0", "false", "False")
+THRESHOLD = float(os.getenv("FAST_PATH_THRESHOLD", 0.85))
+DATASET_PATH = os.getenv("FAST_PATH_DATASET", os.path.join('training', 'dataset.jsonl'))
+
+# Misses scoring within this distance of the threshold are counted as near misses
+NEAR_MISS_MARGIN = 0.1
+
+# Words a paraphrase may add or drop without changing the query
+FILLER_WORDS = frozenset('''
+    a all an any are can could display do does fetch find for get give i is list me my of
+    please show tell the there us we what which would you
+'''.split())
+
+_DATE = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+_SLOT_PATTERNS = {
+    'text': r"('[^']+'|.+?)",
+    'number': r'(\d+(?:\.\d+)?)',
+    'date': r'(\d{4}-\d{2}-\d{2})',
+    'year': r'((?:19|20)\d{2})',
+}
+# Stand-ins for slots in normalized text
+_PLACEHOLDERS = {'text': '\x01', 'number': '\x02', 'date': '\x03', 'year': '\x04'}
+_KIND_OF = {p: k for k, p in _PLACEHOLDERS.items()}
+_QUESTION_IN_PROMPT = re.compile(r'QUESTION: (.*)')
+_QUOTED = re.compile(r"'[^']+'")
+
+
+def clean(text):
+    """Single spaces, no trailing punctuation."""
+    return re.sub(r'\s+', ' ', text).strip().rstrip('?.!').strip()
+
+
+def trigrams(text):
+    padded = f"  {text} "
+    return Counter(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def cosine(a, b):
+    dot = sum(count * b[gram] for gram, count in a.items() if gram in b)
+    if not dot:
+        return 0.0
+    return dot / math.sqrt(sum(v * v for v in a.values()) * sum(v * v for v in b.values()))
+
+
+def content_words(text):
+    """Words of placeholder text other than fillers (slots excluded)."""
+    return {w for w in re.findall(r'[a-z0-9]+', text) if w not in FILLER_WORDS}
+
+
+def core_text(text):
+    """Placeholder text without filler words, for similarity scoring."""
+    return ' '.join(w for w in re.findall(r'[a-z0-9]+|[\x01-\x04]', text) if w not in FILLER_WORDS)
+
+
+def sql_string(value):
+    """MySQL string literal for a slot value."""
+    return "'" + value.replace('\\', '\\\\').replace("'", "''") + "'"
+
+
+def _find_word(haystack, needle):
+    """Start of `needle` in `haystack` as a whole word (case-insensitive), or -1."""
+    match = re.search(r'(?<!\w)' + re.escape(needle) + r'(?!\w)', haystack, re.IGNORECASE)
+    return match.start() if match else -1
+
+
+def _literal_value(token):
+    if token.kind == 'string':
+        return token.text[1:-1].replace("''", "'").replace('\\\\', '\\')
+    return token.text
+
+
+class Template:
+    """One question shape with its SQL and typed slots."""
+
+    __slots__ = ('example', 'sql', 'kinds', 'values', 'edits', 'text', 'words', 'grams', 'regex',
+                 'literal_chars')
+
+    def __init__(self, question, sql, slots, edits):
+        """
+        Args:
+            question (str): the example question
+            sql (str): the example SQL
+            slots (list): (start, end, kind) of each slot in the question, in order
+            edits (list): (start, end, slot, suffix) SQL literal replacements,
+                sorted; the literal becomes the slot value followed by suffix
+        """
+        self.example = question
+        self.sql = sql
+        self.kinds = tuple(kind for _, _, kind in slots)
+        self.values = [question[start:end] for start, end, _ in slots]
+        self.edits = edits
+
+        parts = []
+        position = 0
+        for start, end, kind in slots:
+            parts.append(question[position:start])
+            parts.append(_PLACEHOLDERS[kind])
+            position = end
+        parts.append(question[position:])
+        self.text = clean(''.join(parts)).lower()
+        self.words = content_words(self.text)
+        self.grams = trigrams(core_text(self.text))
+
+        pattern = []
+        for piece in re.split('([\x01-\x04])', self.text):
+            kind = _KIND_OF.get(piece)
+            pattern.append(_SLOT_PATTERNS[kind] if kind else re.escape(piece).replace(r'\ ', r'\s+'))
+        self.regex = re.compile('^' + ''.join(pattern) + '$', re.IGNORECASE)
+        self.literal_chars = len(self.text) - len(self.kinds)
+
+    def fill(self, values):
+        """SQL with the slot values substituted."""
+        parts = []
+        position = 0
+        for start, end, slot, suffix in self.edits:
+            value = values[slot]
+            parts.append(self.sql[position:start])
+            parts.append(value if self.kinds[slot] == 'number' else sql_string(value + suffix))
+            position = end
+        parts.append(self.sql[position:])
+        return ''.join(parts)
+
+
+def usable_sql(sql):
+    """Parsed SQL of a dataset example, or None if it is not one well-formed query."""
+    parsed = parse(sql)
+    if not parsed.is_query or not parsed.balanced or parsed.statements != 1:
+        return None
+    # e.g. "... WHERE name = 'x' WHERE is_active = 1" from naive augmentation
+    if sum(1 for t in parsed.top if t.kind == 'word' and t.value == 'WHERE') > 1:
+        return None
+    return parsed
+
+
+def load_examples(path=DATASET_PATH, validator=None):
+    """
+    (question, sql) pairs from the NL->SQL dataset at `path`, first one per
+    question. SQL that is malformed or that the validator rejects is skipped.
+    """
+    examples = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            match = _QUESTION_IN_PROMPT.search(item.get('prompt', ''))
+            question = (match.group(1) if match else item.get('question', '')).strip()
+            sql = (item.get('completion') or item.get('sql') or '').strip()
+            if not question or not sql or question in examples or usable_sql(sql) is None:
+                continue
+            if validator is not None and not validator.is_safe_query(sql.rstrip(';'))[0]:
+                continue
+            examples[question] = sql
+    return list(examples.items())
+
+
+def build_template(question, sql):
+    """Template for one example, or None if its SQL is unusable."""
+    sql = sql.strip()
+    parsed = usable_sql(sql)
+    if parsed is None:
+        return None
+
+    found = []      # (question start, question end, kind, sql token, suffix)
+    for token in parsed.tokens:
+        if token.kind not in ('string', 'number'):
+            continue
+        value = _literal_value(token)
+        start = _find_word(question, value)
+        if start >= 0:
+            kind = 'number' if token.kind == 'number' else ('date' if _DATE.match(value) else 'text')
+            found.append((start, start + len(value), kind, token, ''))
+    # A year in the question that only appears inside date literals, e.g. "for 2024"
+    for match in re.finditer(r'(?<![\w-])((?:19|20)\d{2})(?![\w-])', question):
+        year = match.group(1)
+        for token in parsed.tokens:
+            value = _literal_value(token) if token.kind == 'string' else ''
+            if _DATE.match(value) and value.startswith(year + '-'):
+                found.append((match.start(), match.end(), 'year', token, value[len(year):]))
+
+    # Longest spans first; a span overlapping a kept one is dropped
+    slots = []
+    for start, end, kind, _, _ in sorted(found, key=lambda f: f[0] - f[1]):
+        if all(end <= s or start >= e or (s, e, k) == (start, end, kind) for s, e, k in slots):
+            if (start, end, kind) not in slots:
+                slots.append((start, end, kind))
+    slots.sort()
+    slot_index = {slot: i for i, slot in enumerate(slots)}
+
+    edits = {}
+    for start, end, kind, token, suffix in found:
+        if (start, end, kind) in slot_index:
+            edits.setdefault(token.start, (token.start, token.end, slot_index[(start, end, kind)], suffix))
+    return Template(question, sql, slots, sorted(edits.values()))
+
+
+class FastPathMatch:
+    __slots__ = ('sql', 'score', 'example', 'values', 'exact')
+
+    def __init__(self, sql, score, example, values, exact=False):
+        self.sql = sql
+        self.score = score
+        self.example = example
+        self.values = values
+        # True for a template fit, False for a paraphrase
+        self.exact = exact
+
+
+class FastPathIndex:
+    """Templates from the NL->SQL dataset and the matcher over them."""
+
+    def __init__(self, templates, names=(), threshold=THRESHOLD):
+        self.templates = templates
+        # Known names, longest first so "Mango - 5 Liter (N)" wins over "Mango"
+        self.names = sorted(set(names), key=len, reverse=True)
+        self._known = {name.lower() for name in self.names}
+        self.threshold = threshold
+
+    @classmethod
+    def load(cls, path=DATASET_PATH, validator=None, threshold=THRESHOLD):
+        """Index of the dataset at `path`; SQL the validator rejects is skipped."""
+        return cls.from_examples(load_examples(path, validator), threshold)
+
+    @classmethod
+    def from_examples(cls, examples, threshold=THRESHOLD):
+        """Index of (question, sql) pairs from `load_examples`."""
+        templates = {}
+        names = set()
+        for question, sql in examples:
+            template = build_template(question, sql)
+            if template is None:
+                continue
+            names.update(v for v, k in zip(template.values, template.kinds) if k == 'text')
+            # the first example of each question shape is kept
+            templates.setdefault((template.text, template.kinds), template)
+        return cls(list(templates.values()), names, threshold)
+
+    def _name_ok(self, value):
+        """A name slot holds one quoted literal or a name known from the dataset, nothing more."""
+        return bool(_QUOTED.fullmatch(value)) or value.lower() in self._known
+
+    def _extract(self, question):
+        """(placeholder text, kinds, values) with known names, quotes, dates and numbers as slots."""
+        spans = []
+
+        def free(start, end):
+            return all(end <= s or start >= e for s, e, _, _ in spans)
+
+        for match in re.finditer(r"'([^']+)'", question):
+            spans.append((match.start(), match.end(), 'text', match.group(1)))
+        for name in self.names:
+            start = _find_word(question, name)
+            if start >= 0 and free(start, start + len(name)):
+                spans.append((start, start + len(name), 'text', question[start:start + len(name)]))
+        for pattern, kind in ((r'\d{4}-\d{2}-\d{2}', 'date'), (r'(?:19|20)\d{2}', 'year'),
+                              (r'\d+(?:\.\d+)?', 'number')):
+            for match in re.finditer(r'(?<![\w.-])' + pattern + r'(?![\w.-])', question):
+                if free(match.start(), match.end()):
+                    spans.append((match.start(), match.end(), kind, match.group()))
+        spans.sort()
+
+        parts = []
+        position = 0
+        for start, end, kind, _ in spans:
+            parts.append(question[position:start])
+            parts.append(_PLACEHOLDERS[kind])
+            position = end
+        parts.append(question[position:])
+        return clean(''.join(parts)).lower(), tuple(s[2] for s in spans), [s[3] for s in spans]
+
+    def match(self, question):
+        """
+        Best template for `question`.
+
+        Returns:
+            tuple: (FastPathMatch or None, best similarity score)
+        """
+        text = clean(question)
+        if not text or not self.templates:
+            return None, 0.0
+
+        # 1. the template's exact wording, any acceptable values in the slots
+        fits = []
+        for template in self.templates:
+            found = template.regex.match(text)
+            if found and all(k != 'text' or self._name_ok(v) for k, v in zip(template.kinds, found.groups())):
+                fits.append((template.literal_chars, template, [v.strip("'") for v in found.groups()]))
+        if fits:
+            _, template, values = max(fits, key=lambda f: f[0])
+            return FastPathMatch(template.fill(values), 1.0, template.example, values, exact=True), 1.0
+
+        # 2. paraphrase: trigram similarity, same slots, only filler words differ
+        placeholder_text, kinds, values = self._extract(text)
+        grams = trigrams(core_text(placeholder_text))
+        words = content_words(placeholder_text)
+        best, best_score = None, 0.0
+        for template in self.templates:
+            if template.kinds != kinds:
+                continue
+            score = cosine(grams, template.grams)
+            if score > best_score:
+                best, best_score = template, score
+        if best is not None and best_score >= self.threshold and words == best.words:
+            return FastPathMatch(best.fill(values), round(best_score, 3), best.example, values), best_score
+        return None, best_score
+
+    def stats(self):
+        return {'templates': len(self.templates), 'names': len(self.names), 'threshold': self.threshold}
+
+
+class FastPathStats:
+    """Hit-rate counters for the fast path (kept across index reloads)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.exact_hits = 0
+        self.near_misses = 0
+
+    def record(self, match, score, threshold=THRESHOLD):
+        with self._lock:
+            self.lookups += 1
+            if match is not None:
+                self.hits += 1
+                if match.exact:
+                    self.exact_hits += 1
+            elif score >= threshold - NEAR_MISS_MARGIN:
+                self.near_misses += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'lookups': self.lookups,
+                'hits': self.hits,
+                'exact_hits': self.exact_hits,
+                'misses': self.lookups - self.hits,
+                'near_misses': self.near_misses,
+                'hit_rate': round(self.hits / self.lookups, 4) if self.lookups else 0.0,
+            }
@@ -0,0 +1,124 @@
+"""
+Few-shot example selection for SQL generation prompts
+
+The NL->SQL pairs in training/dataset.jsonl that validate against the schema
+(see fast_path.load_examples) are indexed in memory with every context
+build. For each question the FEW_SHOT_K nearest examples go into the
+prompt, so smaller models such as sqlcoder:7b see how this schema is usually
+joined and filtered.
+
+Examples are ranked with BM25 over their question terms, using the same
+tokenizer and synonyms as the schema index, plus the tables their SQL reads
+at a lower weight. Two rules apply to the ranked list:
+
+* examples whose SQL differs only in literals count once, so one question
+  shape cannot fill every slot
+* examples are added until FEW_SHOT_TOKEN_BUDGET is spent, and those below
+  MIN_RELATIVE_SCORE of the best match are dropped
+
+The examples are question-specific and so belong in the prompt suffix, after
+the stable prefix that Ollama caches.
+"""
+
+import math
+import os
+from collections import Counter
+
+from schema_index import BM25_B, BM25_K1, SYNONYMS, estimate_tokens, tokenize
+from sql_parser import parse
+
+FEW_SHOT_K = int(os.getenv("FEW_SHOT_K", 3))
+FEW_SHOT_TOKEN_BUDGET = int(os.getenv("FEW_SHOT_TOKEN_BUDGET", 400))
+
+QUESTION_WEIGHT = 1.0
+TABLE_WEIGHT = 0.5
+
+# Examples scoring below this fraction of the best match are not worth the tokens
+MIN_RELATIVE_SCORE = 0.4
+
+
+def sql_shape(sql):
+    """SQL with string and number literals blanked out."""
+    return ' '.join('?' if t.kind in ('string', 'number') else t.value for t in parse(sql).tokens)
+
+
+class FewShotIndex:
+    """BM25 index over dataset examples, selecting the nearest few per question."""
+
+    def __init__(self, examples, k=FEW_SHOT_K, token_budget=FEW_SHOT_TOKEN_BUDGET):
+        """
+        Args:
+            examples (list): (question, sql) pairs
+            k (int): examples per prompt (0 disables)
+            token_budget (int): approximate token cap for the examples section
+        """
+        self.k = k
+        self.token_budget = token_budget
+        self.examples = []
+        self.term_freqs = []
+        for question, sql in examples:
+            text = f"Question: {question}\nSQL: {sql}"
+            self.examples.append((text, estimate_tokens(text), sql_shape(sql)))
+            tf = Counter()
+            for term in tokenize(question):
+                tf[term] += QUESTION_WEIGHT
+            for table in parse(sql).tables:
+                for term in tokenize(table):
+                    tf[term] += TABLE_WEIGHT
+            self.term_freqs.append(tf)
+
+        self.doc_lengths = [sum(tf.values()) for tf in self.term_freqs]
+        self.avg_doc_length = (sum(self.doc_lengths) / len(self.doc_lengths)) if self.doc_lengths else 1.0
+        doc_freq = Counter()
+        for tf in self.term_freqs:
+            doc_freq.update(tf.keys())
+        n = len(self.term_freqs)
+        self.idf = {term: math.log(1 + (n - df + 0.5) / (df + 0.5)) for term, df in doc_freq.items()}
+
+    def score(self, question):
+        """(example position, BM25 score) for the question, highest first (zero scores dropped)."""
+        terms = tokenize(question)
+        terms = Counter(terms + [s for term in terms for s in SYNONYMS.get(term, [])])
+        scores = []
+        for i, tf in enumerate(self.term_freqs):
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[i] / self.avg_doc_length)
+            total = 0.0
+            for term, qf in terms.items():
+                f = tf.get(term)
+                if f:
+                    total += self.idf[term] * qf * f * (BM25_K1 + 1) / (f + norm)
+            if total > 0:
+                scores.append((i, total))
+        return sorted(scores, key=lambda item: (-item[1], item[0]))
+
+    def select(self, question, k=None, token_budget=None):
+        """Prompt texts of the examples for the question, nearest first."""
+        k = self.k if k is None else k
+        token_budget = self.token_budget if token_budget is None else token_budget
+        if k <= 0:
+            return []
+
+        scored = self.score(question)
+        selected = []
+        shapes = set()
+        used = 0
+        for i, score in scored:
+            if len(selected) >= k or score < scored[0][1] * MIN_RELATIVE_SCORE:
+                break
+            text, cost, shape = self.examples[i]
+            if shape in shapes or used + cost > token_budget:
+                continue
+            selected.append(text)
+            shapes.add(shape)
+            used += cost
+        return selected
+
+    def prompt_section(self, question, k=None, token_budget=None):
+        """Examples block for the prompt, or '' when nothing relevant fits."""
+        selected = self.select(question, k=k, token_budget=token_budget)
+        if not selected:
+            return ''
+        return "EXAMPLES:\n" + '\n\n'.join(selected)
+
+    def stats(self):
+        return {'examples': len(self.examples), 'k': self.k, 'token_budget': self.token_budget}
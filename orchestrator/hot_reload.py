@@ -0,0 +1,106 @@
+"""Reload compiled schema and business context when their files change.
+
+A `HotReloader` holds the current snapshot (whatever `build()` returns) and
+polls the size and mtime of the files it was built from every
+CONTEXT_RELOAD_INTERVAL seconds. When they change, a complete new snapshot
+is built off to the side and swapped in with a single reference assignment,
+so a request sees either the old snapshot or the new one, never a mix. If
+the build fails (e.g. a half-written JSON file) the old snapshot stays live
+and the build is retried on the next change. `on_swap(old, new)` runs after
+each swap so dependent caches can be invalidated.
+
+Set CONTEXT_RELOAD_INTERVAL=0 to disable polling.
+"""
+import os
+import threading
+import time
+
+RELOAD_INTERVAL = float(os.getenv("CONTEXT_RELOAD_INTERVAL", 5))
+
+
+def files_signature(paths):
+    """(path, size, mtime_ns) for each existing path; changes when any file does."""
+    signature = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        signature.append((path, st.st_size, st.st_mtime_ns))
+    return tuple(signature)
+
+
+class HotReloader:
+    """Polls watched files and atomically swaps in freshly built snapshots."""
+
+    def __init__(self, build, paths, interval=RELOAD_INTERVAL, on_swap=None, initial=None):
+        """
+        Args:
+            build: callable returning a new snapshot; must not mutate the live one
+            paths: callable returning the files to watch (re-evaluated each poll,
+                so new files matching a glob are picked up)
+            interval (float): seconds between polls; 0 disables polling
+            on_swap: optional callable(old, new) run after a successful swap
+            initial: snapshot to start from (default: `build()`), e.g. one
+                built with fallbacks the reloads should not accept
+        """
+        self._build = build
+        self._paths = paths
+        self.interval = interval
+        self._on_swap = on_swap
+        self._lock = threading.Lock()
+        self._signature = files_signature(paths())
+        self.current = build() if initial is None else initial
+        self.reloads = 0
+        self.failures = 0
+        self.loaded_at = time.time()
+        self.last_error = None
+
+    def check(self) -> bool:
+        """Rebuild and swap if a watched file changed; returns True on a swap."""
+        with self._lock:
+            signature = files_signature(self._paths())
+            if signature == self._signature:
+                return False
+            # Record the signature first: a failed build is retried on the next change only
+            self._signature = signature
+            try:
+                snapshot = self._build()
+            except Exception as e:
+                self.failures += 1
+                self.last_error = str(e)
+                print(f"Context reload failed, keeping the previous version: {e}")
+                return False
+            old, self.current = self.current, snapshot
+            self.reloads += 1
+            self.loaded_at = time.time()
+            self.last_error = None
+        if self._on_swap is not None:
+            self._on_swap(old, snapshot)
+        print(f"Reloaded schema and business context (version {getattr(snapshot, 'version', '?')})")
+        return True
+
+    def start(self):
+        """Start the polling thread (no-op when interval is 0)."""
+        if self.interval <= 0:
+            return
+
+        def loop():
+            while True:
+                time.sleep(self.interval)
+                try:
+                    self.check()
+                except Exception as e:
+                    print(f"Context reload check failed: {e}")
+
+        threading.Thread(target=loop, name='context-reloader', daemon=True).start()
+
+    def stats(self) -> dict:
+        return {
+            'version': getattr(self.current, 'version', None),
+            'loaded_at': self.loaded_at,
+            'reloads': self.reloads,
+            'failures': self.failures,
+            'last_error': self.last_error,
+            'poll_interval': self.interval,
+        }
@@ -0,0 +1,398 @@
+"""
+Ollama HTTP client
+Keeps a persistent keep-alive session to the Ollama servers with split
+connect/read timeouts, jittered exponential backoff between retries and a
+circuit breaker per server that fails fast while it is down. Which server
+serves each attempt is decided by llm_router.
+
+Requests carry Ollama's keep_alive (OLLAMA_KEEP_ALIVE, overridable per model
+with OLLAMA_KEEP_ALIVE_MODELS="llama3:8b=1h,mistral=10m") so a model and
+the KV cache of its last prompt stay loaded between questions; together
+with the stable prompt prefix from prompt_layout, repeat prefixes are not
+prefilled again.
+"""
+
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from contextlib import nullcontext
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", 5))
+READ_TIMEOUT = float(os.getenv("OLLAMA_READ_TIMEOUT", 300))
+POOL_CONNECTIONS = int(os.getenv("OLLAMA_POOL_CONNECTIONS", 4))   # distinct hosts kept
+POOL_MAXSIZE = int(os.getenv("OLLAMA_POOL_MAXSIZE", 20))          # connections per host
+MAX_ATTEMPTS = int(os.getenv("OLLAMA_MAX_ATTEMPTS", 3))
+BACKOFF_BASE = float(os.getenv("OLLAMA_BACKOFF_BASE", 1))
+BACKOFF_MAX = float(os.getenv("OLLAMA_BACKOFF_MAX", 10))
+BREAKER_THRESHOLD = int(os.getenv("OLLAMA_BREAKER_THRESHOLD", 5))
+BREAKER_RESET = float(os.getenv("OLLAMA_BREAKER_RESET", 30))
+# Ollama duration strings ("30m", "1h", "-1" for forever); unset uses the server default
+KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE") or None
+KEEP_ALIVE_MODELS = os.getenv("OLLAMA_KEEP_ALIVE_MODELS", "")
+# Context window sent as options.num_ctx; unset uses the server default
+NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", 0)) or None
+
+
+def parse_model_settings(spec):
+    """{"model": "duration"} from "model=duration,model2=duration"."""
+    overrides = {}
+    for item in spec.split(','):
+        model, sep, duration = item.strip().rpartition('=')
+        if sep and model and duration:
+            overrides[model.strip()] = duration.strip()
+    return overrides
+
+
+class LLMError(Exception):
+    """Generation failed; the message is safe to show to the user."""
+
+
+class CircuitOpenError(LLMError):
+    """Raised without contacting the server while the breaker is open."""
+
+
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_MAX):
+    """Full-jitter exponential backoff for the given 1-based attempt."""
+    return random.uniform(0, min(cap, base * (2 ** (attempt - 1))))
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker.
+
+    After `threshold` consecutive failures the breaker opens and calls are
+    rejected for `reset_timeout` seconds. It then lets a single trial call
+    through (half-open); success closes it, failure opens it again.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, reset_timeout=BREAKER_RESET):
+        self.threshold = max(1, int(threshold))
+        self.reset_timeout = float(reset_timeout)
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self.rejected = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+            self._trial_in_flight = False
+        return self._state
+
+    def allow(self):
+        """True if a call may proceed now."""
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def retry_after(self):
+        """Seconds until the breaker will let a trial call through."""
+        with self._lock:
+            if self._current_state() != self.OPEN:
+                return 0.0
+            return max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.threshold:
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self._current_state(),
+                'consecutive_failures': self._failures,
+                'rejected': self.rejected,
+            }
+
+
+class OllamaClient:
+    """Pooled client for Ollama's /api/generate endpoint on one or more hosts."""
+
+    def __init__(self, router, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                 pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE,
+                 max_attempts=MAX_ATTEMPTS, keep_alive=KEEP_ALIVE,
+                 keep_alive_models=None, scheduler=None, num_ctx=NUM_CTX):
+        """
+        Args:
+            router (llm_router.LLMRouter): picks the backend for each attempt;
+                each backend has its own circuit breaker
+        """
+        self.router = router
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_attempts = max(1, int(max_attempts))
+        # Optional llm_scheduler.ModelScheduler: every call first takes a slot for its model
+        self.scheduler = scheduler
+        self.keep_alive = keep_alive
+        self.keep_alive_models = parse_model_settings(KEEP_ALIVE_MODELS) if keep_alive_models is None \
+            else dict(keep_alive_models)
+        # the same value on every request: changing it makes Ollama reload the model
+        self.num_ctx = num_ctx
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max(pool_connections, len(router.backends)),
+                              pool_maxsize=pool_maxsize, pool_block=False)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def request_body(self, model, prompt, stream=False):
+        """JSON body for /api/generate, with the model's keep_alive and num_ctx when configured."""
+        body = {"model": model, "prompt": prompt, "stream": stream}
+        keep_alive = self.keep_alive_models.get(model, self.keep_alive)
+        if keep_alive is not None:
+            body["keep_alive"] = keep_alive
+        if self.num_ctx:
+            body["options"] = {"num_ctx": self.num_ctx}
+        return body
+
+    def slot(self, model):
+        """Context manager holding a scheduler slot for `model` (no-op without a scheduler)."""
+        return self.scheduler.slot(model) if self.scheduler is not None else nullcontext()
+
+    def pick_backend(self, model, tried):
+        """
+        Reserve the best backend not in `tried` (falling back to any backend
+        once every one has failed); raises CircuitOpenError if all are open.
+        """
+        backend = self.router.choose(model, exclude=tried)
+        if backend is None and tried:
+            backend = self.router.choose(model)
+        if backend is None:
+            raise CircuitOpenError(
+                f"LLM server unavailable (circuit open, retry in {self.router.retry_after():.0f}s)")
+        return backend
+
+    def aslot(self, model):
+        """Async counterpart of `slot`."""
+        return self.scheduler.aslot(model) if self.scheduler is not None else nullcontext()
+
+    def backoff_delay(self, attempt, tried):
+        """Seconds to wait before the next attempt: none until every backend has been tried."""
+        if len(set(tried)) >= len(self.router.backends):
+            tried.clear()
+            return backoff_delay(attempt)
+        return 0
+
+    def backoff(self, attempt, tried):
+        """Sleep before the next attempt only once every backend has been tried."""
+        delay = self.backoff_delay(attempt, tried)
+        if delay:
+            time.sleep(delay)
+
+    def completion(self, backend, response, start):
+        """
+        Completion text of a generate response, releasing `backend`.
+
+        Returns:
+            tuple: (text, None) on success, or (None, error) for a failure
+                the backend's breaker counts and the next attempt retries
+                (5xx, a body that is not JSON such as a truncated or HTML page)
+        Raises LLMError for other responses, which are not retried.
+        """
+        if 500 <= response.status_code < 600:
+            self.router.release(backend, ok=False)
+            return None, f"API returned status code {response.status_code}"
+        if response.status_code != 200:
+            # the server answered, so it is up even if the request was bad
+            self.router.release(backend, time.monotonic() - start)
+            raise LLMError(f"API returned status code {response.status_code}")
+        try:
+            result = response.json()
+        except ValueError:
+            self.router.release(backend, ok=False)
+            return None, "Invalid JSON in response (status 200)"
+        self.router.release(backend, time.monotonic() - start)
+        if not isinstance(result, dict) or 'response' not in result:
+            raise LLMError("Unexpected response format (status 200)")
+        return result['response'], None
+
+    def generate(self, model, prompt):
+        """
+        Return the full completion text for `prompt`.
+
+        Timeouts, connection errors, 5xx responses and unreadable bodies are
+        counted by the backend's circuit breaker and retried on the next best
+        backend, with jittered backoff once every backend has failed; other
+        responses fail at once.
+        """
+        last_err = None
+        tried = []
+        for attempt in range(1, self.max_attempts + 1):
+            # the slot is held per attempt, not across backoff sleeps
+            with self.slot(model):
+                backend = self.pick_backend(model, tried)
+                start = time.monotonic()
+                try:
+                    response = self.session.post(backend.url, json=self.request_body(model, prompt),
+                                                 timeout=self.timeout)
+                except requests.exceptions.Timeout as e:
+                    self.router.release(backend, ok=False)
+                    last_err = f"Timeout: {e}"
+                except requests.exceptions.RequestException as e:
+                    self.router.release(backend, ok=False)
+                    last_err = str(e)
+                else:
+                    text, last_err = self.completion(backend, response, start)
+                    if last_err is None:
+                        return text
+
+            tried.append(backend)
+            if attempt < self.max_attempts:
+                self.backoff(attempt, tried)
+
+        raise LLMError(last_err or 'Unknown error')
+
+    async def agenerate(self, model, prompt, http):
+        """
+        Async `generate` over an httpx.AsyncClient (`http`), with the same
+        slots, failover, breakers and retries; waits never block the loop.
+        """
+        last_err = None
+        tried = []
+        for attempt in range(1, self.max_attempts + 1):
+            async with self.aslot(model):
+                backend = self.pick_backend(model, tried)
+                start = time.monotonic()
+                try:
+                    response = await http.post(backend.url, json=self.request_body(model, prompt))
+                except httpx.TimeoutException as e:
+                    self.router.release(backend, ok=False)
+                    last_err = f"Timeout: {e}"
+                except httpx.HTTPError as e:
+                    self.router.release(backend, ok=False)
+                    last_err = str(e)
+                else:
+                    text, last_err = self.completion(backend, response, start)
+                    if last_err is None:
+                        return text
+
+            tried.append(backend)
+            if attempt < self.max_attempts:
+                delay = self.backoff_delay(attempt, tried)
+                if delay:
+                    await asyncio.sleep(delay)
+
+        raise LLMError(last_err or 'Unknown error')
+
+    def stream(self, model, prompt):
+        """
+        Yield response fragments from Ollama's streaming generate API.
+
+        Closing the generator closes the HTTP response, which makes Ollama stop
+        generating; callers use that to cut generation short. The model's
+        scheduler slot is held from the attempt that opens the response until
+        then. Failures before the response starts fail over to the next
+        backend; as in `generate`, the slot and the backend are given back
+        before any backoff sleep.
+        """
+        last_err = None
+        tried = []
+        for attempt in range(1, self.max_attempts + 1):
+            with self.slot(model):
+                backend, response, last_err = self._open_stream(model, prompt, tried)
+                if response is not None:
+                    yield from self._read_stream(backend, response)
+                    return
+            if attempt < self.max_attempts:
+                self.backoff(attempt, tried)
+        raise LLMError(last_err or 'Unknown error')
+
+    def _open_stream(self, model, prompt, tried):
+        """
+        One attempt at a streaming request.
+
+        Returns:
+            tuple: (backend, response, None) once a backend returned 200, or
+                (None, None, error) after a retryable failure, with the
+                released backend appended to `tried`
+        """
+        backend = self.pick_backend(model, tried)
+        start = time.monotonic()
+        try:
+            response = self.session.post(backend.url, json=self.request_body(model, prompt, stream=True),
+                                         stream=True, timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            self.router.release(backend, ok=False)
+            tried.append(backend)
+            return None, None, str(e)
+        if response.status_code == 200:
+            return backend, response, None
+        response.close()
+        if response.status_code < 500:
+            self.router.release(backend, time.monotonic() - start)
+            raise LLMError(f"API returned status code {response.status_code}")
+        self.router.release(backend, ok=False)
+        tried.append(backend)
+        return None, None, f"API returned status code {response.status_code}"
+
+    def _read_stream(self, backend, response):
+        """Fragments of an open streaming response; releases `backend` at the first chunk."""
+        start = time.monotonic()
+        ok = True
+        first = True
+        try:
+            with response:
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    if chunk.get('error'):
+                        raise LLMError(chunk['error'])
+                    if first:
+                        # time to first chunk: prefill plus queueing on the host
+                        self.router.release(backend, time.monotonic() - start)
+                        first = False
+                    if chunk.get('response'):
+                        yield chunk['response']
+                    if chunk.get('done'):
+                        break
+        except (requests.exceptions.RequestException, ValueError) as e:
+            ok = False
+            raise LLMError(str(e))
+        finally:
+            if first:
+                self.router.release(backend, ok=ok)
+
+
+    def stats(self):
+        return {
+            'connect_timeout': self.timeout[0],
+            'read_timeout': self.timeout[1],
+            'keep_alive': self.keep_alive,
+            'keep_alive_models': self.keep_alive_models,
+            'num_ctx': self.num_ctx,
+            'router': self.router.stats(),
+            'scheduler': self.scheduler.stats() if self.scheduler is not None else None,
+        }
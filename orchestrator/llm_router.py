@@ -0,0 +1,194 @@
+"""
+Routing of Ollama requests across several hosts
+
+OLLAMA_API_URLS lists the generate endpoints of every inference box
+(comma-separated; defaults to OLLAMA_API_URL). Each backend keeps its own
+circuit breaker, a count of requests in flight and an EWMA of its response
+latency. A probe thread polls /api/tags on every backend each
+OLLAMA_PROBE_INTERVAL seconds, as test_connection.py does, to learn whether
+it is up and which models it has pulled.
+
+`choose(model)` picks among backends that are up, whose breaker is not open
+and that have the model (any backend that is up when none lists it), using
+OLLAMA_BALANCE:
+
+* ewma (default) - lowest EWMA latency x (requests in flight + 1), so a slow
+  box only gets work once the fast ones are busy
+* least_outstanding - fewest requests in flight, EWMA latency breaks ties
+
+Callers pass the backends that already failed for a request as `exclude`,
+so the next attempt goes to the next best host (failover).
+"""
+
+import os
+import random
+import threading
+import time
+
+import requests
+
+from llm_client import CircuitBreaker
+
+BALANCE = os.getenv("OLLAMA_BALANCE", "ewma").lower()
+PROBE_INTERVAL = float(os.getenv("OLLAMA_PROBE_INTERVAL", 15))
+PROBE_TIMEOUT = float(os.getenv("OLLAMA_PROBE_TIMEOUT", 3))
+LATENCY_EWMA_ALPHA = 0.3
+BALANCERS = ('ewma', 'least_outstanding')
+
+
+def parse_urls(spec):
+    """Generate URLs from a comma-separated list."""
+    return [url.strip() for url in spec.split(',') if url.strip()]
+
+
+def model_key(name):
+    """Ollama model name with the implicit ':latest' tag made explicit."""
+    return name if ':' in name else f"{name}:latest"
+
+
+class Backend:
+    """One Ollama host and what the router knows about it."""
+
+    def __init__(self, url, breaker=None):
+        self.url = url
+        self.base_url = url.split('/api/')[0]
+        self.breaker = breaker or CircuitBreaker()
+        self.outstanding = 0
+        self.latency = None        # EWMA seconds, None until a request finished
+        self.models = None         # model names from /api/tags, None until probed
+        self.up = True             # assumed up until a probe says otherwise
+        self.requests = 0
+        self.failures = 0
+        self.probe_error = None
+        self.probed_at = None
+
+    def has_model(self, model):
+        return self.models is None or model_key(model) in self.models
+
+    def stats(self):
+        return {
+            'url': self.url,
+            'up': self.up,
+            'circuit': self.breaker.stats(),
+            'outstanding': self.outstanding,
+            'latency_ms': round(self.latency * 1000, 1) if self.latency is not None else None,
+            'requests': self.requests,
+            'failures': self.failures,
+            'models': sorted(self.models) if self.models is not None else None,
+            'probe_error': self.probe_error,
+        }
+
+
+class LLMRouter:
+    """Latency-aware choice of an Ollama backend per request."""
+
+    def __init__(self, urls, balance=BALANCE, probe_interval=PROBE_INTERVAL, probe_timeout=PROBE_TIMEOUT):
+        if not urls:
+            raise ValueError("At least one Ollama URL is required")
+        if balance not in BALANCERS:
+            raise ValueError(f"Unknown OLLAMA_BALANCE '{balance}' (use ewma or least_outstanding)")
+        self.backends = [Backend(url) for url in urls]
+        self.balance = balance
+        self.probe_interval = probe_interval
+        self.probe_timeout = probe_timeout
+        self._lock = threading.Lock()
+        self._probe_session = requests.Session()
+
+    def _score(self, backend):
+        # Backends without a latency sample yet look as fast as the fastest one
+        known = [b.latency for b in self.backends if b.latency is not None]
+        latency = backend.latency if backend.latency is not None else (min(known) if known else 0.0)
+        if self.balance == 'least_outstanding':
+            return backend.outstanding, latency, random.random()
+        return (backend.outstanding + 1) * latency, backend.outstanding, random.random()
+
+    def choose(self, model, exclude=()):
+        """
+        Reserve the best backend for `model`, or None if every candidate is
+        excluded or has an open breaker. Pair with `release`.
+        """
+        rejected = set()
+        while True:
+            with self._lock:
+                candidates = [b for b in self.backends if b not in exclude and b not in rejected
+                              and b.breaker.state != CircuitBreaker.OPEN]
+                # Prefer hosts the probe saw up, but never refuse outright on a stale probe
+                up = [b for b in candidates if b.up]
+                candidates = up or candidates
+                with_model = [b for b in candidates if b.has_model(model)]
+                candidates = with_model or candidates
+                if not candidates:
+                    return None
+                backend = min(candidates, key=self._score)
+                backend.outstanding += 1
+            # A half-open breaker lets one trial request through at a time
+            if backend.breaker.allow():
+                return backend
+            with self._lock:
+                backend.outstanding -= 1
+            rejected.add(backend)
+
+    def release(self, backend, latency=None, ok=True):
+        """Return a backend reserved by `choose`, recording the outcome."""
+        if ok:
+            backend.breaker.record_success()
+        else:
+            backend.breaker.record_failure()
+        with self._lock:
+            backend.outstanding -= 1
+            backend.requests += 1
+            if not ok:
+                backend.failures += 1
+            elif latency is not None:
+                backend.latency = latency if backend.latency is None else \
+                    backend.latency + LATENCY_EWMA_ALPHA * (latency - backend.latency)
+
+    def retry_after(self):
+        """Seconds until some backend's breaker lets a trial request through."""
+        return min(b.breaker.retry_after() for b in self.backends)
+
+    def probe(self, backend):
+        """Refresh one backend's health and model list from /api/tags."""
+        try:
+            response = self._probe_session.get(f"{backend.base_url}/api/tags", timeout=self.probe_timeout)
+            response.raise_for_status()
+            models = {model_key(m['name']) for m in response.json().get('models', [])}
+        except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+            with self._lock:
+                backend.up = False
+                backend.probe_error = str(e)
+                backend.probed_at = time.time()
+            return False
+        with self._lock:
+            backend.up = True
+            backend.models = models
+            backend.probe_error = None
+            backend.probed_at = time.time()
+        return True
+
+    def probe_all(self):
+        for backend in self.backends:
+            self.probe(backend)
+
+    def start_probes(self):
+        """Probe every backend now and then every probe_interval seconds (0 disables)."""
+        if self.probe_interval <= 0:
+            return
+
+        def loop():
+            while True:
+                try:
+                    self.probe_all()
+                except Exception as e:
+                    print(f"Ollama probe failed: {e}")
+                time.sleep(self.probe_interval)
+
+        threading.Thread(target=loop, name='ollama-probe', daemon=True).start()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'balance': self.balance,
+                'probe_interval': self.probe_interval,
+                'backends': [b.stats() for b in self.backends],
+            }
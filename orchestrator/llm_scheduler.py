@@ -0,0 +1,305 @@
+"""
+Per-model scheduler for Ollama requests
+
+Every generation first takes a slot for its model. Requests queue per model
+and are admitted so that the Ollama host swaps weights as rarely as possible:
+
+* at most LLM_MODEL_CONCURRENCY generations run per model (per-model
+  overrides in LLM_MODEL_CONCURRENCY_OVERRIDES="sqlcoder:7b=1,llama3:8b=4")
+* at most LLM_MAX_ACTIVE_MODELS models run at the same time; a waiting model
+  is only brought in once a running one has drained
+* the models that ran last are assumed still loaded on the host and keep
+  being fed from their queues (requests are batched by model) until
+  LLM_MODEL_MAX_BATCH admissions in a row while other models wait, after
+  which the longest-waiting model is loaded next
+* a model whose queue already holds LLM_QUEUE_MAX_DEPTH requests rejects new
+  ones with QueueFullError, carrying a Retry-After estimate from the model's
+  recent generation times; requests still waiting after LLM_QUEUE_TIMEOUT
+  seconds give up with QueueTimeoutError
+* statistics are kept for at most LLM_SCHEDULER_MAX_MODELS models; beyond
+  that the least recently requested idle models are forgotten, so requests
+  naming arbitrary models cannot grow the scheduler's state without bound
+
+Limits are per inference host; with `hosts` > 1 (one per OLLAMA_API_URLS
+entry) both the per-model concurrency and the number of active models are
+multiplied by it, and llm_router spreads the admitted requests over the hosts.
+
+Slots are taken with `slot(model)` from threads or `aslot(model)` on an
+asyncio loop; both share the same queues.
+"""
+
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager, contextmanager
+
+from llm_client import LLMError, parse_model_settings
+
+MODEL_CONCURRENCY = int(os.getenv("LLM_MODEL_CONCURRENCY", 2))
+MODEL_CONCURRENCY_OVERRIDES = os.getenv("LLM_MODEL_CONCURRENCY_OVERRIDES", "")
+MAX_ACTIVE_MODELS = int(os.getenv("LLM_MAX_ACTIVE_MODELS", 1))
+MAX_BATCH = int(os.getenv("LLM_MODEL_MAX_BATCH", 8))
+QUEUE_MAX_DEPTH = int(os.getenv("LLM_QUEUE_MAX_DEPTH", 32))
+QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", 120))
+MAX_TRACKED_MODELS = int(os.getenv("LLM_SCHEDULER_MAX_MODELS", 32))
+
+# Generation time assumed for a model before any has finished (seconds)
+INITIAL_SERVICE_TIME = 5.0
+SERVICE_EWMA_ALPHA = 0.2
+WAIT_SAMPLES = 512
+
+
+class QueueFullError(LLMError):
+    """The model's queue is full; retry after `retry_after` seconds."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class QueueTimeoutError(LLMError):
+    """Waited LLM_QUEUE_TIMEOUT seconds without getting a slot."""
+
+
+class _Ticket:
+    __slots__ = ('model', 'enqueued_at', 'granted', 'notify')
+
+    def __init__(self, model, notify):
+        self.model = model
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+        self.notify = notify
+
+
+class ModelScheduler:
+    """Per-model queues with concurrency limits and batching by model."""
+
+    def __init__(self, concurrency=MODEL_CONCURRENCY, overrides=None, max_active_models=MAX_ACTIVE_MODELS,
+                 max_batch=MAX_BATCH, max_depth=QUEUE_MAX_DEPTH, timeout=QUEUE_TIMEOUT, hosts=1,
+                 max_models=MAX_TRACKED_MODELS):
+        self.hosts = max(1, int(hosts))
+        self.concurrency = max(1, int(concurrency))
+        if overrides is None:
+            overrides = parse_model_settings(MODEL_CONCURRENCY_OVERRIDES)
+        self.overrides = {model: max(1, int(n)) for model, n in overrides.items()}
+        self.max_active_models = max(1, int(max_active_models)) * self.hosts
+        self.max_batch = max(1, int(max_batch))
+        self.max_depth = max(1, int(max_depth))
+        self.timeout = timeout
+        self.max_models = max(1, int(max_models))
+
+        self._lock = threading.Lock()
+        self._queues = defaultdict(deque)      # model -> waiting tickets, oldest first
+        self._running = defaultdict(int)       # model -> generations in progress
+        self._streak = defaultdict(int)        # model -> admissions since it was loaded
+        self._resident = []                    # models assumed loaded, most recent last
+        self._service = {}                     # model -> EWMA of slot hold time (s)
+        self._waits = defaultdict(lambda: deque(maxlen=WAIT_SAMPLES))
+        self._counters = defaultdict(lambda: defaultdict(int))   # least recently requested first
+
+    def limit(self, model):
+        return self.overrides.get(model, self.concurrency) * self.hosts
+
+    # -- admission ----------------------------------------------------------
+
+    def retry_after(self, model):
+        """Seconds until a new request for `model` would likely get a slot."""
+        with self._lock:
+            return self._retry_after(model)
+
+    def _retry_after(self, model):
+        service = self._service.get(model, INITIAL_SERVICE_TIME)
+        depth = len(self._queues.get(model, ()))
+        return max(1, math.ceil(service * (depth + 1) / self.limit(model)))
+
+    def is_full(self, model):
+        with self._lock:
+            return len(self._queues.get(model, ())) >= self.max_depth
+
+    def _enqueue(self, model, notify):
+        """Queue a ticket and run the dispatcher; raises QueueFullError."""
+        with self._lock:
+            self._counters[model] = self._counters.pop(model, None) or defaultdict(int)
+            queue = self._queues[model]
+            if len(queue) >= self.max_depth:
+                self._counters[model]['rejected'] += 1
+                retry_after = self._retry_after(model)
+                if not queue:
+                    del self._queues[model]
+                self._forget_idle()
+                raise QueueFullError(
+                    f"Too many queued requests for model '{model}', retry in {retry_after}s", retry_after)
+            ticket = _Ticket(model, notify)
+            queue.append(ticket)
+            self._dispatch()
+            return ticket
+
+    def _cancel(self, ticket, reason='timeouts'):
+        """Withdraw a waiting ticket; returns False if it was granted meanwhile."""
+        with self._lock:
+            if ticket.granted:
+                return False
+            queue = self._queues.get(ticket.model)
+            if queue is not None:
+                try:
+                    queue.remove(ticket)
+                except ValueError:
+                    pass
+                if not queue:
+                    del self._queues[ticket.model]
+            self._counters[ticket.model][reason] += 1
+            self._dispatch()
+            self._forget_idle()
+            return True
+
+    def _release(self, model, held):
+        """Give back a slot; `held` (seconds) feeds the service time estimate unless None."""
+        with self._lock:
+            self._running[model] -= 1
+            if held is not None:
+                previous = self._service.get(model)
+                self._service[model] = held if previous is None else \
+                    previous + SERVICE_EWMA_ALPHA * (held - previous)
+            if self._running[model] <= 0:
+                del self._running[model]
+            self._dispatch()
+            self._forget_idle()
+
+    def _forget_idle(self):
+        """Drop the state of the least recently requested idle models beyond max_models (lock held)."""
+        excess = len(self._counters) - self.max_models
+        for model in list(self._counters):
+            if excess <= 0:
+                return
+            if model in self._queues or model in self._running or model in self._resident:
+                continue
+            del self._counters[model]
+            self._waits.pop(model, None)
+            self._service.pop(model, None)
+            self._streak.pop(model, None)
+            excess -= 1
+
+    # -- dispatch (lock held) -----------------------------------------------
+
+    def _next_model(self):
+        waiting = sorted((q[0].enqueued_at, m) for m, q in self._queues.items() if q)
+        if not waiting:
+            return None
+
+        def batch_open(model):
+            return self._streak[model] < self.max_batch or len(waiting) == 1
+
+        # Keep feeding models that are running, then loaded ones: no weights to swap in
+        for _, model in waiting:
+            if 0 < self._running.get(model, 0) < self.limit(model) and batch_open(model):
+                return model
+        if len(self._running) >= self.max_active_models:
+            return None
+        for _, model in waiting:
+            if model in self._resident and model not in self._running and batch_open(model):
+                return model
+        # Otherwise load the longest-waiting idle model
+        for _, model in waiting:
+            if model not in self._running:
+                return model
+        return None
+
+    def _dispatch(self):
+        while True:
+            model = self._next_model()
+            if model is None:
+                return
+            queue = self._queues[model]
+            ticket = queue.popleft()
+            if not queue:
+                del self._queues[model]
+            if model not in self._resident or (model not in self._running and self._streak[model] >= self.max_batch):
+                # (re)loaded: a new batch starts
+                if model not in self._resident:
+                    self._counters[model]['loads'] += 1
+                    self._resident.append(model)
+                    for evicted in self._resident[:-self.max_active_models]:
+                        self._streak.pop(evicted, None)
+                    del self._resident[:-self.max_active_models]
+                self._streak[model] = 0
+            self._running[model] += 1
+            self._streak[model] += 1
+            self._counters[model]['admitted'] += 1
+            self._waits[model].append(time.monotonic() - ticket.enqueued_at)
+            ticket.granted = True
+            ticket.notify()
+
+    # -- slots --------------------------------------------------------------
+
+    @contextmanager
+    def slot(self, model):
+        """Hold one of `model`'s generation slots (blocking the calling thread)."""
+        granted = threading.Event()
+        ticket = self._enqueue(model, granted.set)
+        if not granted.wait(self.timeout) and self._cancel(ticket):
+            raise QueueTimeoutError(f"Timed out waiting {self.timeout:.0f}s for model '{model}'")
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(model, time.monotonic() - start)
+
+    @asynccontextmanager
+    async def aslot(self, model):
+        """Async counterpart of `slot`; waiting does not block the event loop."""
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def notify():
+            loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(None))
+
+        ticket = self._enqueue(model, notify)
+        try:
+            await asyncio.wait_for(asyncio.shield(granted), self.timeout)
+        except asyncio.TimeoutError:
+            if self._cancel(ticket):
+                raise QueueTimeoutError(f"Timed out waiting {self.timeout:.0f}s for model '{model}'")
+        except asyncio.CancelledError:
+            # client went away; hand back the slot if it was granted meanwhile
+            if not self._cancel(ticket, 'abandoned'):
+                self._release(model, None)
+            raise
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(model, time.monotonic() - start)
+
+    def stats(self) -> dict:
+        with self._lock:
+            models = set(self._queues) | set(self._running) | set(self._counters)
+            per_model = {}
+            for model in sorted(models):
+                waits = sorted(self._waits[model])
+                counters = self._counters[model]
+                per_model[model] = {
+                    'queued': len(self._queues.get(model, ())),
+                    'running': self._running.get(model, 0),
+                    'limit': self.limit(model),
+                    'admitted': counters['admitted'],
+                    'rejected': counters['rejected'],
+                    'timeouts': counters['timeouts'],
+                    'abandoned': counters['abandoned'],
+                    'loads': counters['loads'],
+                    'wait_ms_avg': round(sum(waits) / len(waits) * 1000, 1) if waits else 0.0,
+                    'wait_ms_p95': round(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000, 1)
+                    if waits else 0.0,
+                    'service_s': round(self._service.get(model, INITIAL_SERVICE_TIME), 2),
+                }
+            return {
+                'hosts': self.hosts,
+                'max_active_models': self.max_active_models,
+                'max_batch': self.max_batch,
+                'max_queue_depth': self.max_depth,
+                'active_models': sorted(self._running),
+                'resident_models': list(self._resident),
+                'models': per_model,
+            }
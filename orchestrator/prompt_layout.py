@@ -0,0 +1,69 @@
+"""
+Prompt layout for SQL generation
+
+Ollama keeps the KV cache of the last prompt each loaded model processed and
+only prefills the tokens after the longest prefix a new prompt shares with
+it. Prompts are therefore split into:
+
+* a prefix that depends only on the compiled schema and business context
+  (instructions, rules, the business summary and the full schema in
+  catalogue order), built once per context version and byte-identical
+  across requests, and
+* a suffix with everything question-specific (retrieved context snippets,
+  the nearest training examples and the question itself), always last.
+
+PROMPT_LAYOUT selects the layout:
+
+* retrieval (default) - only the tables and business-context snippets
+  selected for the question. Prompts are short, ~0.6-1.2k tokens. Tables
+  are listed in catalogue order, so questions that select the same tables
+  still share the whole schema section.
+* prefix - the full schema and business context in a prefix the server
+  caches. Prompts are ~4k tokens, but only the question part is prefilled
+  while the prefix stays cached. It only pays off with a warm, dedicated
+  model. Requests then carry a fixed num_ctx (see context_window) large
+  enough for the prefix, so Ollama's default window does not truncate the
+  prefix and lose the reuse.
+"""
+
+import os
+
+PROMPT_LAYOUT = os.getenv("PROMPT_LAYOUT", "retrieval").lower()
+LAYOUTS = ('prefix', 'retrieval')
+if PROMPT_LAYOUT not in LAYOUTS:
+    raise ValueError(f"Unknown PROMPT_LAYOUT '{PROMPT_LAYOUT}' (use prefix or retrieval)")
+
+# Tokens reserved after the prefix: examples, question and the generated SQL
+SUFFIX_TOKENS = 1024
+# num_ctx is rounded up to this step so small context edits do not change it
+# (a different num_ctx makes Ollama reload the model)
+CONTEXT_STEP = 2048
+# chars/4 undercounts schema text (identifiers, punctuation)
+TOKEN_MARGIN = 1.25
+
+SYSTEM_LINE = "You are a SQL expert for DataSense."
+RULES = "Rules:\n1) Only use tables/columns present above.\n2) Return ONLY the SQL query, no explanation."
+
+
+def build_prefix(schema_text, business_context):
+    """Stable part of the prompt: instructions, business context, schema and rules."""
+    return f"{SYSTEM_LINE}\n\n{business_context}\n\n{schema_text}\n{RULES}\n\n"
+
+
+def build_suffix(question, context_section='', examples_section=''):
+    """Question-specific part of the prompt, appended to the prefix."""
+    context = f"{context_section}\n\n" if context_section else ''
+    examples = f"{examples_section}\n\n" if examples_section else ''
+    return f"{context}{examples}User question: {question}\n\nSQL:"
+
+
+def catalogue_order(catalog, names):
+    """`names` sorted into the order the tables appear in the schema."""
+    position = {name: i for i, name in enumerate(catalog.tables)}
+    return sorted(names, key=lambda name: position.get(name, len(position)))
+
+
+def context_window(prefix_tokens):
+    """num_ctx that holds the prefix plus a question and its answer."""
+    needed = int(prefix_tokens * TOKEN_MARGIN) + SUFFIX_TOKENS
+    return -(-needed // CONTEXT_STEP) * CONTEXT_STEP
@@ -1,42 +1,274 @@
-"""Simple in-memory token store for validated queries.
+"""Token store for validated queries.
 
 This store maps a short UUID token to a validated SQL query and metadata.
 Tokens are short-lived (TTL) and meant to be used by the frontend to request
 an export without resending raw SQL.
+
+Two backends, selected with QUERY_STORE_BACKEND:
+
+* memory (default) - per-process, bounded to QUERY_STORE_MAX_TOKENS (oldest
+  evicted first). Expiry times are bucketed per second, so the background
+  sweeper drops everything that expired since its last run without scanning
+  live tokens.
+* sqlite - a shared file (QUERY_STORE_PATH) so tokens created by one gunicorn
+  worker can be used for exports handled by another.
+
+The module-level functions operate on the backend chosen at import time.
 """
+import json
+import os
+import sqlite3
+import threading
 import time
 import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict, defaultdict
 from typing import Optional
 
-_STORE = {}
-
 DEFAULT_TTL = 60 * 15  # 15 minutes
 
+BACKEND = os.getenv("QUERY_STORE_BACKEND", "memory").lower()
+MAX_TOKENS = int(os.getenv("QUERY_STORE_MAX_TOKENS", 10000))
+SWEEP_INTERVAL = float(os.getenv("QUERY_STORE_SWEEP_INTERVAL", 30))
+SQLITE_PATH = os.getenv("QUERY_STORE_PATH", "query_tokens.sqlite3")
+
+
+class TokenStore(ABC):
+    """Interface shared by the token store backends."""
+
+    @abstractmethod
+    def create(self, sql: str, ttl: int = DEFAULT_TTL, meta: Optional[dict] = None) -> str:
+        """Store `sql` and return a new token."""
+
+    @abstractmethod
+    def get(self, token: str) -> Optional[dict]:
+        """Item for a live token, or None."""
+
+    @abstractmethod
+    def delete(self, token: str) -> None:
+        """Forget a token."""
+
+    @abstractmethod
+    def update_meta(self, token: str, fields: dict) -> bool:
+        """Merge `fields` into a live token's metadata; False if it is gone."""
+
+    @abstractmethod
+    def sweep(self) -> int:
+        """Remove expired (and over-capacity) tokens; returns how many were removed."""
+
+    @abstractmethod
+    def stats(self) -> dict:
+        """Backend counters for /api/health."""
+
+    def start_sweeper(self, interval=SWEEP_INTERVAL):
+        def loop():
+            while not self._stop.wait(interval):
+                try:
+                    self.sweep()
+                except Exception as e:
+                    print(f"Token sweep failed: {e}")
+
+        self._stop = threading.Event()
+        threading.Thread(target=loop, name='token-sweeper', daemon=True).start()
+
+    def close(self):
+        stop = getattr(self, '_stop', None)
+        if stop is not None:
+            stop.set()
+
+
+class MemoryTokenStore(TokenStore):
+    """Bounded in-process store with per-second expiry buckets."""
+
+    def __init__(self, max_tokens=MAX_TOKENS):
+        self.max_tokens = max(1, int(max_tokens))
+        self._items = OrderedDict()          # token -> item, oldest first
+        self._buckets = defaultdict(set)     # int(expires_at) -> tokens
+        self._swept_until = int(time.time())
+        self._lock = threading.Lock()
+        self.evicted = 0
+        self.expired = 0
+
+    def create(self, sql, ttl=DEFAULT_TTL, meta=None):
+        token = uuid.uuid4().hex
+        now = time.time()
+        item = {
+            "sql": sql,
+            "created_at": now,
+            "expires_at": now + ttl,
+            "meta": meta or {}
+        }
+        with self._lock:
+            self._items[token] = item
+            self._buckets[int(item["expires_at"])].add(token)
+            while len(self._items) > self.max_tokens:
+                self._remove(next(iter(self._items)))
+                self.evicted += 1
+        return token
+
+    def get(self, token):
+        with self._lock:
+            item = self._items.get(token)
+            if item is None:
+                return None
+            if item["expires_at"] < time.time():
+                self._remove(token)
+                self.expired += 1
+                return None
+            return item
+
+    def delete(self, token):
+        with self._lock:
+            self._remove(token)
+
+    def update_meta(self, token, fields):
+        item = self.get(token)
+        if item is None:
+            return False
+        with self._lock:
+            item["meta"].update(fields)
+        return True
+
+    def _remove(self, token):
+        item = self._items.pop(token, None)
+        if item is None:
+            return
+        bucket = int(item["expires_at"])
+        tokens = self._buckets.get(bucket)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._buckets[bucket]
+
+    def sweep(self):
+        now = int(time.time())
+        removed = 0
+        with self._lock:
+            # Every bucket strictly before the current second has fully expired
+            for bucket in range(self._swept_until, now):
+                for token in self._buckets.pop(bucket, ()):
+                    self._items.pop(token, None)
+                    removed += 1
+            self._swept_until = max(self._swept_until, now)
+            self.expired += removed
+        return removed
+
+    def stats(self):
+        with self._lock:
+            return {
+                'backend': 'memory',
+                'size': len(self._items),
+                'max_tokens': self.max_tokens,
+                'expired': self.expired,
+                'evicted': self.evicted,
+            }
+
+
+class SQLiteTokenStore(TokenStore):
+    """Tokens in a SQLite file shared by every worker process on the host."""
+
+    def __init__(self, path=SQLITE_PATH, max_tokens=MAX_TOKENS):
+        self.path = path
+        self.max_tokens = max(1, int(max_tokens))
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS tokens ("
+                " token TEXT PRIMARY KEY, sql TEXT NOT NULL, created_at REAL NOT NULL,"
+                " expires_at REAL NOT NULL, meta TEXT NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS tokens_expires_at ON tokens (expires_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS tokens_created_at ON tokens (created_at)")
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def create(self, sql, ttl=DEFAULT_TTL, meta=None):
+        token = uuid.uuid4().hex
+        now = time.time()
+        self._connect().execute(
+            "INSERT INTO tokens (token, sql, created_at, expires_at, meta) VALUES (?, ?, ?, ?, ?)",
+            (token, sql, now, now + ttl, json.dumps(meta or {}, default=str))
+        )
+        return token
+
+    def get(self, token):
+        row = self._connect().execute(
+            "SELECT sql, created_at, expires_at, meta FROM tokens WHERE token = ? AND expires_at >= ?",
+            (token, time.time())
+        ).fetchone()
+        if row is None:
+            return None
+        return {"sql": row[0], "created_at": row[1], "expires_at": row[2], "meta": json.loads(row[3])}
+
+    def delete(self, token):
+        self._connect().execute("DELETE FROM tokens WHERE token = ?", (token,))
+
+    def update_meta(self, token, fields):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT meta FROM tokens WHERE token = ? AND expires_at >= ?", (token, time.time())
+            ).fetchone()
+            if row is not None:
+                meta = json.loads(row[0])
+                meta.update(fields)
+                conn.execute("UPDATE tokens SET meta = ? WHERE token = ?", (json.dumps(meta, default=str), token))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return row is not None
+
+    def sweep(self):
+        conn = self._connect()
+        removed = conn.execute("DELETE FROM tokens WHERE expires_at < ?", (time.time(),)).rowcount
+        excess = conn.execute("SELECT COUNT(*) FROM tokens").fetchone()[0] - self.max_tokens
+        if excess > 0:
+            removed += conn.execute(
+                "DELETE FROM tokens WHERE token IN (SELECT token FROM tokens ORDER BY created_at LIMIT ?)",
+                (excess,)
+            ).rowcount
+        return removed
+
+    def stats(self):
+        size = self._connect().execute("SELECT COUNT(*) FROM tokens").fetchone()[0]
+        return {'backend': 'sqlite', 'path': self.path, 'size': size, 'max_tokens': self.max_tokens}
+
+
+def open_store(backend=BACKEND) -> TokenStore:
+    if backend == 'sqlite':
+        store = SQLiteTokenStore()
+    elif backend == 'memory':
+        store = MemoryTokenStore()
+    else:
+        raise ValueError(f"Unknown QUERY_STORE_BACKEND '{backend}' (use memory or sqlite)")
+    store.start_sweeper()
+    return store
+
+
+STORE = open_store()
+
+
 def create_token(sql: str, ttl: int = DEFAULT_TTL, meta: Optional[dict] = None) -> str:
-    token = uuid.uuid4().hex
-    _STORE[token] = {
-        "sql": sql,
-        "created_at": time.time(),
-        "expires_at": time.time() + ttl,
-        "meta": meta or {}
-    }
-    return token
+    return STORE.create(sql, ttl, meta)
 
 def get_query(token: str) -> Optional[dict]:
-    item = _STORE.get(token)
-    if not item:
-        return None
-    if item.get("expires_at", 0) < time.time():
-        # expired
-        try:
-            del _STORE[token]
-        except KeyError:
-            pass
-        return None
-    return item
+    return STORE.get(token)
 
 def delete_token(token: str) -> None:
-    try:
-        del _STORE[token]
-    except KeyError:
-        pass
+    STORE.delete(token)
+
+def update_meta(token: str, **fields) -> bool:
+    """Merge `fields` into a live token's metadata; False if the token is gone."""
+    return STORE.update_meta(token, fields)
+
+def stats() -> dict:
+    return STORE.stats()
@@ -3,16 +3,31 @@ Query Validator
 Validates SQL queries before execution for safety
 """
 
-import re
+from sql_parser import bare_column_tokens, identifier, parse, tokenize
 
 class QueryValidator:
     """Validate SQL queries for safety and correctness"""
     
     # Allowed SQL keywords for read-only operations
-    ALLOWED_KEYWORDS = ['SELECT', 'SHOW', 'DESCRIBE', 'DESC', 'EXPLAIN']
+    ALLOWED_KEYWORDS = ['SELECT', 'WITH', 'SHOW', 'DESCRIBE', 'DESC', 'EXPLAIN']
     
-    # Dangerous keywords that modify data
-    DANGEROUS_KEYWORDS = ['INSERT', 'UPDATE', 'DELETE', 'DROP', 'CREATE', 'ALTER', 'TRUNCATE', 'GRANT', 'REVOKE']
+    # Dangerous keywords that modify data (matched as whole words, so created_at is fine)
+    DANGEROUS_KEYWORDS = ['INSERT', 'UPDATE', 'DELETE', 'DROP', 'CREATE', 'ALTER', 'TRUNCATE', 'GRANT',
+                          'REVOKE', 'INTO', 'LOCK']
+
+    # Functions that read files or stall the server
+    DANGEROUS_FUNCTIONS = ['LOAD_FILE', 'SLEEP', 'BENCHMARK', 'GET_LOCK']
+
+    def __init__(self, catalog=None, database=None):
+        """
+        Args:
+            catalog (SchemaCatalog): optional schema catalogue; when given,
+                SELECTs may only read its tables and columns
+            database (str): the only schema tables may be qualified with
+                (default: the catalogue's database)
+        """
+        self.columns_by_table = catalog.column_sets if catalog is not None else None
+        self.database = database or (catalog.database if catalog is not None else None)
     
     @staticmethod
     def is_select_query(query):
@@ -20,10 +35,14 @@ class QueryValidator:
         query_upper = query.strip().upper()
         return query_upper.startswith('SELECT')
     
-    @staticmethod
-    def is_safe_query(query):
+    def is_safe_query(self, query):
         """
-        Check if query is safe to execute (read-only)
+        Check if query is safe to execute (read-only, single statement and,
+        with a schema, limited to known tables and columns)
+
+        Unqualified column names are checked against the columns of all
+        tables the query reads. When it reads a CTE or derived table, whose
+        columns are not catalogued, only qualified columns are checked.
         
         Args:
             query (str): SQL query to validate
@@ -31,48 +50,85 @@ class QueryValidator:
         Returns:
             tuple: (is_safe, message)
         """
-        query_upper = query.strip().upper()
-        
-        # Check for dangerous keywords
+        parsed = parse(query)
+
+        if not parsed.tokens:
+            return False, "❌ Query is empty."
+
+        if parsed.statements > 1:
+            return False, "❌ Only a single SQL statement is allowed."
+
+        # MySQL runs the body of /*! ... */ comments, so they can hide SQL
+        if any(comment.startswith('/*!') for comment in parsed.comments):
+            return False, "❌ Query contains potentially dangerous patterns."
+
+        if parsed.kind not in QueryValidator.ALLOWED_KEYWORDS:
+            return False, "❌ Only SELECT, SHOW, DESCRIBE queries are allowed."
+
+        # Check for dangerous keywords (INTO OUTFILE, FOR UPDATE, ... inside a SELECT)
         for keyword in QueryValidator.DANGEROUS_KEYWORDS:
-            if keyword in query_upper:
+            if keyword in parsed.words:
                 return False, f"❌ Query contains dangerous keyword: {keyword}. Only SELECT queries are allowed."
-        
-        # Check if it starts with allowed keywords
-        starts_with_allowed = any(query_upper.startswith(kw) for kw in QueryValidator.ALLOWED_KEYWORDS)
-        
-        if not starts_with_allowed:
-            return False, "❌ Only SELECT, SHOW, DESCRIBE queries are allowed."
-        
-        # Basic check for SQL injection patterns
-        dangerous_patterns = [
-            r';\s*DROP',
-            r';\s*DELETE',
-            r';\s*INSERT',
-            r';\s*UPDATE',
-            r'--',  # SQL comments
-            r'/\*.*\*/',  # Multi-line comments
-        ]
-        
-        for pattern in dangerous_patterns:
-            if re.search(pattern, query_upper):
-                return False, "❌ Query contains potentially dangerous patterns."
+
+        tokens = parsed.tokens
+        for i, token in enumerate(tokens[:-1]):
+            if token.kind == 'word' and token.value in QueryValidator.DANGEROUS_FUNCTIONS and tokens[i + 1].value == '(':
+                return False, f"❌ Query calls a disallowed function: {token.value}."
+
+        if self.columns_by_table is not None and parsed.is_query:
+            other_schemas = sorted(parsed.schemas - {(self.database or '').lower()})
+            if other_schemas:
+                return False, f"❌ Only tables of the {self.database or 'configured'} database are allowed " \
+                              f"(found: {', '.join(other_schemas)})."
+            unknown = sorted(parsed.tables - self.columns_by_table.keys())
+            if unknown:
+                return False, f"❌ Unknown table(s): {', '.join(unknown)}."
+            for qualifier, column in parsed.column_refs:
+                if qualifier not in parsed.aliases:
+                    return False, f"❌ Unknown table or alias: {qualifier}."
+                table = parsed.aliases[qualifier]
+                # Derived tables and CTEs have no catalogued columns
+                if table is not None and column not in self.columns_by_table[table]:
+                    return False, f"❌ Unknown column: {qualifier}.{column}."
+            if None not in parsed.aliases.values():
+                columns = set().union(*(self.columns_by_table[table] for table in parsed.tables))
+                for i in bare_column_tokens(parsed):
+                    column = identifier(parsed.tokens[i]).lower()
+                    if column not in columns:
+                        return False, f"❌ Unknown column: {column}."
         
         return True, "✅ Query is safe to execute."
     
     @staticmethod
     def clean_query(query):
         """Clean and format SQL query"""
-        # Remove extra whitespace
-        query = re.sub(r'\s+', ' ', query.strip())
-        
+        query = query.strip()
+
         # Remove markdown code blocks if present
         if query.startswith('```'):
             lines = query.split('\n')
             query = '\n'.join([line for line in lines if not line.startswith('```')])
             query = query.strip()
-        
+
+        # Drop comments and collapse whitespace between tokens. Working on the
+        # tokens keeps string literals intact and stops a "-- comment" from
+        # swallowing the rest of the statement once it is on one line.
+        # /*! ... */ is kept: MySQL executes it, so the validator rejects it.
+        parts = []
+        previous_end = None
+        for token in tokenize(query, keep_comments=True):
+            if token.kind == 'comment' and not token.text.startswith('/*!'):
+                # a comment separates tokens like whitespace does
+                if previous_end is not None:
+                    previous_end = -1
+                continue
+            if previous_end is not None and token.start != previous_end:
+                parts.append(' ')
+            parts.append(token.text)
+            previous_end = token.end
+        query = ''.join(parts)
+
         # Remove trailing semicolons (will be added back if needed)
-        query = query.rstrip(';')
-        
+        query = query.rstrip(';').rstrip()
+
         return query
@@ -0,0 +1,150 @@
+"""Bounded cache of preview query results with table-aware expiry.
+
+Preview rows/columns are cached by normalized SQL. Each entry's TTL is the
+shortest TTL among the tables the query reads, so queries over high-churn
+tables (invoices, inventory_transactions, ...) expire quickly while lookups
+on reference tables (products, vehicles, ...) stay cached for longer. Writes
+executed through the API invalidate every entry that touches a written table.
+
+Per-table TTLs can be overridden with RESULT_CACHE_TABLE_TTLS, e.g.
+"invoices=5,products=900".
+"""
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from typing import Optional
+
+from sql_parser import parse
+
+DEFAULT_TTL = int(os.getenv("RESULT_CACHE_TTL", 60))
+DEFAULT_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", 256))
+
+# Seconds; tables not listed use DEFAULT_TTL
+TABLE_TTLS = {
+    # high-churn transactional tables
+    'inventory_transactions': 10,
+    'invoices': 15,
+    'invoice_items': 15,
+    'orders': 15,
+    'order_items': 15,
+    'payments': 15,
+    'load_plans': 30,
+    'load_plan_items': 30,
+    # reference data
+    'products': 600,
+    'vehicles': 1800,
+    'distributors': 1800,
+}
+
+
+def _parse_table_ttls(spec):
+    ttls = {}
+    for part in (spec or '').split(','):
+        name, _, seconds = part.partition('=')
+        if name.strip() and seconds.strip():
+            ttls[name.strip().lower()] = int(seconds)
+    return ttls
+
+
+TABLE_TTLS.update(_parse_table_ttls(os.getenv("RESULT_CACHE_TABLE_TTLS")))
+
+
+def normalize_sql(sql):
+    """Collapse whitespace, drop comments and trailing semicolons, lowercase outside literals."""
+    return parse(sql).normalized
+
+
+class ResultCache:
+    """Thread-safe LRU cache of (rows, columns) keyed on normalized SQL."""
+
+    def __init__(self, table_names=(), max_entries=DEFAULT_MAX_ENTRIES, default_ttl=DEFAULT_TTL,
+                 table_ttls=None):
+        self.max_entries = max(1, int(max_entries))
+        self.default_ttl = default_ttl
+        self.table_ttls = dict(TABLE_TTLS if table_ttls is None else table_ttls)
+        self.table_names = {t.lower() for t in table_names}
+        self._entries = OrderedDict()          # key -> (rows, columns, tables, expires_at)
+        self._by_table = defaultdict(set)      # table -> keys
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def tables_in(self, sql):
+        """Known schema tables named anywhere in the query (outside string literals)."""
+        return parse(sql).identifiers & self.table_names
+
+    def ttl_for(self, tables):
+        if not tables:
+            return self.default_ttl
+        return min(self.table_ttls.get(t, self.default_ttl) for t in tables)
+
+    def get(self, sql) -> Optional[tuple]:
+        key = normalize_sql(sql)
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            rows, columns, _, expires_at = item
+            if expires_at < time.time():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return rows, columns
+
+    def set(self, sql, rows, columns) -> None:
+        key = normalize_sql(sql)
+        tables = self.tables_in(key)
+        ttl = self.ttl_for(tables)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (rows, columns, tables, time.time() + ttl)
+            for table in tables:
+                self._by_table[table].add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate_tables(self, tables) -> int:
+        """Drop every entry that reads any of `tables`; returns the number removed."""
+        removed = 0
+        with self._lock:
+            for table in tables:
+                for key in list(self._by_table.get(table.lower(), ())):
+                    self._remove(key)
+                    removed += 1
+            self.invalidations += removed
+        return removed
+
+    def _remove(self, key):
+        item = self._entries.pop(key, None)
+        if item is None:
+            return
+        for table in item[2]:
+            keys = self._by_table.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_table[table]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._by_table.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            }
@@ -0,0 +1,259 @@
+"""Page through a query result beyond the preview.
+
+Two strategies, chosen per query:
+
+* keyset: single-table queries without JOIN/GROUP BY/DISTINCT/ORDER BY/LIMIT
+  whose table has a single-column primary key (from database_schema.json)
+  are re-run one page at a time as
+  ``SELECT * FROM (<query>) AS _page WHERE pk > <last> ORDER BY pk LIMIT n``.
+  Every page is an index range scan, so page 1000 costs the same as page 1
+  and no server state is kept between requests.
+* cursor: anything else keeps its server-side cursor (and pooled connection)
+  open between requests and continues reading where the last page stopped.
+  Cursors are closed after IDLE_TIMEOUT seconds without a request, and at most
+  MAX_CURSORS are held at once (least recently used is closed first). A
+  request for an offset the open cursor has already passed re-runs the query.
+
+Page positions are returned to the client as an opaque `next_cursor` string.
+"""
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from result_cache import normalize_sql
+
+DEFAULT_PAGE_SIZE = int(os.getenv("QUERY_PAGE_SIZE", 100))
+MAX_PAGE_SIZE = int(os.getenv("QUERY_PAGE_MAX_SIZE", 1000))
+IDLE_TIMEOUT = int(os.getenv("QUERY_CURSOR_IDLE_TIMEOUT", 120))
+MAX_CURSORS = int(os.getenv("QUERY_CURSOR_MAX_OPEN", 4))
+# Tokens remembered as not keyset-pageable
+MAX_NO_KEYSET = 1024
+# Rows read per fetch while skipping to an offset after a cursor is reopened
+SKIP_BATCH = 5000
+
+_KEYSET_SHAPE = re.compile(
+    r'^select\s+(?P<select>.+?)\s+from\s+`?(?P<table>[a-z_][a-z0-9_]*)`?'
+    r'(?:\s+(?!where\b)(?:as\s+)?[a-z_][a-z0-9_]*)?'
+    r'(?:\s+where\s+.+)?$',
+    re.DOTALL
+)
+_NOT_KEYSET = re.compile(r'\b(?:join|union|group\s+by|distinct|having|order\s+by|limit|offset)\b|\(\s*select\b')
+
+
+class CursorError(ValueError):
+    """Malformed or mismatched `cursor` value from the client."""
+
+
+def encode_cursor(kind, value):
+    return f"{kind}:{json.dumps(value, default=str, separators=(',', ':'))}"
+
+
+def decode_cursor(cursor):
+    """Return ('keyset', last key) or ('offset', row offset) for a client cursor."""
+    kind, _, raw = str(cursor).partition(':')
+    try:
+        value = json.loads(raw)
+    except ValueError:
+        raise CursorError('Malformed cursor')
+    if kind == 'k':
+        return 'keyset', value
+    if kind == 'o' and isinstance(value, int) and value >= 0:
+        return 'offset', value
+    raise CursorError('Malformed cursor')
+
+
+class _OpenCursor:
+    def __init__(self, rows, columns):
+        self.rows = rows
+        self.columns = columns
+        self.position = 0
+        self.pending = []
+        self.last_used = time.time()
+
+    def close(self):
+        self.rows.close()
+
+
+class ResultPager:
+    """Serves pages of a stored query via keyset pagination or retained cursors."""
+
+    def __init__(self, db, primary_keys=None, idle_timeout=IDLE_TIMEOUT, max_cursors=MAX_CURSORS):
+        self.db = db
+        self.primary_keys = primary_keys or {}
+        self.idle_timeout = idle_timeout
+        self.max_cursors = max(1, int(max_cursors))
+        self._cursors = OrderedDict()   # token -> _OpenCursor
+        self._no_keyset = OrderedDict()  # tokens whose keyset query failed
+        self._lock = threading.Lock()
+        self.keyset_pages = 0
+        self.cursor_pages = 0
+        self.reopens = 0
+        self.expired = 0
+        sweeper = threading.Thread(target=self._sweep_loop, name='result-pager-sweeper', daemon=True)
+        sweeper.start()
+
+    def keyset_column(self, sql) -> Optional[str]:
+        """Primary key to paginate `sql` on, or None if keyset pagination is not safe."""
+        normalized = normalize_sql(sql)
+        if _NOT_KEYSET.search(normalized):
+            return None
+        match = _KEYSET_SHAPE.match(normalized)
+        if not match:
+            return None
+        pk = self.primary_keys.get(match.group('table'))
+        if not pk:
+            return None
+        select = match.group('select')
+        if select.strip() == '*' or select.endswith('.*') or re.search(rf'\b{re.escape(pk.lower())}\b', select):
+            return pk
+        return None
+
+    def page(self, token, sql, cursor=None, page_size=DEFAULT_PAGE_SIZE):
+        """
+        Fetch one page of `sql` for export token `token`.
+
+        Returns:
+            tuple: (success, dict with rows/columns/has_more/next_cursor/pagination
+                    or an error message)
+        Raises:
+            CursorError: if `cursor` is malformed or does not match the query
+        """
+        kind, value = decode_cursor(cursor) if cursor else (None, None)
+        pk = None if token in self._no_keyset else self.keyset_column(sql)
+
+        if kind == 'keyset':
+            if not pk:
+                raise CursorError('Cursor does not match this query')
+            return self._keyset_page(sql, pk, value, page_size)
+        if kind is None and pk:
+            ok, result = self._keyset_page(sql, pk, None, page_size)
+            if ok:
+                return ok, result
+            # e.g. the key column is aliased away; remember and use a cursor instead
+            with self._lock:
+                self._no_keyset[token] = True
+                if len(self._no_keyset) > MAX_NO_KEYSET:
+                    self._no_keyset.popitem(last=False)
+        return self._cursor_page(token, sql, value or 0, page_size)
+
+    def _keyset_page(self, sql, pk, after, page_size):
+        inner = sql.strip().rstrip(';')
+        where = ''
+        params = None
+        if after is not None:
+            # pymysql only %-formats the query when parameters are passed, so
+            # literal '%' is doubled only then
+            inner = inner.replace('%', '%%')
+            where = f" WHERE _page.`{pk}` > %s"
+            params = (after,)
+        query = f"SELECT * FROM ({inner}) AS _page{where} ORDER BY _page.`{pk}` LIMIT {int(page_size) + 1}"
+        ok, rows, columns = self.db.execute_query(query, params)
+        if not ok:
+            return False, rows
+        if columns.count(pk) != 1:
+            return False, f"Key column '{pk}' is not uniquely present in the result"
+
+        has_more = len(rows) > page_size
+        rows = list(rows[:page_size])
+        with self._lock:
+            self.keyset_pages += 1
+        return True, {
+            'rows': rows,
+            'columns': columns,
+            'has_more': has_more,
+            'next_cursor': encode_cursor('k', rows[-1][columns.index(pk)]) if has_more else None,
+            'pagination': 'keyset'
+        }
+
+    def _cursor_page(self, token, sql, offset, page_size):
+        with self._lock:
+            entry = self._cursors.pop(token, None)
+        try:
+            if entry is None or entry.position != offset:
+                if entry is not None:
+                    entry.close()
+                    with self._lock:
+                        self.reopens += 1
+                entry = self._open(sql, offset)
+
+            rows = entry.pending + entry.rows.fetch(page_size + 1 - len(entry.pending))
+        except Exception as e:
+            if entry is not None:
+                entry.close()
+            return False, str(e)
+
+        has_more = len(rows) > page_size
+        entry.pending = rows[page_size:]
+        rows = rows[:page_size]
+        entry.position += len(rows)
+        entry.last_used = time.time()
+        if has_more:
+            self._retain(token, entry)
+        else:
+            entry.close()
+
+        with self._lock:
+            self.cursor_pages += 1
+        return True, {
+            'rows': rows,
+            'columns': entry.columns,
+            'has_more': has_more,
+            'next_cursor': encode_cursor('o', entry.position) if has_more else None,
+            'pagination': 'cursor'
+        }
+
+    def _open(self, sql, offset):
+        columns, rows = self.db.stream_query_with_columns(sql.strip().rstrip(';'))
+        entry = _OpenCursor(rows, columns)
+        while entry.position < offset:
+            skipped = len(rows.fetch(min(SKIP_BATCH, offset - entry.position)))
+            if not skipped:
+                break
+            entry.position += skipped
+        return entry
+
+    def _retain(self, token, entry):
+        evicted = []
+        with self._lock:
+            previous = self._cursors.pop(token, None)
+            if previous is not None:
+                evicted.append(previous)
+            self._cursors[token] = entry
+            while len(self._cursors) > self.max_cursors:
+                evicted.append(self._cursors.popitem(last=False)[1])
+        for old in evicted:
+            old.close()
+
+    def sweep(self) -> int:
+        """Close cursors idle for longer than idle_timeout; returns how many were closed."""
+        cutoff = time.time() - self.idle_timeout
+        with self._lock:
+            stale = [t for t, entry in self._cursors.items() if entry.last_used < cutoff]
+            closed = [self._cursors.pop(t) for t in stale]
+            self.expired += len(closed)
+        for entry in closed:
+            entry.close()
+        return len(closed)
+
+    def _sweep_loop(self):
+        while True:
+            time.sleep(max(1, self.idle_timeout / 2))
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Cursor sweep failed: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'open_cursors': len(self._cursors),
+                'max_cursors': self.max_cursors,
+                'keyset_pages': self.keyset_pages,
+                'cursor_pages': self.cursor_pages,
+                'reopens': self.reopens,
+                'expired': self.expired,
+            }
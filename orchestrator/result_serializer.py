@@ -0,0 +1,79 @@
+"""JSON serialization of query results.
+
+All /api/query responses go through `serialize_columns`, which converts a
+result set column by column: the column type is taken from its first
+non-NULL value, native JSON types (int, float, bool, str) pass through
+untouched, and DECIMAL/DATE/DATETIME/TIME/binary values are rendered with
+str() so DECIMAL precision is never lost to float. The row-of-dicts shape is
+built from those columns; the columnar shape returns them directly together
+with the declared types, which avoids repeating every column name per row.
+"""
+import datetime
+from decimal import Decimal
+
+ROW_SHAPES = ('rows', 'columnar')
+
+# Types that JSON encodes natively and are passed through as-is
+_PASSTHROUGH = ('int', 'float', 'bool', 'string', 'null')
+
+
+def value_type(value):
+    """Declared type name for one non-NULL value."""
+    if isinstance(value, bool):
+        return 'bool'
+    if isinstance(value, int):
+        return 'int'
+    if isinstance(value, float):
+        return 'float'
+    if isinstance(value, Decimal):
+        return 'decimal'
+    if isinstance(value, datetime.datetime):
+        return 'datetime'
+    if isinstance(value, datetime.date):
+        return 'date'
+    if isinstance(value, datetime.timedelta):
+        return 'time'
+    if isinstance(value, (bytes, bytearray)):
+        return 'binary'
+    if isinstance(value, str):
+        return 'string'
+    return 'other'
+
+
+def serialize_columns(rows, width):
+    """
+    Convert result tuples to JSON-safe column arrays.
+
+    Returns:
+        tuple: (list of column value lists, list of declared type names)
+    """
+    if not rows:
+        return [[] for _ in range(width)], ['null'] * width
+
+    arrays = []
+    types = []
+    for values in zip(*rows):
+        first = next((v for v in values if v is not None), None)
+        kind = 'null' if first is None else value_type(first)
+        if kind in _PASSTHROUGH:
+            arrays.append(list(values))
+        else:
+            arrays.append([None if v is None else str(v) for v in values])
+        types.append(kind)
+    return arrays, types
+
+
+def rows_to_dicts(rows, columns):
+    """Convert result tuples to JSON-safe dicts (non-native values as strings)"""
+    arrays, _ = serialize_columns(rows, len(columns))
+    return [dict(zip(columns, values)) for values in zip(*arrays)]
+
+
+def columnar(rows, columns):
+    """Column-oriented payload: {'columns', 'column_types', 'data'}"""
+    arrays, types = serialize_columns(rows, len(columns))
+    return {
+        'columns': columns,
+        'column_types': types,
+        'data': arrays
+    }
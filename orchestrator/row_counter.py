@@ -0,0 +1,134 @@
+"""Background row counts for results that exceed the preview.
+
+When a query returns more than the preview, a count job is queued for its
+export token. The job first asks EXPLAIN for the optimizer's row estimate;
+if that is below COUNT_EXACT_MAX_ESTIMATE it runs
+``SELECT COUNT(*) FROM (<query>) AS _count`` capped by MySQL's
+MAX_EXECUTION_TIME hint. The outcome is stored in the token's metadata under
+"row_count":
+
+    {"status": "pending" | "exact" | "estimated" | "failed",
+     "rows": <int or None>, "elapsed_ms": <int>}
+
+"estimated" means the exact count was skipped or timed out and `rows` is the
+EXPLAIN estimate (rows examined, so usually an upper bound).
+
+At most ROW_COUNT_MAX_PENDING jobs are queued or running at once; further
+requests are refused (`start` returns False) rather than piling up full
+aggregates behind a burst of queries.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from query_store import get_query, update_meta
+
+COUNT_WORKERS = int(os.getenv("ROW_COUNT_WORKERS", 2))
+COUNT_TIMEOUT_MS = int(os.getenv("ROW_COUNT_TIMEOUT_MS", 10000))
+COUNT_EXACT_MAX_ESTIMATE = int(os.getenv("ROW_COUNT_EXACT_MAX_ESTIMATE", 20000000))
+COUNT_MAX_PENDING = int(os.getenv("ROW_COUNT_MAX_PENDING", 8))
+
+
+def explain_estimate(db, sql):
+    """Optimizer estimate of rows produced by the outermost SELECT, or None."""
+    success, rows, columns = db.execute_query(f"EXPLAIN {sql}")
+    if not success or not columns or 'rows' not in columns:
+        return None
+    id_col, rows_col = columns.index('id'), columns.index('rows')
+    filtered_col = columns.index('filtered') if 'filtered' in columns else None
+    estimate = None
+    for row in rows:
+        # Tables of the outermost SELECT are nested-loop joined: multiply their fan-outs
+        if row[id_col] != 1 or row[rows_col] is None:
+            continue
+        fanout = float(row[rows_col])
+        if filtered_col is not None and row[filtered_col] is not None:
+            fanout *= float(row[filtered_col]) / 100
+        estimate = fanout if estimate is None else estimate * max(fanout, 1.0)
+    return int(round(estimate)) if estimate is not None else None
+
+
+class RowCounter:
+    """Runs count jobs on a small thread pool and records results on export tokens."""
+
+    def __init__(self, db, workers=COUNT_WORKERS, timeout_ms=COUNT_TIMEOUT_MS,
+                 exact_max_estimate=COUNT_EXACT_MAX_ESTIMATE, max_pending=COUNT_MAX_PENDING):
+        self.db = db
+        self.max_pending = max(1, max_pending)
+        self.timeout_ms = timeout_ms
+        self.exact_max_estimate = exact_max_estimate
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='row-count')
+        self._jobs = {}                 # token -> Future, while running
+        self._lock = threading.Lock()
+        self.counts = {'exact': 0, 'estimated': 0, 'failed': 0, 'skipped': 0}
+
+    def start(self, token, sql):
+        """
+        Queue a count for `token` unless one is already running or finished.
+
+        Returns:
+            bool: False if the token is unknown or too many counts are pending
+        """
+        item = get_query(token)
+        if not item:
+            return False
+        with self._lock:
+            if token in self._jobs or 'row_count' in item['meta']:
+                return True
+            if len(self._jobs) >= self.max_pending:
+                self.counts['skipped'] += 1
+                return False
+            update_meta(token, row_count={'status': 'pending', 'rows': None, 'elapsed_ms': 0})
+            future = self._pool.submit(self._count, token, sql.strip().rstrip(';'))
+            self._jobs[token] = future
+        future.add_done_callback(lambda _: self._forget(token))
+        return True
+
+    def _forget(self, token):
+        with self._lock:
+            self._jobs.pop(token, None)
+
+    def _count(self, token, sql):
+        started = time.time()
+        estimate = None
+        result = None
+        try:
+            estimate = explain_estimate(self.db, sql)
+            if estimate is None or estimate <= self.exact_max_estimate:
+                success, rows, _ = self.db.execute_query(
+                    f"SELECT /*+ MAX_EXECUTION_TIME({int(self.timeout_ms)}) */ COUNT(*) FROM ({sql}) AS _count")
+                if success and rows:
+                    result = {'status': 'exact', 'rows': int(rows[0][0])}
+        except Exception as e:
+            print(f"Row count failed: {e}")
+        if result is None:
+            result = {'status': 'estimated' if estimate is not None else 'failed', 'rows': estimate}
+        result['elapsed_ms'] = int((time.time() - started) * 1000)
+
+        with self._lock:
+            self.counts[result['status']] += 1
+        update_meta(token, row_count=result)
+        return result
+
+    def get(self, token):
+        """Recorded count state for `token`, or None if none was started."""
+        item = get_query(token)
+        return item['meta'].get('row_count') if item else None
+
+    def wait(self, token, timeout):
+        """Like get(), but give a running job up to `timeout` seconds to finish."""
+        with self._lock:
+            future = self._jobs.get(token)
+        if future is not None and timeout > 0:
+            try:
+                future.result(timeout=timeout)
+            except FutureTimeout:
+                pass
+            except Exception as e:
+                print(f"Row count failed: {e}")
+        return self.get(token)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.counts, running=len(self._jobs), max_pending=self.max_pending)
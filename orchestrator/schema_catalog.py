@@ -0,0 +1,146 @@
+"""Immutable catalogue of the database schema.
+
+Built once from database_schema.json, the catalogue precomputes everything
+the request paths need from the schema: per-table prompt fragments, the full
+prompt text, case-insensitive name -> table and column -> tables indexes,
+primary keys, FK adjacency and the serialized /api/schema payload with its
+ETag. Request handlers only look things up; nothing walks the table list per
+call. Indexes are exposed as read-only mappings and frozensets, so a
+catalogue can be shared between threads and swapped as a whole.
+"""
+import hashlib
+import json
+from collections import defaultdict
+from types import MappingProxyType
+
+
+def format_table(table):
+    """Compact prompt fragment for one table: types, keys, FKs and ENUM values."""
+    lines = [f"Table: {table['name']}", "Columns:"]
+    for col in table.get('columns', []):
+        info = col.get('type', '')
+        if col.get('primary_key'):
+            info += ", PK"
+        if 'foreign_key' in col:
+            fk = col['foreign_key']
+            info += f", FK -> {fk['table']}({fk['column']})"
+        if 'values' in col:
+            info += f", VALUES: {', '.join(str(v) for v in col['values'])}"
+        lines.append(f"  - {col['name']} ({info})")
+    return '\n'.join(lines) + '\n'
+
+
+def format_schema_for_prompt(schema_data):
+    """Convert JSON schema to human-readable format for LLM prompt"""
+    parts = [f"DATABASE: {schema_data['database']}\n\n", "TABLES AND COLUMNS:\n\n"]
+
+    for table in schema_data['tables']:
+        parts.append(f"Table: {table['name']}\n")
+        parts.append("Columns:\n")
+
+        for col in table['columns']:
+            col_info = f"  - {col['name']} ({col['type']}"
+
+            if col.get('primary_key'):
+                col_info += ", PRIMARY KEY"
+            if col.get('nullable') == False:
+                col_info += ", NOT NULL"
+            if col.get('unique'):
+                col_info += ", UNIQUE"
+            if 'default' in col:
+                col_info += f", DEFAULT {col['default']}"
+            if 'foreign_key' in col:
+                fk = col['foreign_key']
+                col_info += f", FOREIGN KEY -> {fk['table']}({fk['column']})"
+            if 'values' in col:
+                col_info += f", VALUES: {col['values']}"
+
+            col_info += ")"
+            parts.append(col_info + "\n")
+
+        parts.append("\n")
+
+    return ''.join(parts)
+
+
+def _display_text(schema_data):
+    """Plain-text schema listing shown by the frontend."""
+    lines = []
+    for table in schema_data['tables']:
+        lines.append(f"\n{table['name']}:")
+        for col in table['columns']:
+            lines.append(f"  • {col['name']} ({col['type']})")
+    return '\n'.join(lines).strip()
+
+
+class SchemaCatalog:
+    """Read-only view of database_schema.json with precomputed indexes."""
+
+    def __init__(self, schema_data, raw=None):
+        self.database = schema_data.get('database', '')
+        tables = schema_data.get('tables', [])
+
+        # Keyed by the schema's own table names (prompt order preserved)
+        self.tables = MappingProxyType({t['name']: t for t in tables})
+        self.fragments = MappingProxyType({t['name']: format_table(t) for t in tables})
+        self.full_prompt = format_schema_for_prompt(schema_data)
+
+        # Case-insensitive indexes
+        self.table_names = MappingProxyType({t['name'].lower(): t['name'] for t in tables})
+        self.columns = MappingProxyType({
+            t['name'].lower(): tuple(c['name'] for c in t.get('columns', [])) for t in tables
+        })
+        self.column_sets = MappingProxyType({
+            name: frozenset(c.lower() for c in cols) for name, cols in self.columns.items()
+        })
+        tables_by_column = defaultdict(list)
+        for t in tables:
+            for col in t.get('columns', []):
+                tables_by_column[col['name'].lower()].append(t['name'])
+        self.tables_by_column = MappingProxyType({c: tuple(ts) for c, ts in tables_by_column.items()})
+
+        primary_keys = {}
+        for t in tables:
+            pk = [c['name'] for c in t.get('columns', []) if c.get('primary_key')]
+            if len(pk) == 1:
+                primary_keys[t['name'].lower()] = pk[0]
+        self.primary_keys = MappingProxyType(primary_keys)
+
+        # FK adjacency in both directions
+        neighbours = defaultdict(set)
+        for t in tables:
+            for col in t.get('columns', []):
+                target = col.get('foreign_key', {}).get('table')
+                if target and target in self.tables and target != t['name']:
+                    neighbours[t['name']].add(target)
+                    neighbours[target].add(t['name'])
+        self.neighbours = MappingProxyType({name: frozenset(neighbours.get(name, ())) for name in self.tables})
+
+        if raw is None:
+            raw = json.dumps(schema_data, sort_keys=True).encode('utf-8')
+        self.version = hashlib.sha256(raw).hexdigest()[:16]
+
+        # /api/schema body, serialized once
+        self.api_payload = json.dumps({
+            'schema': _display_text(schema_data),
+            'database': self.database,
+            'tables': tables
+        }).encode('utf-8')
+        self.etag = hashlib.sha256(self.api_payload).hexdigest()[:32]
+
+    @classmethod
+    def load(cls, path):
+        """Catalogue for the JSON schema file at `path` (raises FileNotFoundError)."""
+        with open(path, 'rb') as f:
+            raw = f.read()
+        return cls(json.loads(raw), raw=raw)
+
+    def table(self, name):
+        """Schema entry for a table name in any case, or None."""
+        real = self.table_names.get(name.lower())
+        return self.tables[real] if real else None
+
+    def section(self, names):
+        """Prompt schema text listing exactly `names`, in that order."""
+        body = '\n'.join(self.fragments[name] for name in names if name in self.fragments)
+        return f"DATABASE: {self.database}\n\nTABLES AND COLUMNS:\n\n{body}"
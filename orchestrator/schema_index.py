@@ -0,0 +1,178 @@
+"""Lexical retrieval index over the database schema.
+
+Built once from the schema catalogue and used by the prompt builder to send
+only the tables relevant to a question instead of the whole schema. Each table
+is indexed as a weighted bag of terms from its name, column names, ENUM values
+and foreign-key targets and scored against the question with BM25. The top-k
+tables are expanded with their foreign-key neighbours so join paths stay
+available, and the selection is capped by an approximate token budget.
+"""
+import math
+import os
+import re
+from collections import Counter
+
+DEFAULT_TOP_K = int(os.getenv("SCHEMA_TOP_K", 4))
+DEFAULT_TOKEN_BUDGET = int(os.getenv("SCHEMA_TOKEN_BUDGET", 1500))
+
+# Field weights: a hit on the table name says more than a hit on one column
+NAME_WEIGHT = 3.0
+COLUMN_WEIGHT = 1.0
+VALUE_WEIGHT = 1.0
+FK_WEIGHT = 0.5
+
+# Tables scoring below this fraction of the best match are treated as noise
+MIN_RELATIVE_SCORE = 0.35
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+STOPWORDS = {
+    'a', 'all', 'an', 'and', 'are', 'as', 'at', 'by', 'do', 'for', 'from', 'get',
+    'give', 'have', 'how', 'i', 'in', 'is', 'it', 'list', 'me', 'many', 'much',
+    'of', 'on', 'or', 'our', 'show', 'tell', 'than', 'that', 'the', 'their',
+    'there', 'this', 'to', 'we', 'what', 'when', 'where', 'which', 'who', 'with',
+}
+
+# Business vocabulary that never appears literally in the schema
+SYNONYMS = {
+    'customer': ['distributor'],
+    'client': ['distributor'],
+    'revenue': ['invoice', 'amount'],
+    'sale': ['invoice', 'sale'],
+    'sold': ['invoice', 'quantity'],
+    'sell': ['invoice', 'quantity'],
+    'stock': ['current', 'stock', 'inventory'],
+    'truck': ['vehicle'],
+    'lorry': ['vehicle'],
+    'delivery': ['delivered', 'load', 'challan'],
+    'deliver': ['delivered', 'load'],
+    'paid': ['payment'],
+    'unpaid': ['payment', 'invoice'],
+    'return': ['return'],
+    'returned': ['return'],
+    'cancel': ['cancellation'],
+    'cancelled': ['cancellation', 'cancelled'],
+    'item': ['product'],
+}
+
+
+def stem(word):
+    """Very small plural/inflection stripper, enough for schema vocabulary."""
+    if len(word) > 4 and word.endswith('ies'):
+        return word[:-3] + 'y'
+    if len(word) > 4 and word.endswith(('ches', 'shes', 'sses', 'xes')):
+        return word[:-2]
+    if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+        return word[:-1]
+    return word
+
+
+def tokenize(text):
+    """Split identifiers and prose into stemmed lowercase terms."""
+    words = re.findall(r'[a-z0-9]+', (text or '').lower().replace('_', ' '))
+    return [stem(w) for w in words if w not in STOPWORDS]
+
+
+def estimate_tokens(text):
+    """Rough LLM token estimate (~4 characters per token)."""
+    return len(text) // 4 + 1
+
+
+class SchemaIndex:
+    """BM25 index over schema tables with FK-neighbour expansion."""
+
+    def __init__(self, catalog, top_k=DEFAULT_TOP_K, token_budget=DEFAULT_TOKEN_BUDGET):
+        self.catalog = catalog
+        self.database = catalog.database
+        self.top_k = top_k
+        self.token_budget = token_budget
+        # Fragments and FK adjacency are precomputed by the catalogue
+        self.tables = catalog.tables
+        self.fragments = catalog.fragments
+        self.fragment_tokens = {name: estimate_tokens(f) for name, f in self.fragments.items()}
+        self.neighbours = catalog.neighbours
+
+        # Weighted term frequencies per table
+        self.term_freqs = {}
+        for name, table in self.tables.items():
+            tf = Counter()
+            for term in tokenize(name):
+                tf[term] += NAME_WEIGHT
+            for col in table.get('columns', []):
+                for term in tokenize(col['name']):
+                    tf[term] += COLUMN_WEIGHT
+                for value in col.get('values', []):
+                    for term in tokenize(str(value)):
+                        tf[term] += VALUE_WEIGHT
+                if 'foreign_key' in col:
+                    for term in tokenize(col['foreign_key']['table']):
+                        tf[term] += FK_WEIGHT
+            self.term_freqs[name] = tf
+
+        self.doc_lengths = {name: sum(tf.values()) for name, tf in self.term_freqs.items()}
+        self.avg_doc_length = (sum(self.doc_lengths.values()) / len(self.doc_lengths)) if self.doc_lengths else 1.0
+        doc_freq = Counter()
+        for tf in self.term_freqs.values():
+            doc_freq.update(tf.keys())
+        n = len(self.tables)
+        self.idf = {term: math.log(1 + (n - df + 0.5) / (df + 0.5)) for term, df in doc_freq.items()}
+
+        # Fallback order when nothing matches: best-connected tables first
+        self.central_tables = sorted(self.tables, key=lambda t: (-len(self.neighbours[t]), t))
+
+    def query_terms(self, question):
+        terms = tokenize(question)
+        expanded = list(terms)
+        for term in terms:
+            expanded.extend(SYNONYMS.get(term, []))
+        return expanded
+
+    def score(self, question):
+        """BM25 score per table for the question, highest first (zero scores dropped)."""
+        terms = Counter(self.query_terms(question))
+        scores = {}
+        for name, tf in self.term_freqs.items():
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[name] / self.avg_doc_length)
+            total = 0.0
+            for term, qf in terms.items():
+                f = tf.get(term)
+                if f:
+                    total += self.idf[term] * qf * f * (BM25_K1 + 1) / (f + norm)
+            if total > 0:
+                scores[name] = total
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+
+    def select_tables(self, question, top_k=None, token_budget=None):
+        """Names of the tables to include in the prompt, in prompt order."""
+        top_k = self.top_k if top_k is None else top_k
+        token_budget = self.token_budget if token_budget is None else token_budget
+
+        scored = self.score(question)[:top_k]
+        ranked = [name for name, s in scored if s >= scored[0][1] * MIN_RELATIVE_SCORE]
+        if not ranked:
+            ranked = self.central_tables[:top_k]
+
+        candidates = list(ranked)
+        for name in ranked:
+            for neighbour in sorted(self.neighbours[name]):
+                if neighbour not in candidates:
+                    candidates.append(neighbour)
+
+        selected = []
+        used = 0
+        for name in candidates:
+            cost = self.fragment_tokens[name]
+            if selected and used + cost > token_budget:
+                continue
+            selected.append(name)
+            used += cost
+        return selected
+
+    def prompt_section(self, question, top_k=None, token_budget=None):
+        """Schema text for the prompt restricted to the selected tables."""
+        return self.tables_section(self.select_tables(question, top_k=top_k, token_budget=token_budget))
+
+    def tables_section(self, names):
+        """Schema text for the prompt listing exactly `names`."""
+        return self.catalog.section(names)
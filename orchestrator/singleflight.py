@@ -0,0 +1,108 @@
+"""Request coalescing for identical in-flight work.
+
+When several callers ask for the same key at once, only the first (the
+leader) runs the function; the others wait for it and receive the same
+result or exception. Used to collapse concurrent identical questions into
+one LLM generation and one preview query.
+"""
+import asyncio
+import threading
+
+
+class _Call:
+    __slots__ = ('event', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Thread-based single-flight group."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.leaders = 0
+        self.shared = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        Run `fn(*args, **kwargs)` once per concurrent `key`.
+
+        Returns:
+            tuple: (result, shared) where `shared` is True for followers
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.shared += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+                leader = True
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result, False
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'leaders': self.leaders,
+                'shared': self.shared,
+            }
+
+
+class AsyncSingleFlight:
+    """asyncio single-flight group (one event loop)."""
+
+    def __init__(self):
+        self._calls = {}
+        self.leaders = 0
+        self.shared = 0
+
+    async def do(self, key, fn, *args, **kwargs):
+        """Await `fn(*args, **kwargs)` once per concurrent `key`; returns (result, shared)."""
+        future = self._calls.get(key)
+        if future is not None:
+            self.shared += 1
+            # shield so one cancelled follower does not cancel the leader's work
+            return await asyncio.shield(future), True
+
+        self.leaders += 1
+        future = asyncio.ensure_future(fn(*args, **kwargs))
+        self._calls[key] = future
+        future.add_done_callback(lambda f: self._finish(key, f))
+        return await asyncio.shield(future), False
+
+    def _finish(self, key, future):
+        self._calls.pop(key, None)
+        # mark the exception retrieved even if every waiter was cancelled
+        if not future.cancelled():
+            future.exception()
+
+    def stats(self):
+        return {
+            'in_flight': len(self._calls),
+            'leaders': self.leaders,
+            'shared': self.shared,
+        }
@@ -0,0 +1,106 @@
+"""Bounded in-memory cache for LLM-generated SQL.
+
+Maps (normalized prompt, model, context fingerprint) to the SQL text returned
+by the model so repeated dashboard questions skip the Ollama round trip.
+Entries expire after a TTL and the least recently used entry is evicted once
+the cache is full. The context fingerprint covers the schema and business
+context, so editing either one produces new keys and old SQL is never served.
+SQL is only stored once it has run successfully (see `remember`), and the
+entry is dropped when it fails, so a bad generation is not served again.
+"""
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+DEFAULT_TTL = int(os.getenv("SQL_CACHE_TTL", 60 * 60))  # 1 hour
+DEFAULT_MAX_ENTRIES = int(os.getenv("SQL_CACHE_MAX_ENTRIES", 512))
+
+
+def normalize_prompt(text: str) -> str:
+    """Lowercase, collapse whitespace and drop trailing punctuation."""
+    text = re.sub(r'\s+', ' ', (text or '').strip().lower())
+    return text.rstrip(' ?.!;')
+
+
+def fingerprint(*parts: str) -> str:
+    """Stable short hash over the given text parts."""
+    h = hashlib.sha256()
+    for part in parts:
+        h.update((part or '').encode('utf-8'))
+        h.update(b'\x00')
+    return h.hexdigest()[:16]
+
+
+class SQLCache:
+    """Thread-safe LRU cache with per-entry expiry and hit/miss counters."""
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, ttl: int = DEFAULT_TTL):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(prompt: str, model: str, context_fingerprint: str) -> str:
+        return fingerprint(normalize_prompt(prompt), model or '', context_fingerprint or '')
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            value, expires_at = item
+            if expires_at < time.time():
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: str, ttl: Optional[int] = None) -> None:
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def remember(self, key: str, value: str) -> None:
+        """Store SQL that ran successfully; a live entry with the same SQL keeps its expiry."""
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None and item[0] == value and item[1] >= time.time():
+                self._entries.move_to_end(key)
+                return
+        self.set(key, value)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            }
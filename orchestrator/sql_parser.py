@@ -0,0 +1,294 @@
+"""Single-pass SQL tokenizer and light parser.
+
+`tokenize` splits a MySQL statement into words, numbers, literals and
+punctuation the way the server would, tagging each token with its
+parenthesis depth and skipping comments, so `created_at` is one word rather
+than a CREATE keyword and text inside strings is never mistaken for SQL.
+
+`parse` walks the tokens once and records what the rest of the service
+needs: statement kind and count, the base tables read through FROM/JOIN
+(CTE names and derived tables excluded) and the schemas they are qualified
+with, table aliases, qualified column references and a normalized text
+used as a cache key. `bare_column_tokens` finds the unqualified names that
+must be columns. Results are memoized,
+so the validator, the preview LIMIT push-down and the result cache share one
+parse per query.
+"""
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+Token = namedtuple('Token', 'kind value depth start end text')
+
+_TOKEN = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<comment>--(?=\s|$)[^\n]*|\#[^\n]*|/\*.*?(?:\*/|$))
+  | (?P<string>'(?:[^'\\]|\\.|'')*'?|"(?:[^"\\]|\\.|"")*"?)
+  | (?P<quoted>`(?:[^`]|``)*`?)
+  | (?P<number>\d+(?:\.\d*)?(?:[eE][-+]?\d+)?|\.\d+)
+  | (?P<word>[A-Za-z_$@][A-Za-z0-9_$@]*)
+  | (?P<op><=>|<>|!=|<=|>=|:=|\|\||&&|[^\s])
+""", re.VERBOSE | re.DOTALL)
+
+# Words that end a table reference instead of naming its alias
+_NOT_ALIAS = {
+    'WHERE', 'GROUP', 'ORDER', 'HAVING', 'LIMIT', 'JOIN', 'INNER', 'LEFT', 'RIGHT', 'FULL',
+    'CROSS', 'NATURAL', 'STRAIGHT_JOIN', 'OUTER', 'ON', 'USING', 'UNION', 'INTERSECT',
+    'EXCEPT', 'WINDOW', 'FOR', 'LOCK', 'INTO', 'PARTITION', 'USE', 'IGNORE', 'FORCE', 'SET',
+    'LATERAL', 'SELECT', 'FROM', 'AS',
+}
+_QUERY_STARTS = ('SELECT', 'WITH')
+
+# Reserved words, clause keywords, type names and interval units that can
+# appear bare in a SELECT without being column names
+KEYWORDS = frozenset('''
+    ALL AND ANY AS ASC BETWEEN BINARY BOTH BY CASE CAST CHAR CHARACTER COLLATE CONVERT CROSS
+    CURRENT_DATE CURRENT_TIME CURRENT_TIMESTAMP DATE DATETIME DAY DAY_HOUR DAY_MINUTE DAY_SECOND
+    DECIMAL DEFAULT DESC DISTINCT DISTINCTROW DIV ELSE END ESCAPE EXCEPT EXISTS EXPLAIN FALSE
+    FIRST FOLLOWING FOR FORCE FROM FULL GROUP HAVING HOUR HOUR_MINUTE HOUR_SECOND IF IGNORE IN
+    INDEX INNER INT INTEGER INTERSECT INTERVAL IS JOIN KEY LAST LATERAL LEADING LEFT LIKE LIMIT
+    MICROSECOND MINUTE MINUTE_SECOND MOD MONTH NATURAL NOT NULL NULLS OFFSET ON OR ORDER OUTER
+    OVER PARTITION PRECEDING QUARTER RANGE RECURSIVE REGEXP RIGHT RLIKE ROLLUP ROW ROWS SECOND
+    SELECT SEPARATOR SIGNED SOUNDS STRAIGHT_JOIN THEN TIME TIMESTAMP TRAILING TRUE UNBOUNDED
+    UNION UNKNOWN UNSIGNED USE USING WEEK WHEN WHERE WINDOW WITH XOR YEAR YEAR_MONTH CURRENT
+    UTC_DATE UTC_TIME UTC_TIMESTAMP LOCALTIME LOCALTIMESTAMP DOUBLE FLOAT JSON SQL_CALC_FOUND_ROWS
+    HIGH_PRIORITY SQL_NO_CACHE SQL_BIG_RESULT SQL_SMALL_RESULT SQL_BUFFER_RESULT
+    AGAINST BOOLEAN MODE LANGUAGE QUERY EXPANSION SHARE NOWAIT SKIP LOCKED OF
+'''.split())
+
+
+def tokenize(sql, keep_comments=False):
+    """Tokens of `sql` (whitespace dropped); words are uppercased in `value`."""
+    tokens = []
+    depth = 0
+    for match in _TOKEN.finditer(sql):
+        kind = match.lastgroup
+        if kind == 'space' or (kind == 'comment' and not keep_comments):
+            continue
+        text = match.group()
+        if kind == 'op' and text == ')':
+            depth -= 1
+        value = text.upper() if kind == 'word' else text
+        tokens.append(Token(kind, value, depth, match.start(), match.end(), text))
+        if kind == 'op' and text == '(':
+            depth += 1
+    return tokens
+
+
+def identifier(token):
+    """Unquoted name for a word or `quoted` token, else None."""
+    if token.kind == 'word':
+        return token.text
+    if token.kind == 'quoted':
+        return token.text[1:-1].replace('``', '`')
+    return None
+
+
+class ParsedQuery:
+    """What `parse` learned about one SQL string."""
+
+    __slots__ = ('sql', 'tokens', 'comments', 'kind', 'statements', 'tables', 'schemas', 'ctes', 'aliases',
+                 'column_refs', 'words', 'identifiers', 'normalized', 'balanced',
+                 'table_tokens', 'column_ref_tokens', 'reference_tokens')
+
+    @property
+    def top(self):
+        """Tokens outside any parentheses."""
+        return [t for t in self.tokens if t.depth == 0]
+
+    @property
+    def is_query(self):
+        return self.kind in _QUERY_STARTS
+
+
+def _matching_parens(tokens):
+    match = {}
+    stack = []
+    for i, t in enumerate(tokens):
+        if t.kind == 'op' and t.value == '(':
+            stack.append(i)
+        elif t.kind == 'op' and t.value == ')' and stack:
+            match[stack.pop()] = i
+    return match, not stack
+
+
+def _is_op(tokens, i, value):
+    return i < len(tokens) and tokens[i].kind == 'op' and tokens[i].value == value
+
+
+def _alias_at(tokens, i):
+    """(alias, next index) for an optional `[AS] alias` starting at i."""
+    if i < len(tokens) and tokens[i].kind == 'word' and tokens[i].value == 'AS':
+        i += 1
+    if i < len(tokens):
+        t = tokens[i]
+        if t.kind == 'quoted' or (t.kind == 'word' and t.value not in _NOT_ALIAS):
+            return identifier(t).lower(), i + 1
+    return None, i
+
+
+@lru_cache(maxsize=1024)
+def parse(sql):
+    """Parse `sql` (a trailing ';' is ignored). Memoized; treat the result as read-only."""
+    sql = sql.strip().rstrip(';').strip()
+    with_comments = tokenize(sql, keep_comments=True)
+    tokens = [t for t in with_comments if t.kind != 'comment']
+    parens, balanced = _matching_parens(tokens)
+
+    p = ParsedQuery()
+    p.sql = sql
+    p.tokens = tokens
+    p.comments = [t.text for t in with_comments if t.kind == 'comment']
+    p.balanced = balanced
+    p.kind = tokens[0].value if tokens and tokens[0].kind == 'word' else None
+    p.statements = 1 + sum(1 for t in tokens if t.kind == 'op' and t.value == ';') if tokens else 0
+    p.words = frozenset(t.value for t in tokens if t.kind == 'word')
+    p.identifiers = frozenset(identifier(t).lower() for t in tokens if t.kind in ('word', 'quoted'))
+
+    # CTE names: `name AS (` (WITH name AS (...), name2 AS (...))
+    ctes = set()
+    if 'WITH' in p.words:
+        for i in range(len(tokens) - 2):
+            if (tokens[i].kind in ('word', 'quoted') and tokens[i + 1].value == 'AS'
+                    and _is_op(tokens, i + 2, '(') and tokens[i].value not in _NOT_ALIAS):
+                ctes.add(identifier(tokens[i]).lower())
+
+    tables = set()
+    schemas = set()
+    table_tokens = []
+    aliases = {}
+    consumed = set()
+    # query_scope[d]: whether parentheses at depth d hold a (sub)query rather than
+    # function arguments, so EXTRACT(YEAR FROM d) is not read as a table list
+    query_scope = [p.kind in _QUERY_STARTS]
+
+    def table_ref(i):
+        """Parse one table reference at i; returns the index after it."""
+        if i < len(tokens) and tokens[i].kind == 'word' and tokens[i].value == 'LATERAL':
+            i += 1
+        if _is_op(tokens, i, '('):
+            close = parens.get(i)
+            if close is None:
+                return len(tokens)
+            alias, nxt = _alias_at(tokens, close + 1)
+            if alias:
+                aliases[alias] = None
+            return nxt
+        if i >= len(tokens) or identifier(tokens[i]) is None or tokens[i].value in _NOT_ALIAS:
+            return i
+        start = i
+        name = identifier(tokens[i]).lower()
+        if _is_op(tokens, i + 1, '.') and i + 2 < len(tokens) and identifier(tokens[i + 2]) is not None:
+            # schema.table: the schema is kept so the validator can check it
+            schemas.add(name)
+            i += 2
+            name = identifier(tokens[i]).lower()
+        consumed.update(range(start, i + 1))
+        if name in ctes:
+            aliases[name] = None
+        else:
+            tables.add(name)
+            table_tokens.append(i)
+            aliases[name] = name
+        alias, nxt = _alias_at(tokens, i + 1)
+        if alias:
+            aliases[alias] = None if name in ctes else name
+            consumed.update(range(i + 1, nxt))
+        return nxt
+
+    i = 0
+    while i < len(tokens):
+        t = tokens[i]
+        if t.kind == 'op' and t.value == '(':
+            nxt = tokens[i + 1] if i + 1 < len(tokens) else None
+            scope_is_query = nxt is not None and nxt.kind == 'word' and nxt.value in _QUERY_STARTS
+            del query_scope[t.depth + 1:]
+            query_scope.append(scope_is_query)
+        elif t.kind == 'word' and t.value in ('FROM', 'JOIN', 'STRAIGHT_JOIN') and \
+                t.depth < len(query_scope) and query_scope[t.depth]:
+            # derived tables are not skipped: the loop goes on into their parentheses
+            j = table_ref(i + 1)
+            if t.value == 'FROM':
+                while _is_op(tokens, j, ',') and tokens[j].depth == t.depth:
+                    j = table_ref(j + 1)
+        i += 1
+
+    # alias.column references outside the table references themselves
+    column_refs = []
+    column_ref_tokens = []
+    for i in range(len(tokens) - 2):
+        if i in consumed or not _is_op(tokens, i + 1, '.'):
+            continue
+        if i > 0 and _is_op(tokens, i - 1, '.'):
+            continue
+        qualifier, column = identifier(tokens[i]), identifier(tokens[i + 2])
+        if qualifier is None or column is None or _is_op(tokens, i + 3, '.') or _is_op(tokens, i + 3, '('):
+            continue
+        column_refs.append((qualifier.lower(), column.lower()))
+        column_ref_tokens.append(i + 2)
+
+    p.tables = frozenset(tables)
+    p.schemas = frozenset(schemas)
+    p.ctes = frozenset(ctes)
+    p.aliases = aliases
+    p.column_refs = tuple(column_refs)
+    # token indices: base-table names, columns of column_refs, and everything
+    # that names a table or alias (including qualifiers)
+    p.table_tokens = tuple(table_tokens)
+    p.column_ref_tokens = tuple(column_ref_tokens)
+    p.reference_tokens = frozenset(consumed | set(column_ref_tokens) | {i - 2 for i in column_ref_tokens})
+
+    # Words lowercased, literals verbatim, one space wherever the source had a gap
+    parts = []
+    previous_end = None
+    for t in tokens:
+        if previous_end is not None and t.start > previous_end:
+            parts.append(' ')
+        parts.append(t.text.lower() if t.kind == 'word' else t.text)
+        previous_end = t.end
+    p.normalized = ''.join(parts)
+    return p
+
+
+def output_aliases(tokens):
+    """Names introduced by `AS name` or an implicit `expr name` alias."""
+    aliases = set()
+    for i, t in enumerate(tokens):
+        if identifier(t) is None or i == 0:
+            continue
+        prev = tokens[i - 1]
+        nxt = tokens[i + 1] if i + 1 < len(tokens) else None
+        if prev.kind == 'word' and prev.value == 'AS':
+            aliases.add(identifier(t).lower())
+        elif (nxt is not None and (nxt.value == ',' or nxt.value == 'FROM')
+              and (prev.value == ')' or prev.kind in ('number', 'string', 'quoted')
+                   or (prev.kind == 'word' and prev.value not in KEYWORDS))):
+            aliases.add(identifier(t).lower())
+    return aliases
+
+
+def bare_column_tokens(parsed):
+    """
+    Indices of unqualified names in `parsed` that can only be column names:
+    not keywords, function names, tables, aliases, CTEs, output aliases,
+    @variables, character sets or collations.
+    """
+    tokens = parsed.tokens
+    known = set(parsed.aliases) | set(parsed.ctes) | output_aliases(tokens)
+    found = []
+    for i, t in enumerate(tokens):
+        if i in parsed.reference_tokens or t.kind not in ('word', 'quoted') or \
+                (t.kind == 'word' and t.value in KEYWORDS):
+            continue
+        nxt = tokens[i + 1] if i + 1 < len(tokens) else None
+        prev = tokens[i - 1] if i > 0 else None
+        if nxt is not None and (nxt.value in ('(', '.') or (t.kind == 'word' and nxt.kind == 'string')):
+            # function call, qualifier or charset introducer (_utf8mb4'...')
+            continue
+        if prev is not None and (prev.value == '.' or (prev.kind == 'word' and prev.value in ('COLLATE', 'USING'))):
+            continue
+        name = identifier(t).lower()
+        if name in known or name.startswith('@'):
+            continue
+        found.append(i)
+    return found
@@ -0,0 +1,159 @@
+"""Schema-aware repair of generated SQL.
+
+Two steps, cheapest first:
+
+1. `fix_identifiers` checks table names, alias.column references and bare
+   column names against the database_schema.json catalogue and replaces an
+   unknown identifier with its closest catalogue name (difflib ratio of at
+   least SQL_REPAIR_FUZZY_CUTOFF, and only when the best match is unique),
+   e.g. ``invoice_dt`` -> ``invoice_date``. No model call is involved.
+2. When the query still fails validation or MySQL rejects it with a schema or
+   syntax error, `repair_prompt` builds a prompt holding the failed SQL, the
+   exact error and only the tables involved, so the model can correct it.
+   The caller bounds this with SQL_REPAIR_MAX_ATTEMPTS.
+"""
+import difflib
+import os
+import re
+import threading
+
+from sql_parser import bare_column_tokens, identifier, parse
+
+FUZZY_CUTOFF = float(os.getenv("SQL_REPAIR_FUZZY_CUTOFF", 0.8))
+MAX_ATTEMPTS = int(os.getenv("SQL_REPAIR_MAX_ATTEMPTS", 2))
+
+# MySQL errors a corrected query can fix: bad field/table, ambiguous column,
+# syntax, misuse of aggregates, ONLY_FULL_GROUP_BY
+_REPAIRABLE_CODES = {1054, 1146, 1052, 1064, 1111, 1055, 1140}
+_REPAIRABLE_MESSAGES = ('Unknown table', 'Unknown column')
+
+
+def is_repairable(error):
+    """Whether an execution or validation error is worth a repair prompt."""
+    text = str(error)
+    match = re.match(r'\((\d+),', text)
+    if match:
+        return int(match.group(1)) in _REPAIRABLE_CODES
+    return any(message in text for message in _REPAIRABLE_MESSAGES)
+
+
+def _closest(name, candidates, cutoff):
+    """Unique best fuzzy match for `name`, or None."""
+    scored = sorted(((difflib.SequenceMatcher(None, name, c).ratio(), c) for c in candidates), reverse=True)
+    if not scored or scored[0][0] < cutoff:
+        return None
+    if len(scored) > 1 and scored[1][0] == scored[0][0]:
+        return None
+    return scored[0][1]
+
+
+class SQLRepairer:
+    """Fixes identifiers against the schema catalogue and builds repair prompts."""
+
+    def __init__(self, catalog, cutoff=FUZZY_CUTOFF):
+        self.cutoff = cutoff
+        # Replaced as a whole when the schema is reloaded
+        self.catalog = catalog
+        self._lock = threading.Lock()
+        self.identifier_fixes = 0
+        self.reprompts = 0
+        self.reprompt_successes = 0
+
+    def fix_identifiers(self, sql):
+        """
+        Replace unknown identifiers with their closest catalogue names.
+
+        Returns:
+            tuple: (sql, list of {"from": ..., "to": ...} replacements)
+        """
+        catalog = self.catalog
+        if catalog is None or not catalog.columns:
+            return sql, []
+        columns_by_table, column_sets, table_names = catalog.columns, catalog.column_sets, catalog.table_names
+        parsed = parse(sql)
+        if not parsed.is_query:
+            return sql, []
+        tokens = parsed.tokens
+        edits = {}        # token index -> replacement name
+
+        # Tables first: column checks below depend on them
+        aliases = dict(parsed.aliases)
+        for index in parsed.table_tokens:
+            name = identifier(tokens[index]).lower()
+            if name in columns_by_table:
+                continue
+            match = _closest(name, table_names, self.cutoff)
+            if match:
+                edits[index] = table_names[match]
+                for alias, table in aliases.items():
+                    if table == name:
+                        aliases[alias] = match
+
+        for (qualifier, column), index in zip(parsed.column_refs, parsed.column_ref_tokens):
+            table = aliases.get(qualifier)
+            columns = columns_by_table.get(table) if table else None
+            if not columns or column in column_sets[table]:
+                continue
+            match = _closest(column, [c.lower() for c in columns], self.cutoff)
+            if match:
+                edits[index] = next(c for c in columns if c.lower() == match)
+
+        # Bare column names, matched against every table the query reads
+        referenced = [aliases[a] for a in aliases if aliases[a]]
+        columns = {c.lower(): c for t in referenced for c in columns_by_table.get(t, ())}
+        if columns:
+            for i in bare_column_tokens(parsed):
+                name = identifier(tokens[i]).lower()
+                if i in edits or name in columns:
+                    continue
+                match = _closest(name, columns, self.cutoff)
+                if match:
+                    edits[i] = columns[match]
+
+        if not edits:
+            return sql, []
+
+        text = parsed.sql
+        parts = []
+        fixes = []
+        position = 0
+        for index in sorted(edits):
+            t = tokens[index]
+            replacement = f"`{edits[index]}`" if t.kind == 'quoted' else edits[index]
+            parts.append(text[position:t.start])
+            parts.append(replacement)
+            position = t.end
+            fixes.append({'from': identifier(t), 'to': edits[index]})
+        parts.append(text[position:])
+        with self._lock:
+            self.identifier_fixes += len(fixes)
+        return ''.join(parts), fixes
+
+    def repair_prompt(self, question, sql, error, schema_section):
+        """Prompt asking the model to correct `sql` given the database `error`."""
+        with self._lock:
+            self.reprompts += 1
+        return (
+            "You are a SQL expert for DataSense.\n\n"
+            f"{schema_section}\n"
+            "The SQL query below was written for the user question but failed.\n\n"
+            f"User question: {question}\n\n"
+            f"Failed SQL:\n{sql}\n\n"
+            f"Error: {error}\n\n"
+            "Rules:\n"
+            "1) Only use tables/columns present above.\n"
+            "2) Return ONLY the corrected SQL query, no explanation.\n\n"
+            "SQL:"
+        )
+
+    def record_success(self):
+        with self._lock:
+            self.reprompt_successes += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'identifier_fixes': self.identifier_fixes,
+                'reprompts': self.reprompts,
+                'reprompt_successes': self.reprompt_successes,
+            }
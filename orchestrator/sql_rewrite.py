@@ -0,0 +1,80 @@
+"""Preview LIMIT push-down.
+
+`push_limit` caps a preview query at `limit` rows, working from the
+statement as parsed by sql_parser:
+
+* merged   - the outermost SELECT already ends in a numeric LIMIT; its row
+             count is lowered to min(existing, limit), any OFFSET is kept
+* appended - a plain outermost SELECT gets ``LIMIT n`` added, letting MySQL
+             stop early and use a top-N sort for ORDER BY
+* wrapped  - anything else (UNION, FOR UPDATE, placeholders, ...) falls back
+             to ``SELECT * FROM (<q>) AS _sub LIMIT n``
+* none     - SHOW / DESCRIBE / EXPLAIN cannot take a LIMIT or be wrapped; the
+             caller caps them when fetching
+"""
+from sql_parser import parse
+
+# Clauses after which LIMIT cannot simply be appended
+_SET_OPERATORS = {'UNION', 'INTERSECT', 'EXCEPT'}
+_TRAILING_LOCKS = {'FOR', 'LOCK', 'INTO', 'PROCEDURE'}
+_UNLIMITABLE = {'SHOW', 'DESCRIBE', 'DESC', 'EXPLAIN'}
+
+
+def _trailing_limit(top):
+    """(limit token index, offset, count) for a numeric top-level LIMIT ending the statement."""
+    for i in range(len(top) - 1, -1, -1):
+        if top[i].kind == 'word' and top[i].value == 'LIMIT':
+            args = top[i + 1:]
+            values = [t.value for t in args]
+            if len(args) == 1 and args[0].kind == 'number':
+                return i, None, int(values[0])
+            if len(args) == 3 and values[1] == ',' and args[0].kind == args[2].kind == 'number':
+                return i, int(values[0]), int(values[2])
+            if len(args) == 3 and values[1].upper() == 'OFFSET' and args[0].kind == args[2].kind == 'number':
+                return i, int(values[2]), int(values[0])
+            return i, None, None
+    return None
+
+
+def wrap_limit(sql, limit):
+    return f"SELECT * FROM ({sql}\n) AS _sub LIMIT {int(limit)}"
+
+
+def push_limit(sql, limit):
+    """
+    Rewrite `sql` so it returns at most `limit` rows.
+
+    Returns:
+        tuple: (rewritten sql, strategy) with strategy 'merged', 'appended',
+               'wrapped' or 'none'
+    """
+    parsed = parse(sql)
+    sql = parsed.sql
+    limit = int(limit)
+    tokens = parsed.tokens
+    top = parsed.top
+
+    if top and top[0].value in _UNLIMITABLE:
+        return sql, 'none'
+
+    if (not top or top[0].value not in ('SELECT', 'WITH')
+            or parsed.statements > 1
+            or any(t.kind == 'op' and t.value == '?' for t in tokens)
+            or any(t.kind == 'word' and t.value in _SET_OPERATORS for t in top)
+            or any(t.kind == 'word' and t.value in _TRAILING_LOCKS for t in top[1:])
+            or not parsed.balanced):
+        return wrap_limit(sql, limit), 'wrapped'
+
+    found = _trailing_limit(top)
+    if found is None:
+        # cut at the last token so a trailing comment cannot swallow the LIMIT
+        return f"{sql[:tokens[-1].end]} LIMIT {limit}", 'appended'
+
+    index, offset, count = found
+    if count is None:
+        return wrap_limit(sql, limit), 'wrapped'
+    head = sql[:top[index].start].rstrip()
+    count = min(count, limit)
+    if offset:
+        return f"{head} LIMIT {offset}, {count}", 'merged'
+    return f"{head} LIMIT {count}", 'merged'
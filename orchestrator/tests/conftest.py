@@ -0,0 +1,11 @@
+"""Make the flat orchestrator modules importable and run from the orchestrator directory."""
+import os
+import sys
+
+ORCHESTRATOR_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ORCHESTRATOR_DIR)
+# importing app must not start the context reloader or backend probe threads
+os.environ.setdefault('CONTEXT_RELOAD_INTERVAL', '0')
+os.environ.setdefault('OLLAMA_PROBE_INTERVAL', '0')
+# modules load database_schema.json and training/ relative to the working directory
+os.chdir(ORCHESTRATOR_DIR)
@@ -0,0 +1,64 @@
+import pytest
+
+app = pytest.importorskip('app')
+
+QUESTION = 'zzqx frobnicate the widgets'
+SQL = 'SELECT * FROM distributors'
+
+
+@pytest.fixture
+def fake_backend(monkeypatch):
+    """LLM always answering SQL; the preview fails until `backend['ok']` is set."""
+    backend = {'calls': 0, 'ok': False}
+
+    def generate(model, prompt):
+        backend['calls'] += 1
+        return SQL
+
+    def stream(model, prompt):
+        backend['calls'] += 1
+        yield SQL + ';'
+
+    def run_preview(cleaned_query, use_cache=True):
+        if backend['ok']:
+            return True, [(1, 'Delta')], ['distributor_id', 'name']
+        return False, 'Lock wait timeout exceeded; try restarting transaction', None
+
+    monkeypatch.setattr(app.ollama, 'generate', generate)
+    monkeypatch.setattr(app.ollama, 'stream', stream)
+    monkeypatch.setattr(app, 'run_preview', run_preview)
+    app.sql_cache.clear()
+    yield backend
+    app.sql_cache.clear()
+
+
+def ask(client):
+    return client.post('/api/query', json={'prompt': QUESTION})
+
+
+def test_failed_query_is_regenerated_on_next_ask(fake_backend):
+    client = app.app.test_client()
+    assert ask(client).status_code == 400
+    assert ask(client).status_code == 400
+    assert fake_backend['calls'] == 2
+
+    fake_backend['ok'] = True
+    assert ask(client).status_code == 200
+    assert ask(client).status_code == 200
+    # the working SQL is cached once it ran
+    assert fake_backend['calls'] == 3
+
+
+def test_failed_stream_is_regenerated_on_next_ask(fake_backend):
+    client = app.app.test_client()
+    body = client.post('/api/query/stream', json={'prompt': QUESTION}).get_data(as_text=True)
+    assert 'event: error' in body
+    client.post('/api/query/stream', json={'prompt': QUESTION}).get_data()
+    assert fake_backend['calls'] == 2
+
+    fake_backend['ok'] = True
+    body = client.post('/api/query/stream', json={'prompt': QUESTION}).get_data(as_text=True)
+    assert 'event: done' in body
+    body = client.post('/api/query/stream', json={'prompt': QUESTION}).get_data(as_text=True)
+    assert '"cached": true' in body
+    assert fake_backend['calls'] == 3
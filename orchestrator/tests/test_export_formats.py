@@ -0,0 +1,111 @@
+import io
+from decimal import Decimal
+
+import pytest
+
+from export_formats import TRUNCATED_KEY, arrow_type, prime, stream_export
+
+pa = pytest.importorskip('pyarrow')
+pq = pytest.importorskip('pyarrow.parquet')
+
+# DB-API description entries as pymysql reports them: (name, type_code, None, length, length, scale, null_ok)
+DECIMAL_65_30 = ('amount', 246, None, 67, 67, 30, True)
+DECIMAL_10_2 = ('price', 246, None, 12, 12, 2, True)
+BIGINT = ('id', 8, None, 20, 20, 0, False)
+
+
+def test_decimal_types_cover_the_column_precision():
+    assert arrow_type(pa, DECIMAL_10_2) == pa.decimal128(12, 2)
+    assert arrow_type(pa, DECIMAL_65_30) == pa.decimal256(67, 30)
+    assert arrow_type(pa, ('x', 246, None, 90, 90, 0, True)) == pa.string()
+
+
+def test_bigint_unsigned_maps_to_uint64():
+    assert arrow_type(pa, BIGINT) == pa.int64()
+    assert arrow_type(pa, BIGINT, unsigned=True) == pa.uint64()
+    assert arrow_type(pa, ('n', 3, None, 10, 10, 0, False), unsigned=True) == pa.int64()
+
+
+@pytest.mark.parametrize('fmt', ['arrow', 'parquet'])
+def test_wide_values_round_trip(fmt):
+    wide = Decimal('9' * 35 + '.' + '1' * 30)
+    rows = [(wide, 2 ** 64 - 1), (Decimal('1.5'), 7)]
+    body = b''.join(stream_export(fmt, ['amount', 'id'], [DECIMAL_65_30, BIGINT], [rows], 100,
+                                  unsigned=(False, True)))
+    if fmt == 'arrow':
+        table = pa.ipc.open_stream(body).read_all()
+    else:
+        table = pq.read_table(io.BytesIO(body))
+    assert table.column('amount').to_pylist()[0] == wide
+    assert table.column('id').to_pylist() == [2 ** 64 - 1, 7]
+
+
+def test_prime_raises_before_the_first_chunk():
+    def failing():
+        raise ValueError('bad schema')
+        yield b''
+
+    with pytest.raises(ValueError):
+        prime(failing())
+
+
+def test_prime_replays_and_closes():
+    closed = []
+
+    def chunks():
+        try:
+            yield b'a'
+            yield b'b'
+        finally:
+            closed.append(True)
+
+    primed = prime(chunks())
+    assert next(primed) == b'a'
+    primed.close()
+    assert closed == [True]
+
+
+def _export(fmt, rows, max_rows):
+    return b''.join(stream_export(fmt, ['price'], [DECIMAL_10_2], [rows], max_rows))
+
+
+ROWS = [(Decimal('1.50'),), (Decimal('2.25'),), (Decimal('3.00'),)]
+
+
+def test_csv_and_ndjson_mark_truncation():
+    assert b'Export truncated: more than 2 rows' in _export('csv', ROWS, 2)
+    assert b'"_truncated":true' in _export('ndjson', ROWS, 2)
+    assert b'truncated' not in _export('csv', ROWS, 3)
+
+
+def _parquet_metadata(body):
+    return pq.ParquetFile(io.BytesIO(body)).metadata.metadata or {}
+
+
+def test_parquet_marks_truncation():
+    assert _parquet_metadata(_export('parquet', ROWS, 2))[TRUNCATED_KEY.encode()] == b'2'
+    assert TRUNCATED_KEY.encode() not in _parquet_metadata(_export('parquet', ROWS, 3))
+
+
+def _arrow_batches(body):
+    reader = pa.ipc.open_stream(body)
+    batches = []
+    while True:
+        try:
+            batches.append(reader.read_next_batch_with_custom_metadata())
+        except StopIteration:
+            return batches
+
+
+def test_arrow_marks_truncation():
+    batches = _arrow_batches(_export('arrow', ROWS, 2))
+    assert sum(b.batch.num_rows for b in batches) == 2
+    last = batches[-1]
+    assert last.batch.num_rows == 0
+    assert last.custom_metadata[TRUNCATED_KEY.encode()] == b'2'
+
+
+def test_complete_arrow_has_no_marker():
+    batches = _arrow_batches(_export('arrow', ROWS, 3))
+    assert sum(b.batch.num_rows for b in batches) == 3
+    assert all(not b.custom_metadata for b in batches)
@@ -0,0 +1,83 @@
+import pytest
+
+from fast_path import FastPathIndex, FastPathStats, build_template, load_examples
+from query_validator import QueryValidator
+from schema_catalog import SchemaCatalog
+
+ORDERS_SQL = ("SELECT o.distributor_id, COUNT(*) AS total_orders FROM orders o JOIN distributors d "
+              "ON o.distributor_id = d.distributor_id WHERE d.name = 'Delta Ice Creams' GROUP BY o.distributor_id;")
+
+
+@pytest.fixture(scope='module')
+def index():
+    catalog = SchemaCatalog.load('database_schema.json')
+    return FastPathIndex.from_examples(load_examples(validator=QueryValidator(catalog)))
+
+
+@pytest.fixture
+def small_index():
+    return FastPathIndex.from_examples([
+        ("Count total orders for Delta Ice Creams", ORDERS_SQL),
+        ("Count total orders for Gulf Distributors", ORDERS_SQL.replace('Delta Ice Creams', 'Gulf Distributors')),
+        ("Show all distributors", "SELECT * FROM distributors;"),
+        ("Which vehicles had load plans in October 2024",
+         "SELECT vehicle_id FROM load_plans WHERE plan_date BETWEEN '2024-10-01' AND '2024-10-31';"),
+    ])
+
+
+def test_known_name_fills_the_template(small_index):
+    match, score = small_index.match("Count total orders for Gulf Distributors?")
+    assert score == 1.0 and match.exact
+    assert "d.name = 'Gulf Distributors'" in match.sql
+
+
+def test_quoted_name_fills_the_template(small_index):
+    match, _ = small_index.match("Count total orders for 'O Brien Foods'")
+    assert "d.name = 'O Brien Foods'" in match.sql
+
+
+def test_filler_words_are_tolerated(small_index):
+    match, _ = small_index.match("show me all distributors please")
+    assert match is not None and not match.exact
+    assert match.sql == "SELECT * FROM distributors;"
+
+
+def test_year_slot_rewrites_both_dates(small_index):
+    match, _ = small_index.match("Which vehicles had load plans in October 2025")
+    assert "'2025-10-01' AND '2025-10-31'" in match.sql
+
+
+@pytest.mark.parametrize('question', [
+    # trailing qualifier must not end up in the name slot
+    "Count total orders for Delta Ice Creams in 2024",
+    # unknown, unquoted names are never trusted
+    "Count total orders for Zeta Foods",
+    "Count total orders for each distributor",
+    # quoted literal with more text in the slot
+    "Count total orders for 'Delta' and 'Gulf'",
+    # content word differs from the template
+    "Which vehicles had load plans in November 2024",
+    "show all distributors in Dhaka",
+    "What is the weather",
+])
+def test_falls_back_to_the_llm(small_index, question):
+    match, _ = small_index.match(question)
+    assert match is None
+
+
+def test_malformed_examples_are_skipped():
+    assert build_template("Show active distributors", "SELECT * FROM distributors WHERE x = 1 WHERE is_active = 1") is None
+    assert build_template("Drop it", "SELECT 1; DROP TABLE distributors") is None
+
+
+def test_dataset_index(index):
+    assert index.templates
+    assert index.match("Count total orders for Delta Ice Creams in 2024")[0] is None
+
+
+def test_stats_count_hits_and_misses(small_index):
+    stats = FastPathStats()
+    for question in ("Show all distributors", "show me all distributors please", "What is the weather"):
+        stats.record(*small_index.match(question), small_index.threshold)
+    assert stats.stats() == {'lookups': 3, 'hits': 2, 'exact_hits': 1, 'misses': 1, 'near_misses': 0,
+                             'hit_rate': 0.6667}
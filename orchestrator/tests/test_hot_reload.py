@@ -0,0 +1,35 @@
+import os
+
+from hot_reload import HotReloader
+
+
+def make_reloader(path, **kwargs):
+    def build():
+        with open(path) as f:
+            return f.read()
+    return HotReloader(build, lambda: [str(path)], interval=0, **kwargs)
+
+
+def test_missing_file_keeps_previous_snapshot(tmp_path):
+    path = tmp_path / 'schema.json'
+    path.write_text('v1')
+    reloader = make_reloader(path)
+
+    os.remove(path)
+    assert reloader.check() is False
+    assert reloader.current == 'v1'
+    assert reloader.failures == 1
+
+    path.write_text('v2')
+    assert reloader.check() is True
+    assert reloader.current == 'v2'
+
+
+def test_initial_snapshot_skips_first_build(tmp_path):
+    path = tmp_path / 'schema.json'
+    reloader = make_reloader(path, initial='fallback')
+    assert reloader.current == 'fallback'
+
+    path.write_text('v1')
+    assert reloader.check() is True
+    assert reloader.current == 'v1'
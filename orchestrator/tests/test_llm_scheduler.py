@@ -0,0 +1,36 @@
+import asyncio
+
+import pytest
+
+from llm_scheduler import ModelScheduler
+
+
+def test_idle_model_state_is_bounded():
+    scheduler = ModelScheduler(concurrency=1, max_models=4)
+    for i in range(100):
+        with scheduler.slot(f'model-{i}'):
+            pass
+    assert len(scheduler._counters) <= 4
+    assert len(scheduler._waits) <= 4
+    assert len(scheduler._service) <= 4
+    assert 'model-99' in scheduler.stats()['models']
+
+
+def test_cancelled_waiter_records_no_service_sample():
+    scheduler = ModelScheduler(concurrency=1)
+    scheduler._service['m'] = 5.0
+
+    async def main():
+        holder = scheduler.aslot('m')
+        await holder.__aenter__()
+        waiter = asyncio.ensure_future(scheduler.aslot('m').__aenter__())
+        await asyncio.sleep(0.01)
+        await holder.__aexit__(None, None, None)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+
+    asyncio.run(main())
+    assert scheduler.stats()['models']['m']['running'] == 0
+    # only the holder's (short) generation was sampled
+    assert scheduler._service['m'] > 3.9
@@ -0,0 +1,94 @@
+import pytest
+
+from query_validator import QueryValidator
+from schema_catalog import SchemaCatalog
+from sql_rewrite import push_limit
+
+clean = QueryValidator.clean_query
+
+
+def test_line_comment_does_not_swallow_the_next_line():
+    sql = clean("SELECT * FROM invoices -- all\nWHERE status='pending';")
+    assert sql == "SELECT * FROM invoices WHERE status='pending'"
+
+
+def test_hash_and_block_comments_are_dropped():
+    assert clean("SELECT a # first column\n, b FROM t") == "SELECT a , b FROM t"
+    assert clean("SELECT a/* no space */FROM t") == "SELECT a FROM t"
+
+
+def test_multiline_query_is_joined_without_touching_strings():
+    sql = clean("SELECT name,\n       'a  b' AS label\nFROM products\n\tWHERE  price > 10 ;")
+    assert sql == "SELECT name, 'a  b' AS label FROM products WHERE price > 10"
+
+
+def test_comment_markers_inside_strings_are_kept():
+    assert clean("SELECT * FROM t WHERE note = '-- x' -- y") == "SELECT * FROM t WHERE note = '-- x'"
+
+
+def test_code_fence_is_removed():
+    assert clean("```sql\nSELECT 1\n-- done\n```") == "SELECT 1"
+
+
+def test_executable_comment_is_kept_and_rejected():
+    sql = clean("SELECT /*!50000 SLEEP(5) */ 1")
+    assert '/*!' in sql
+    assert QueryValidator().is_safe_query(sql)[0] is False
+
+
+def test_cte_is_accepted():
+    sql = clean("WITH recent AS (\n  SELECT * FROM invoices -- last month\n)\nSELECT * FROM recent;")
+    assert sql == "WITH recent AS ( SELECT * FROM invoices ) SELECT * FROM recent"
+    assert QueryValidator().is_safe_query(sql)[0] is True
+
+
+def test_limit_push_down_keeps_filters_after_comments():
+    sql = clean("SELECT * FROM invoices -- only pending ones\nWHERE status = 'pending'\nORDER BY invoice_date")
+    limited, strategy = push_limit(sql, 51)
+    assert strategy == 'appended'
+    assert limited == "SELECT * FROM invoices WHERE status = 'pending' ORDER BY invoice_date LIMIT 51"
+
+
+@pytest.fixture(scope='module')
+def validator():
+    return QueryValidator(SchemaCatalog.load('database_schema.json'), database='datasense')
+
+
+@pytest.mark.parametrize('sql', [
+    "SELECT * FROM mysql.user",
+    "SELECT * FROM other_db.products",
+    "SELECT * FROM `mysql`.`user`",
+    "SELECT p.name FROM products p JOIN information_schema.tables t ON t.table_name = p.name",
+])
+def test_other_schemas_are_rejected(validator, sql):
+    ok, message = validator.is_safe_query(sql)
+    assert not ok and 'datasense database' in message
+
+
+def test_configured_schema_is_accepted(validator):
+    assert validator.is_safe_query("SELECT name FROM datasense.products")[0]
+
+
+@pytest.mark.parametrize('sql', [
+    "SELECT bogus FROM products",
+    "SELECT `password` FROM products",
+    "SELECT name FROM products WHERE secret = 1",
+    "SELECT p.name FROM products p JOIN order_items oi ON p.product_id = oi.product_id ORDER BY bogus",
+])
+def test_unknown_unqualified_columns_are_rejected(validator, sql):
+    ok, message = validator.is_safe_query(sql)
+    assert not ok and 'Unknown column' in message
+
+
+@pytest.mark.parametrize('sql', [
+    "SELECT name, COUNT(*) total FROM distributors GROUP BY name ORDER BY total DESC",
+    "SELECT CAST(total_amount AS DECIMAL(10,2)) FROM orders WHERE order_date >= DATE_SUB(CURDATE(), INTERVAL 6 MONTH)",
+    "SELECT EXTRACT(YEAR FROM order_date) y, CONVERT(notes USING utf8mb4) FROM orders",
+    "SELECT o.order_id FROM orders o JOIN order_items USING (order_id) WHERE quantity > 2",
+    "SELECT name FROM products WHERE name COLLATE utf8mb4_bin LIKE _utf8mb4'A%'",
+    # CTE and derived-table columns are not catalogued
+    "WITH t AS (SELECT distributor_id, COUNT(*) AS c FROM orders GROUP BY distributor_id) SELECT c FROM t",
+    "SELECT x FROM (SELECT order_id AS x FROM orders) d",
+])
+def test_known_and_uncatalogued_columns_are_accepted(validator, sql):
+    assert validator.is_safe_query(sql) == (True, "✅ Query is safe to execute.")
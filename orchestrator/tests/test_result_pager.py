@@ -0,0 +1,31 @@
+from result_pager import ResultPager, decode_cursor
+
+SQL = "SELECT * FROM distributors WHERE name LIKE '%ice%'"
+
+
+class FakeDB:
+    """Records the SQL as MySQL would receive it: pymysql %-formats only when params are given."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.sent = []
+
+    def execute_query(self, query, params=None):
+        if params is not None:
+            query = query % tuple(repr(p) for p in params)
+        self.sent.append(query)
+        return True, self.rows, ['distributor_id', 'name']
+
+
+def test_first_keyset_page_keeps_like_literal():
+    db = FakeDB([(1, 'Delta Ice'), (2, 'Polar Ice')])
+    pager = ResultPager(db, {'distributors': 'distributor_id'})
+    ok, page = pager.page('token', SQL, page_size=1)
+    assert ok and page['pagination'] == 'keyset'
+    assert "LIKE '%ice%'" in db.sent[0]
+    assert '%%' not in db.sent[0]
+
+    ok, _ = pager.page('token', SQL, cursor=page['next_cursor'], page_size=1)
+    assert ok
+    assert "LIKE '%ice%'" in db.sent[1]
+    assert decode_cursor(page['next_cursor']) == ('keyset', 1)